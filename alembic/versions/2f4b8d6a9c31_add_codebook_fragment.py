@@ -0,0 +1,36 @@
+"""Add precomputed codebook fragments
+
+Revision ID: 2f4b8d6a9c31
+Revises: 5c9a7e3d2b18
+Create Date: 2026-10-17 15:08:44.902613
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2f4b8d6a9c31'
+down_revision = '5c9a7e3d2b18'
+branch_labels = None
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import JSONB
+
+
+def upgrade():
+    op.create_table(
+        'codebook_fragment',
+        sa.Column('id', sa.BigInteger, primary_key=True),
+        sa.Column('schema_id', sa.Integer, nullable=False),
+        sa.Column('fingerprint', sa.String, nullable=False),
+        sa.Column('rows', JSONB, nullable=False),
+        sa.Column('create_date', sa.DateTime, nullable=False),
+        sa.ForeignKeyConstraint(
+            ['schema_id'], ['schema.id'],
+            name='fk_codebook_fragment_schema_id',
+            ondelete='CASCADE'),
+        sa.UniqueConstraint(
+            'schema_id', name='uq_codebook_fragment_schema_id'))
+
+
+def downgrade():
+    op.drop_table('codebook_fragment')
@@ -0,0 +1,32 @@
+"""Add export backend
+
+Revision ID: 3b1f6e2c9a4d
+Revises: fa6460f5386f
+Create Date: 2026-10-17 09:12:44.503121
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3b1f6e2c9a4d'
+down_revision = 'fa6460f5386f'
+branch_labels = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    export_backend = sa.Enum('python', 'copy', name='export_backend')
+    export_backend.create(op.get_bind(), checkfirst=True)
+    op.add_column(
+        'export',
+        sa.Column(
+            'backend',
+            export_backend,
+            nullable=False,
+            server_default='python'))
+
+
+def downgrade():
+    op.drop_column('export', 'backend')
+    sa.Enum(name='export_backend').drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,35 @@
+"""Add report table registry
+
+Revision ID: 5c9a7e3d2b18
+Revises: 8d2e4c7a1f05
+Create Date: 2026-10-17 11:42:05.318227
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5c9a7e3d2b18'
+down_revision = '8d2e4c7a1f05'
+branch_labels = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'report_table',
+        sa.Column('id', sa.BigInteger, primary_key=True),
+        sa.Column('schema_name', sa.String, nullable=False),
+        sa.Column('table_name', sa.String, nullable=False),
+        sa.Column('fingerprint', sa.String, nullable=False),
+        sa.Column('watermark', sa.DateTime, nullable=False),
+        sa.Column('refresh_date', sa.DateTime, nullable=False),
+        sa.UniqueConstraint(
+            'schema_name', name='uq_report_table_schema_name'),
+        sa.UniqueConstraint(
+            'table_name', name='uq_report_table_table_name'))
+
+
+def downgrade():
+    op.drop_table('report_table')
+    op.execute('DROP SCHEMA IF EXISTS reports CASCADE')
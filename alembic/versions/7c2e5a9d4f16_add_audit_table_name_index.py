@@ -0,0 +1,26 @@
+"""Add audit table name index
+
+Revision ID: 7c2e5a9d4f16
+Revises: 2f4b8d6a9c31
+Create Date: 2026-10-17 16:42:07.512334
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7c2e5a9d4f16'
+down_revision = '2f4b8d6a9c31'
+branch_labels = None
+
+from alembic import op
+
+
+def upgrade():
+    # Export caches look up the latest audit event of each table
+    op.execute(
+        'CREATE INDEX IF NOT EXISTS ix_logged_actions_table_name_event_id '
+        'ON audit.logged_actions (table_name, event_id)')
+
+
+def downgrade():
+    op.execute(
+        'DROP INDEX IF EXISTS audit.ix_logged_actions_table_name_event_id')
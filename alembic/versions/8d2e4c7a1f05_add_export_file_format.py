@@ -0,0 +1,32 @@
+"""Add export file format
+
+Revision ID: 8d2e4c7a1f05
+Revises: 3b1f6e2c9a4d
+Create Date: 2026-10-17 10:03:18.220984
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8d2e4c7a1f05'
+down_revision = '3b1f6e2c9a4d'
+branch_labels = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    export_file_format = sa.Enum('csv', 'parquet', name='export_file_format')
+    export_file_format.create(op.get_bind(), checkfirst=True)
+    op.add_column(
+        'export',
+        sa.Column(
+            'file_format',
+            export_file_format,
+            nullable=False,
+            server_default='csv'))
+
+
+def downgrade():
+    op.drop_column('export', 'file_format')
+    sa.Enum(name='export_file_format').drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,23 @@
+"""Add export file size
+
+Revision ID: 9e4d1b7c3a52
+Revises: 7c2e5a9d4f16
+Create Date: 2026-10-17 17:05:44.108213
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9e4d1b7c3a52'
+down_revision = '7c2e5a9d4f16'
+branch_labels = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('export', sa.Column('file_size', sa.BigInteger))
+
+
+def downgrade():
+    op.drop_column('export', 'file_size')
@@ -0,0 +1,268 @@
+"""
+Synthetic data generator
+
+Populates a database with realistic volumes of studies, patients, visits
+and form data. Bulk rows are inserted through SQLAlchemy core with
+pre-reserved primary keys so that millions of rows can be generated
+without the overhead of the ORM unit of work.
+"""
+
+from datetime import date, timedelta
+from itertools import cycle, islice
+import random
+
+from occams import models
+from occams.bulk import reserve_ids
+
+
+BATCH_SIZE = 10000
+
+
+def generate(dbsession,
+             sites=2,
+             patients=100,
+             visits=4,
+             schemata=5,
+             attributes=20,
+             choices=5,
+             randomized=False,
+             seed=0):
+    """
+    Generates a synthetic data set
+
+    Forms are collected for every patient at every visit. Each form is
+    attached to its patient, visit and enrollment contexts just as the
+    data entry views would.
+
+    Parameters:
+    dbsession -- the database session to populate
+    sites -- number of sites
+    patients -- number of patients (distributed evenly across sites)
+    visits -- number of visits per patient (one per study cycle)
+    schemata -- number of forms
+    attributes -- number of variables per form
+    choices -- number of answer choices per choice variable
+    randomized -- (Optional) also randomize every patient, attaching the
+                  first form of each patient to its stratum
+    seed -- random number generator seed, for reproducible data sets
+
+    Returns:
+    A dictionary of generated row counts, keyed by table name
+    """
+
+    rand = random.Random(seed)
+    today = date.today()
+
+    study = models.Study(
+        name=u'benchmark',
+        title=u'Benchmark',
+        short_title=u'BENCH',
+        code=u'000',
+        consent_date=today - timedelta(365))
+
+    arms = [
+        models.Arm(name=u'arm{}'.format(i), title=u'Arm {}'.format(i),
+                   study=study)
+        for i in range(2)]
+
+    cycles = [
+        models.Cycle(name=u'week-{}'.format(i), title=u'Week {}'.format(i),
+                     week=i, study=study)
+        for i in range(visits)]
+
+    forms = [
+        _make_schema(u'bench_form_{}'.format(i), attributes, choices, today)
+        for i in range(schemata)]
+
+    study.schemata.update(forms)
+
+    site_records = [
+        models.Site(name=u'site{}'.format(i), title=u'Site {}'.format(i))
+        for i in range(sites)]
+
+    dbsession.add_all([study] + arms + cycles + forms + site_records)
+    dbsession.flush()
+
+    leafs = [list(form.iterleafs()) for form in forms]
+
+    patient_ids = reserve_ids(dbsession, models.Patient, patients)
+    enrollment_ids = reserve_ids(dbsession, models.Enrollment, patients)
+    visit_ids = reserve_ids(dbsession, models.Visit, patients * visits)
+    stratum_ids = (
+        reserve_ids(dbsession, models.Stratum, patients)
+        if randomized else [])
+    entity_ids = iter(reserve_ids(
+        dbsession, models.Entity, patients * visits * schemata))
+
+    counts = dict.fromkeys(['patient', 'enrollment', 'visit', 'visit_cycle',
+                            'stratum', 'entity', 'context'], 0)
+
+    def rows():
+        site_iter = cycle(site_records)
+        visit_iter = iter(visit_ids)
+        for n, patient_id in enumerate(patient_ids):
+            enrollment_id = enrollment_ids[n]
+            consent_date = today - timedelta(rand.randint(visits * 7, 365))
+            yield 'patient', {
+                'id': patient_id,
+                'site_id': next(site_iter).id,
+                'pid': u'P{:08d}'.format(n)}
+            yield 'enrollment', {
+                'id': enrollment_id,
+                'patient_id': patient_id,
+                'study_id': study.id,
+                'consent_date': consent_date,
+                'latest_consent_date': consent_date,
+                'reference_number': u'R{:08d}'.format(n)}
+
+            stratum_id = None
+            if randomized:
+                stratum_id = stratum_ids[n]
+                yield 'stratum', {
+                    'id': stratum_id,
+                    'study_id': study.id,
+                    'arm_id': rand.choice(arms).id,
+                    'block_number': n // 10,
+                    'reference_number': u'{:08d}'.format(n),
+                    'patient_id': patient_id}
+
+            for cycle_ in cycles:
+                visit_id = next(visit_iter)
+                visit_date = consent_date + timedelta(cycle_.week * 7)
+                yield 'visit', {
+                    'id': visit_id,
+                    'patient_id': patient_id,
+                    'visit_date': visit_date}
+                yield 'visit_cycle', {
+                    'visit_id': visit_id,
+                    'cycle_id': cycle_.id}
+
+                for form, form_leafs in zip(forms, leafs):
+                    entity_id = next(entity_ids)
+                    yield 'entity', {
+                        'id': entity_id,
+                        'schema_id': form.id,
+                        'collect_date': visit_date,
+                        'not_done': False,
+                        'data': _make_data(rand, form_leafs, visit_date)}
+                    contexts = [
+                        ('patient', patient_id),
+                        ('visit', visit_id),
+                        ('enrollment', enrollment_id)]
+                    if stratum_id is not None:
+                        contexts.append(('stratum', stratum_id))
+                        stratum_id = None
+                    for external, key in contexts:
+                        yield 'context', {
+                            'entity_id': entity_id,
+                            'external': external,
+                            'key': key}
+
+    tables = {
+        'patient': models.Patient.__table__,
+        'enrollment': models.Enrollment.__table__,
+        'stratum': models.Stratum.__table__,
+        'visit': models.Visit.__table__,
+        'visit_cycle': models.visit_cycle_table,
+        'entity': models.Entity.__table__,
+        'context': models.Context.__table__,
+    }
+
+    # Tables are flushed in dependency order
+    order = ['patient', 'enrollment', 'stratum', 'visit', 'visit_cycle',
+             'entity', 'context']
+    pending = dict((name, []) for name in order)
+
+    def flush():
+        for name in order:
+            if pending[name]:
+                dbsession.execute(tables[name].insert(), pending[name])
+                counts[name] += len(pending[name])
+                pending[name] = []
+
+    for name, row in rows():
+        pending[name].append(row)
+        if len(pending[name]) >= BATCH_SIZE:
+            flush()
+
+    flush()
+
+    dbsession.execute('ANALYZE')
+
+    return counts
+
+
+def _make_schema(name, attributes, choices, publish_date):
+    """
+    Generates a published form with a mix of variable types
+
+    Every fifth variable is placed in a section so that reports exercise
+    nested attributes as well.
+    """
+    types = cycle([
+        ('string', False),
+        ('number', False),
+        ('date', False),
+        ('choice', False),
+        ('choice', True),
+        ('text', False),
+        ('datetime', False)])
+
+    schema = models.Schema(
+        name=name,
+        title=name.replace('_', ' ').title(),
+        publish_date=publish_date)
+
+    section = models.Attribute(
+        name=u'section', title=u'Section', type='section', order=0)
+    schema.attributes[section.name] = section
+
+    for i, (type_, is_collection) in enumerate(islice(types, attributes)):
+        attribute = models.Attribute(
+            name=u'var_{}'.format(i),
+            title=u'Variable {}'.format(i),
+            type=type_,
+            is_collection=is_collection,
+            is_private=(i == 0),
+            order=i + 1)
+        if type_ == 'number':
+            attribute.decimal_places = 2
+        if type_ == 'choice':
+            for c in range(choices):
+                attribute.choices[str(c)] = models.Choice(
+                    name=str(c), title=u'Choice {}'.format(c), order=c)
+        if i % 5 == 4:
+            section.attributes[attribute.name] = attribute
+        else:
+            schema.attributes[attribute.name] = attribute
+
+    return schema
+
+
+def _make_data(rand, attributes, collect_date):
+    """
+    Generates an entity's JSON document for the given variables
+    """
+    data = {}
+    for attribute in attributes:
+        if rand.random() < 0.1:
+            value = None
+        elif attribute.type in ('string', 'text'):
+            value = u'value-{}'.format(rand.randint(0, 1 << 16))
+        elif attribute.type == 'number':
+            value = str(round(rand.uniform(0, 1000), 2))
+        elif attribute.type == 'date':
+            value = (collect_date - timedelta(rand.randint(0, 365))) \
+                .isoformat()
+        elif attribute.type == 'datetime':
+            value = (collect_date - timedelta(rand.randint(0, 365))) \
+                .isoformat() + 'T12:00:00'
+        elif attribute.type == 'choice' and attribute.is_collection:
+            names = sorted(attribute.choices.keys())
+            value = rand.sample(names, rand.randint(1, len(names)))
+        elif attribute.type == 'choice':
+            value = rand.choice(sorted(attribute.choices.keys()))
+        else:
+            value = None
+        data[attribute.name] = value
+    return data
@@ -0,0 +1,493 @@
+"""
+Bulk entity writes
+
+Data entry normally goes through a generated form per entity (see
+`occams.renderers.apply_data`), which validates and saves values one
+attribute at a time through the ORM. Mass data entry (e.g. all forms of a
+visit) and device imports instead submit many entities at once: their
+schemata and states are resolved in a single query each, values are
+validated against cached attribute validators and rows are written with one
+``executemany`` per table.
+
+Only the data of published versions can be written in bulk, attachments
+must still be uploaded through the form of each entity.
+"""
+
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from dateutil.parser import isoparse
+import sqlalchemy as sa
+from sqlalchemy import null
+
+from . import _, models
+from .exc import ConstraintError
+from .models import validation
+from .reporting import schema_cache_key
+from .renderers import states
+from .utils.cache import metadata_cache, validator_cache
+
+
+def reserve_ids(dbsession, model, count):
+    """
+    Reserves primary key values from a table's sequence in one query
+    """
+    if not count:
+        return []
+    query = sa.text(
+        'SELECT nextval(pg_get_serial_sequence(:table, \'id\')) '
+        'FROM generate_series(1, :count)')
+    return [id for id, in dbsession.execute(
+        query, {'table': model.__table__.name, 'count': count})]
+
+
+def get_validator(dbsession, schema_id, schema_name):
+    """
+    Returns the compiled validator of a published version's attributes
+
+    The attribute rules are kept in the metadata cache, and the validators
+    compiled from them in the (process-local) validator cache, until the
+    version is edited or retracted. Limits set on types that cannot be
+    limited are ignored.
+
+    Parameters:
+    dbsession -- The database session to use
+    schema_id -- The id of the version
+    schema_name -- The name of the version's schema
+
+    Returns:
+    A `occams.models.SchemaValidator` of the version's (leaf) attributes
+    """
+    key = schema_cache_key(
+        dbsession, 'entity_rules', schema_name, ids=[schema_id],
+        extra=[schema_id])
+    validator = validator_cache.get(key)
+    if validator is None:
+        rules = metadata_cache.get_or_create(
+            key, lambda: _query_rules(dbsession, schema_id))
+        validator = models.SchemaValidator(schema_name, rules.values())
+        validator_cache.set(key, validator)
+    return validator
+
+
+def _query_rules(dbsession, schema_id):
+    """
+    Queries the rules `get_validator` compiles, keyed by attribute name
+    """
+    rules = {}
+
+    query = (
+        dbsession.query(
+            models.Attribute.id,
+            models.Attribute.name,
+            models.Attribute.type,
+            models.Attribute.is_collection,
+            models.Attribute.is_required,
+            models.Attribute.decimal_places,
+            models.Attribute.value_min,
+            models.Attribute.value_max,
+            models.Attribute.collection_min,
+            models.Attribute.collection_max,
+            models.Attribute.pattern)
+        .filter(models.Attribute.schema_id == schema_id)
+        .filter(models.Attribute.type != u'section'))
+
+    ids = {}
+    for attribute in query:
+        rule = attribute._asdict()
+        ids[rule.pop('id')] = rule['name']
+        rule['choices'] = []
+        rules[rule['name']] = rule
+
+    query = (
+        dbsession.query(models.Choice.attribute_id, models.Choice.name)
+        .filter(models.Choice.attribute_id.in_(list(ids)))
+        .order_by(models.Choice.attribute_id, models.Choice.order))
+
+    for attribute_id, name in query:
+        rules[ids[attribute_id]]['choices'].append(name)
+
+    return rules
+
+
+def validate(validator, data, required=True):
+    """
+    Validates and serializes the data of an entity
+
+    Values are stored the same way as `occams.renderers.apply_data`
+    (numbers and dates as strings).
+
+    Parameters:
+    validator -- the version's validator (see `get_validator`)
+    data -- a dictionary of JSON values keyed by attribute name
+    required -- (Optional) checks that required attributes have a value
+
+    Returns:
+    A tuple of the serialized values and a dictionary of error messages
+    keyed by attribute name
+    """
+    values = {}
+    errors = {}
+
+    for name in sorted(name for name in data if name not in validator):
+        errors[name] = _(u'Unknown field')
+
+    for name, attribute in validator.items():
+        value = data.get(name)
+
+        if value is None or value == [] or value == u'':
+            if required and attribute.is_required:
+                errors[name] = _(u'This field is required')
+            elif name in data:
+                values[name] = None
+            continue
+
+        try:
+            values[name] = validate_value(attribute, value)
+        except ValueError as exc:
+            errors[name] = exc.args[0]
+
+    return values, errors
+
+
+# Error messages of constraint violations, by reason
+CONSTRAINT_MESSAGES = {
+    validation.CHOICE: _(u'Not a valid choice'),
+    validation.VALUE_MIN: _(u'Value is out of range'),
+    validation.VALUE_MAX: _(u'Value is out of range'),
+    validation.COLLECTION_MIN: _(u'Too few choices selected'),
+    validation.COLLECTION_MAX: _(u'Too many choices selected'),
+    validation.PATTERN: _(u'Value does not match the expected format'),
+    validation.INVALID: _(u'Invalid value'),
+}
+
+
+def validate_value(attribute, value):
+    """
+    Validates and serializes a (non-empty) attribute value
+
+    Parameters:
+    attribute -- the attribute's `occams.models.AttributeValidator`
+    value -- a JSON value
+
+    Raises:
+    ValueError with a translatable message if the value is invalid
+    """
+    if attribute.is_collection:
+        if not isinstance(value, list):
+            raise ValueError(_(u'Expected a list of values'))
+        value = [_convert(attribute, v) for v in value]
+    else:
+        value = _convert(attribute, value)
+    try:
+        return attribute(value)
+    except ConstraintError as exc:
+        raise ValueError(CONSTRAINT_MESSAGES[exc.args[2]])
+
+
+def _convert(attribute, value):
+    """
+    Converts a JSON value to its stored form
+    """
+    type_ = attribute.type
+
+    if type_ in ('string', 'text'):
+        if not isinstance(value, str):
+            raise ValueError(_(u'Expected text'))
+        return value.strip()
+
+    elif type_ == 'number':
+        if isinstance(value, bool):
+            raise ValueError(_(u'Not a valid number'))
+        try:
+            number = Decimal(str(value))
+        except InvalidOperation:
+            raise ValueError(_(u'Not a valid number'))
+        if not number.is_finite():
+            raise ValueError(_(u'Not a valid number'))
+        if attribute.decimal_places == 0 \
+                and number != number.to_integral():
+            raise ValueError(_(u'Not a valid integer'))
+        return str(number)
+
+    elif type_ in ('date', 'datetime'):
+        if not isinstance(value, str):
+            raise ValueError(_(u'Not a valid date'))
+        try:
+            parsed = isoparse(value)
+        except ValueError:
+            raise ValueError(_(u'Not a valid date'))
+        return str(parsed.date() if type_ == 'date' else parsed)
+
+    elif type_ == 'choice':
+        # Choice codes are checked by the validator
+        return str(value)
+
+    elif type_ == 'boolean':
+        if value not in (True, False, 0, 1):
+            raise ValueError(_(u'Expected true or false'))
+        return bool(value)
+
+    elif type_ == 'blob':
+        raise ValueError(_(u'Attachments cannot be uploaded in bulk'))
+
+    raise ValueError(_(u'Unsupported field type'))
+
+
+def save(dbsession, parent, entries):
+    """
+    Adds or updates the entities of a patient or visit
+
+    Each entry is a dictionary of:
+    id -- (Optional) the id of an existing entity of the parent
+    schema -- the schema name
+    publish_date -- the version's publish date (ISO format)
+    collect_date -- the date the data was collected (ISO format)
+    not_done -- (Optional) flags the form as not collected
+    data -- (Optional) values keyed by attribute name
+
+    As with data entry users who cannot set workflow states, saved
+    entities are marked for review and completed entities are read-only.
+
+    Parameters:
+    dbsession -- The database session to use
+    parent -- the `models.Patient` or `models.Visit` the entities belong to
+    entries -- a list of entries
+
+    Returns:
+    A tuple of the saved entity ids (in the same order as the entries)
+    and a dictionary of error messages keyed by
+    ``entities-<index>-<field>``. Nothing is written if there are errors.
+    """
+    errors = {}
+    parsed = []
+
+    for index, entry in enumerate(entries):
+        prefix = 'entities-%d-' % index
+        if not isinstance(entry, dict):
+            errors[prefix[:-1]] = _(u'Expected an object')
+            continue
+        try:
+            record = {
+                'id': _parse_id(entry.get('id')),
+                'version': (
+                    str(entry['schema']),
+                    parse_date(entry['publish_date'])),
+                'collect_date': parse_date(entry['collect_date']),
+                'not_done': bool(entry.get('not_done', False)),
+                'data': entry.get('data') or {},
+            }
+        except KeyError as exc:
+            errors[prefix + exc.args[0]] = _(u'This field is required')
+            continue
+        except (TypeError, ValueError):
+            errors[prefix[:-1]] = _(u'Invalid entry')
+            continue
+        if not isinstance(record['data'], dict):
+            errors[prefix + 'data'] = _(u'Expected an object')
+            continue
+        if record['collect_date'] < date(1900, 1, 1):
+            errors[prefix + 'collect_date'] = _(u'Invalid date')
+            continue
+        parsed.append((index, record))
+
+    versions = _resolve_versions(
+        dbsession, parent, set(r['version'] for _, r in parsed))
+    existing = _resolve_existing(
+        dbsession, parent, [r['id'] for _, r in parsed if r['id']])
+
+    state_id = (
+        dbsession.query(models.State.id)
+        .filter_by(name=states.PENDING_REVIEW)
+        .scalar())
+
+    validators = {}
+    rows = []
+
+    for index, record in parsed:
+        prefix = 'entities-%d-' % index
+
+        if record['version'] not in versions:
+            errors[prefix + 'schema'] = \
+                _(u'This form is not available for data entry')
+            continue
+
+        schema_id = versions[record['version']]
+
+        if record['id']:
+            if record['id'] not in existing:
+                errors[prefix + 'id'] = _(u'Form not found')
+                continue
+            schema_name, state_name = existing[record['id']]
+            if schema_name != record['version'][0]:
+                errors[prefix + 'schema'] = _(u'Cannot change the form')
+                continue
+            if state_name == states.COMPLETE:
+                errors[prefix + 'id'] = _(u'This form is complete')
+                continue
+
+        if schema_id not in validators:
+            validators[schema_id] = get_validator(
+                dbsession, schema_id, record['version'][0])
+
+        if record['not_done']:
+            values, field_errors = {}, {}
+        else:
+            values, field_errors = validate(
+                validators[schema_id], record['data'])
+
+        for name, message in field_errors.items():
+            errors[prefix + 'data-' + name] = message
+
+        rows.append({
+            'id': record['id'],
+            'schema_id': schema_id,
+            'state_id': state_id,
+            'collect_date': record['collect_date'],
+            'not_done': record['not_done'],
+            'data': values,
+        })
+
+    if errors:
+        return [], errors
+
+    return write(dbsession, parent, rows), {}
+
+
+def write(dbsession, parent, rows):
+    """
+    Writes validated entity rows, associating new ones with a parent
+
+    New entities (whose ``id`` is None) are inserted, the data of
+    existing entities is replaced.
+
+    Returns:
+    The ids of the rows, in order
+    """
+    # Make sure pending ORM changes do not overwrite these rows later
+    dbsession.flush()
+
+    table = models.Entity.__table__
+    new = [row for row in rows if row['id'] is None]
+    updated = [row for row in rows if row['id'] is not None]
+
+    for row, id in zip(new, reserve_ids(dbsession, models.Entity, len(new))):
+        row['id'] = id
+
+    if new:
+        dbsession.execute(table.insert(), new)
+        dbsession.execute(models.Context.__table__.insert(), [
+            {'entity_id': row['id'], 'external': external, 'key': key}
+            for row in new
+            for external, key in _get_contexts(parent)])
+
+    if updated:
+        dbsession.execute(
+            table.update()
+            .where(table.c.id == sa.bindparam('_id'))
+            .values(
+                schema_id=sa.bindparam('_schema_id'),
+                state_id=sa.bindparam('_state_id'),
+                collect_date=sa.bindparam('_collect_date'),
+                not_done=sa.bindparam('_not_done'),
+                data=sa.bindparam('_data', type_=table.c.data.type)),
+            [dict(('_' + k, v) for k, v in row.items()) for row in updated])
+
+        # Entities already loaded into the session are now stale
+        ids = set(row['id'] for row in updated)
+        for instance in list(dbsession.identity_map.values()):
+            if isinstance(instance, models.Entity) and instance.id in ids:
+                dbsession.expire(instance)
+
+    return [row['id'] for row in rows]
+
+
+def _parse_id(value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise TypeError(value)
+    return int(value)
+
+
+def parse_date(value):
+    """
+    Parses an ISO formatted date
+    """
+    if not isinstance(value, str):
+        raise TypeError(value)
+    return isoparse(value).date()
+
+
+def _get_contexts(parent):
+    """
+    Returns the (external, key) pairs new entities of a parent belong to
+    """
+    contexts = [(parent.__tablename__, parent.id)]
+    if isinstance(parent, models.Visit):
+        # Visit forms are also listed in the patient's forms
+        contexts.append((models.Patient.__tablename__, parent.patient.id))
+    return contexts
+
+
+def _resolve_versions(dbsession, parent, versions):
+    """
+    Looks up the ids of the published versions available to a parent
+
+    Returns:
+    A dictionary of schema ids keyed by (schema name, publish date)
+    """
+    if not versions:
+        return {}
+
+    query = (
+        dbsession.query(
+            models.Schema.name,
+            models.Schema.publish_date,
+            models.Schema.id)
+        .filter(sa.tuple_(models.Schema.name, models.Schema.publish_date)
+                .in_(list(versions)))
+        .filter(models.Schema.publish_date != null())
+        .filter(models.Schema.retract_date == null()))
+
+    studies = sa.select([models.study_schema_table.c.schema_id])
+
+    if isinstance(parent, models.Visit):
+        cycle_ids = [cycle.id for cycle in parent.cycles]
+        cycles = (
+            sa.select([models.cycle_schema_table.c.schema_id])
+            .where(models.cycle_schema_table.c.cycle_id.in_(cycle_ids)))
+        studies = studies.where(
+            models.study_schema_table.c.study_id.in_(
+                sa.select([models.Cycle.study_id])
+                .where(models.Cycle.id.in_(cycle_ids))))
+        query = query.filter(
+            models.Schema.id.in_(cycles) | models.Schema.id.in_(studies))
+    else:
+        query = query.filter(models.Schema.id.in_(studies))
+
+    return dict(((name, publish_date), id) for name, publish_date, id in query)
+
+
+def _resolve_existing(dbsession, parent, ids):
+    """
+    Looks up the existing entities of a parent
+
+    Returns:
+    A dictionary of (schema name, state name) keyed by entity id
+    """
+    if not ids:
+        return {}
+
+    query = (
+        dbsession.query(
+            models.Entity.id, models.Schema.name, models.State.name)
+        .join(models.Schema, models.Entity.schema_id == models.Schema.id)
+        .outerjoin(models.State, models.Entity.state_id == models.State.id)
+        .join(models.Context, models.Context.entity_id == models.Entity.id)
+        .filter(models.Context.external == parent.__tablename__)
+        .filter(models.Context.key == parent.id)
+        .filter(models.Entity.id.in_(ids)))
+
+    return dict((id, (schema_name, state_name))
+                for id, schema_name, state_name in query)
@@ -60,3 +60,10 @@ class ConstraintError(DataStoreError):
     """
     Raised when an invalid value is set to an entity
     """
+
+
+class ImportFileError(DataStoreError):
+    """
+    Raised when a data file cannot be imported at all
+    (e.g. unknown columns or an unpublished form)
+    """
@@ -9,12 +9,16 @@ import inspect
 
 import csv
 from collections import OrderedDict
+from contextlib import contextmanager
+import io
+import zipfile
 
 from pyramid.config import aslist
 from pyramid.path import DottedNameResolver
+import sqlalchemy as sa
 
 from .. import log
-from . import codebook
+from . import codebook, fragments
 
 from .pid import PidPlan
 from .enrollment import EnrollmentPlan
@@ -25,6 +29,19 @@ from .schema import SchemaPlan
 plans = [PidPlan, EnrollmentPlan, VisitPlan, SchemaPlan.list_all]
 
 
+# Archive compression methods, by setting value
+COMPRESSION = OrderedDict([
+    ('deflate', zipfile.ZIP_DEFLATED),
+    ('bzip2', zipfile.ZIP_BZIP2),
+    ('lzma', zipfile.ZIP_LZMA),
+    ('store', zipfile.ZIP_STORED),
+])
+
+# Zstandard entries are only supported by newer versions of Python
+if hasattr(zipfile, 'ZIP_ZSTANDARD'):
+    COMPRESSION['zstd'] = zipfile.ZIP_ZSTANDARD
+
+
 def list_all(dbsession, include_rand=True, include_private=True):
     """
     Lists all available data files
@@ -58,25 +75,405 @@ def list_all(dbsession, include_rand=True, include_private=True):
     return all
 
 
-def write_data(buffer, query):
+def iter_codebook(dbsession, plans):
+    """
+    Chains the codebook rows of several data files
+
+    The codebook fragments of all published forms are loaded at once,
+    rather than once per form.
+
+    Arguments:
+    dbsession -- the database session to use
+    plans -- the export plans to include
+
+    Returns:
+    An iterator of codebook rows
+    """
+    loaded = fragments.load(dbsession)
+    for plan in plans:
+        if isinstance(plan, SchemaPlan):
+            rows = plan.codebook(fragments=loaded)
+        else:
+            rows = plan.codebook()
+        for row in rows:
+            yield row
+
+
+def get_watermark(dbsession):
+    """
+    Determines the modification timestamp up to which an export is complete
+
+    Records are stamped with the time they were modified, not the time their
+    transaction commits. So the watermark is the start of the oldest
+    transaction still in progress, guaranteeing that the next incremental
+    export will not miss records that are committed after this one.
+
+    Arguments:
+    dbsession -- the database session the export is generated from
+
+    Returns:
+    A timestamp suitable for the ``since`` parameter of `ExportPlan.data`
+    """
+    return dbsession.execute(sa.text("""
+        SELECT CAST(LEAST(NOW(), MIN(xact_start)) AS TIMESTAMP)
+        FROM pg_stat_activity
+        WHERE datname = CURRENT_DATABASE()
+        AND xact_start IS NOT NULL
+    """)).scalar()
+
+
+def open_archive(file, compression='deflate', compresslevel=None):
+    """
+    Opens a ZIP archive for writing export data files
+
+    Arguments:
+    file -- a path or writable binary file object
+    compression -- (Optional) a method name from `COMPRESSION`
+    compresslevel -- (Optional) method-specific level (e.g. 0-9 for deflate)
+
+    Returns:
+    A `zipfile.ZipFile` instance
+    """
+    return zipfile.ZipFile(
+        file,
+        mode='w',
+        compression=COMPRESSION[compression],
+        compresslevel=compresslevel)
+
+
+@contextmanager
+def open_member(archive, file_name, binary=False):
+    """
+    Opens a new entry of an archive for streaming
+
+    Data written to the entry is compressed directly into the archive,
+    without first being staged in a temporary file.
+
+    Arguments:
+    archive -- an archive from `open_archive`
+    file_name -- the name of the entry
+    binary -- (Optional) yield the raw binary stream instead of text
+
+    Returns:
+    A file object for the entry's contents
+    """
+    # Sizes are unknown in advance, so always allow entries over 2 GiB
+    with archive.open(file_name, mode='w', force_zip64=True) as fp:
+        if binary:
+            yield fp
+        else:
+            with io.TextIOWrapper(fp, encoding='utf-8', newline='') as tfp:
+                yield tfp
+
+
+def stream_archive(connection, members, codebook_rows=None,
+                   compression='deflate', compresslevel=None,
+                   batch_size=1000):
+    """
+    Generates a ZIP archive of query results on the fly
+
+    Rows are fetched from a server-side cursor and compressed into the
+    archive as they arrive, so the archive is never held in memory or
+    written to disk. This is meant to be used as a response ``app_iter``.
+
+    Arguments:
+    connection -- an engine or connection to execute the queries with.
+                  The queries are not executed through their own session
+                  since the response is generated after the request's
+                  transaction has ended.
+    members -- (file_name, query) pairs of data files to include
+    codebook_rows -- (Optional) code book rows to include
+    compression -- (Optional) a method name from `COMPRESSION`
+    compresslevel -- (Optional) method-specific compression level
+    batch_size -- (Optional) rows fetched (and yielded) at a time
+
+    Returns:
+    An iterator of bytes chunks
+    """
+    sink = _StreamSink()
+
+    with connection.connect() as conn, conn.begin():
+        with open_archive(sink, compression, compresslevel) as zfp:
+            for file_name, query in members:
+                header = [d['name'] for d in query.column_descriptions]
+                result = (
+                    conn.execution_options(stream_results=True)
+                    .execute(query.statement))
+                with open_member(zfp, file_name) as fp:
+                    writer = csv.writer(fp)
+                    writer.writerow(header)
+                    while True:
+                        rows = result.fetchmany(batch_size)
+                        if not rows:
+                            break
+                        writer.writerows(rows)
+                        fp.flush()
+                        yield from sink.drain()
+                yield from sink.drain()
+
+            if codebook_rows is not None:
+                with open_member(zfp, codebook.FILE_NAME) as fp:
+                    write_codebook(fp, codebook_rows)
+
+    yield from sink.drain()
+
+
+class _StreamSink(object):
+    """
+    Unseekable file object that collects written archive bytes
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        if self.chunks:
+            data = b''.join(self.chunks)
+            self.chunks = []
+            yield data
+
+
+def write_data(buffer, query, batch_size=None, header=True, checkpoint=None):
     """
     Dumps a query to a CSV file using the specified buffer
-    Each record in the query is accessed as a `namedtuple`.
+    Each record in the query is written positionally as a tuple, in the
+    same order as the query's column descriptions.
+
+    Arguments:
+    buffer -- a file object which will be used to write data contents
+    query -- SQLAlchemy query that will be writen to a CSV file.
+             Note that the column names will be used as the header.
+    batch_size -- (Optional) Stream results through a named server-side
+                  cursor, fetching this many rows at a time. This keeps
+                  memory flat for large exports, but requires the query
+                  to be executed within a transaction.
+                  default: None (load the entire result set at once)
+    header -- (Optional) Write the column names as the first row,
+              disable when appending to a partially written file
+              default: True
+    checkpoint -- (Optional) Called with the last written id every
+                  ``batch_size`` rows once the buffer has been flushed.
+                  Requires the query to have an "id" column and to be
+                  ordered by it. Rows sharing the same id are never split
+                  across checkpoints.
+    """
+    names = [d['name'] for d in query.column_descriptions]
+
+    if batch_size:
+        query = (
+            query
+            .execution_options(stream_results=True)
+            .yield_per(batch_size))
+
+    writer = csv.writer(buffer)
+
+    if header:
+        writer.writerow(names)
+
+    if checkpoint is None or not batch_size:
+        writer.writerows(query)
+    else:
+        id_index = names.index('id')
+        last_id = None
+        pending = 0
+        for row in query:
+            current_id = row[id_index]
+            if pending >= batch_size and current_id != last_id:
+                buffer.flush()
+                checkpoint(last_id)
+                pending = 0
+            writer.writerow(row)
+            last_id = current_id
+            pending += 1
+
+    buffer.flush()
+
+
+def write_chunks(buffer, names, chunks, header=True, checkpoint=None):
+    """
+    Dumps chunked export data to a CSV file using the specified buffer
+
+    Arguments:
+    buffer -- a file object which will be used to write data contents
+    names -- the column names (see `write_data`)
+    chunks -- an iterator of row lists, see `ExportPlan.iterchunks`
+    header -- (Optional) Write the column names as the first row
+              default: True
+    checkpoint -- (Optional) Called with the last written id after each
+                  chunk once the buffer has been flushed.
+    """
+    writer = csv.writer(buffer)
+
+    if header:
+        writer.writerow(names)
+
+    for rows in chunks:
+        writer.writerows(rows)
+        buffer.flush()
+        if checkpoint is not None:
+            checkpoint(rows[-1].id)
 
-    See `namedtuple`.
+    buffer.flush()
+
+
+def copy_data(buffer, query):
+    """
+    Dumps a query to a CSV file using PostgreSQL's native COPY command
+
+    The query is compiled and bound to its parameters so that the server
+    streams the CSV output (including the header) directly into the buffer,
+    bypassing the ORM and Python's `csv` module altogether.
 
     Arguments:
     buffer -- a file object which will be used to write data contents
     query -- SQLAlchemy query that will be writen to a CSV file.
              Note that the column names will be used as the header.
     """
-    fieldnames = [d['name'] for d in query.column_descriptions]
-    writer = csv.DictWriter(buffer, fieldnames=fieldnames)
-    writer.writeheader()
-    writer.writerows(r._asdict() for r in query)
+    # Use the session's connection so the COPY runs in the same transaction
+    connection = query.session.connection()
+    compiled = query.statement.compile(dialect=connection.dialect)
+
+    cursor = connection.connection.cursor()
+    try:
+        # Let psycopg2 render the parameters
+        statement = cursor.mogrify(
+            str(compiled), compiled.construct_params()).decode('utf-8')
+        cursor.copy_expert(
+            'COPY ({}) TO STDOUT WITH CSV HEADER'.format(statement),
+            buffer)
+    finally:
+        cursor.close()
+
+    buffer.flush()
+
+
+def write_parquet(buffer, query, rows, batch_size=1000):
+    """
+    Dumps a query to a Parquet file using the specified buffer
+
+    Column types are determined by the plan's codebook so that numbers,
+    dates and multi-selects are stored natively instead of as text.
+    Columns without a codebook entry (e.g. expanded collections) are typed
+    according to their SQL expression.
+
+    Requires the optional ``pyarrow`` package.
+
+    Arguments:
+    buffer -- a binary file object which will be used to write data contents
+    query -- SQLAlchemy query that will be writen to a Parquet file.
+             Note that the column names will be used as the header.
+    rows -- Code book rows of the plan the query was generated from.
+            See `occams.codebook`
+    batch_size -- (Optional) Number of rows fetched and written at a time,
+                  memory use is bounded by this amount.
+                  default: 1000
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # Use the most recent definition of each field
+    fields = dict((row['field'], row) for row in rows)
+
+    names = [d['name'] for d in query.column_descriptions]
+    arrow_types, converters = zip(*[
+        _get_arrow_type(pa, fields.get(d['name']), d['type'])
+        for d in query.column_descriptions])
+
+    schema = pa.schema(list(zip(names, arrow_types)))
+
+    def write(records):
+        arrays = [
+            pa.array([None if v is None else convert(v) for v in values],
+                     type=arrow_type)
+            for values, convert, arrow_type
+            in zip(zip(*records), converters, arrow_types)]
+        writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+
+    query = (
+        query
+        .execution_options(stream_results=True)
+        .yield_per(batch_size))
+
+    writer = pq.ParquetWriter(buffer, schema)
+    records = []
+
+    for record in query:
+        records.append(record)
+        if len(records) >= batch_size:
+            write(records)
+            records = []
+
+    if records:
+        write(records)
+
+    writer.close()
     buffer.flush()
 
 
+def _get_arrow_type(pa, row, sql_type):
+    """
+    Determines the Arrow type of a column
+
+    Parameters:
+    pa -- the pyarrow module
+    row -- the column's codebook entry, if any
+    sql_type -- the column's SQLAlchemy type
+
+    Returns:
+    A tuple of (the arrow type, a function to convert non-null values)
+    """
+
+    def identity(value):
+        return value
+
+    if row is None:
+        if isinstance(sql_type, (sa.Integer, sa.Boolean)):
+            return pa.int64(), int
+        elif isinstance(sql_type, sa.Numeric):
+            return pa.float64(), float
+        elif isinstance(sql_type, sa.DateTime):
+            return pa.timestamp('us'), identity
+        elif isinstance(sql_type, sa.Date):
+            return pa.date32(), identity
+        else:
+            return pa.string(), str
+
+    type_ = row['type']
+
+    if type_ == codebook.types.NUMBER:
+        if row['decimal_places'] == 0:
+            arrow_type, convert = pa.int64(), int
+        else:
+            arrow_type, convert = pa.float64(), float
+    elif type_ == codebook.types.BOOLEAN:
+        arrow_type, convert = pa.bool_(), bool
+    elif type_ == codebook.types.DATETIME or (
+            type_ == codebook.types.DATE
+            and isinstance(sql_type, sa.DateTime)):
+        # Some system columns (e.g. create_date) are really timestamps
+        arrow_type, convert = pa.timestamp('us'), identity
+    elif type_ == codebook.types.DATE:
+        arrow_type, convert = pa.date32(), identity
+    else:
+        arrow_type, convert = pa.string(), str
+
+    if row['is_collection']:
+        scalar = convert
+        arrow_type = pa.list_(arrow_type)
+
+        def convert(value):
+            return [scalar(v) for v in str(value).split(';')]
+
+    return arrow_type, convert
+
+
 def write_codebook(buffer, rows):
     """
     Dumps a list of dictioanries to a CSV file using the specified buffer
@@ -0,0 +1,191 @@
+"""
+Export data file cache
+
+Popular forms tend to be checked out with the same options many times a
+day. Generated data files are therefore kept in a content-addressed cache
+so that exports can reuse them as long as nothing has changed since.
+
+A cached file is keyed on everything that affects its contents: the plan,
+its versions, the export options and the latest audit log event of the
+plan's source tables.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+import sqlalchemy as sa
+
+from .plan import logged_actions
+
+
+# Subdirectory of `studies.export.dir` that contains cached files
+DIR_NAME = 'cache'
+
+
+def get_data_version(dbsession, tables):
+    """
+    Returns the id of the latest audit log event of a plan's source tables
+
+    Any insert, update or delete in one of the tables increments this
+    value, while changes to unrelated tables (e.g. the ``export`` table
+    itself) leave it as is. Each table's latest event is looked up
+    separately so that every lookup is a single (backward) scan of the
+    ``(table_name, event_id)`` index.
+
+    Parameters:
+    dbsession -- The database session to use
+    tables -- the plan's source tables (see `ExportPlan.source_tables`)
+    """
+    latest = [
+        sa.select([sa.func.max(logged_actions.c.event_id)])
+        .where(logged_actions.c.table_name == table)
+        .as_scalar()
+        for table in sorted(tables)]
+    # GREATEST ignores tables without events
+    return dbsession.query(sa.func.greatest(*latest)).scalar()
+
+
+def has_pending_writes(dbsession, tables):
+    """
+    Checks if other transactions have uncommitted changes to tables
+
+    Audit events of such transactions are numbered before they become
+    visible, so data generated while they are in progress must not be
+    cached under the current data version. Writes hold a row exclusive
+    lock on their table until the transaction ends.
+
+    Parameters:
+    dbsession -- The database session to use
+    tables -- the plan's source tables (see `ExportPlan.source_tables`)
+    """
+    query = sa.text(
+        'SELECT EXISTS ('
+        ' SELECT 1 FROM pg_locks'
+        ' JOIN pg_class ON pg_class.oid = pg_locks.relation'
+        ' WHERE pg_locks.database = ('
+        '  SELECT oid FROM pg_database WHERE datname = CURRENT_DATABASE())'
+        ' AND pg_locks.mode = \'RowExclusiveLock\''
+        ' AND pg_locks.pid <> pg_backend_pid()'
+        ' AND pg_table_is_visible(pg_class.oid)'
+        ' AND pg_class.relname IN :tables)'
+    ).bindparams(sa.bindparam('tables', expanding=True))
+    return dbsession.execute(query, {'tables': list(tables)}).scalar()
+
+
+def make_key(plan, data_version, **options):
+    """
+    Generates the content address of a plan's data file
+
+    Parameters:
+    plan -- the export plan
+    data_version -- see `get_data_version`
+    options -- export options that affect the generated file
+               (e.g. use_choice_labels, file_format)
+
+    Returns:
+    A hexadecimal digest
+    """
+    document = {
+        'plan': plan.name,
+        'versions': [str(v) for v in plan.versions],
+        'data_version': data_version,
+        'options': options,
+    }
+    encoded = json.dumps(document, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class ExportCache(object):
+    """
+    Size-bounded, least-recently-used cache of generated data files
+    """
+
+    def __init__(self, directory, max_size):
+        """
+        Parameters:
+        directory -- where cached files are stored
+        max_size -- total size in bytes of cached files (0 disables)
+        """
+        self.directory = directory
+        self.max_size = max_size
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            os.path.join(settings['studies.export.dir'], DIR_NAME),
+            settings['studies.export.cache.size'])
+
+    @property
+    def is_enabled(self):
+        return self.max_size > 0
+
+    def get_path(self, key, file_name):
+        extension = os.path.splitext(file_name)[1]
+        return os.path.join(self.directory, key + extension)
+
+    def fetch(self, key, file_name, destination):
+        """
+        Places a cached file at destination
+
+        Returns:
+        True if the file was cached, False otherwise
+        """
+        if not self.is_enabled:
+            return False
+        path = self.get_path(key, file_name)
+        try:
+            # Mark as recently used
+            os.utime(path)
+            _link_or_copy(path, destination)
+        except FileNotFoundError:
+            # Not cached or evicted in the meantime
+            return False
+        return True
+
+    def store(self, key, file_name, source):
+        """
+        Adds a generated file to the cache and evicts old entries if needed
+        """
+        if not self.is_enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.get_path(key, file_name)
+        staging = os.path.join(self.directory, '.' + uuid.uuid4().hex)
+        _link_or_copy(source, staging)
+        os.replace(staging, path)
+        self.evict()
+
+    def evict(self):
+        """
+        Removes least recently used files until under the size limit
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            # Skip files still being staged by `store`
+            if entry.is_file() and not entry.name.startswith('.'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def _link_or_copy(source, destination):
+    """
+    Hard links files if possible, since they are never modified in place
+    """
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
@@ -19,6 +19,10 @@ class EnrollmentPlan(ExportPlan):
 
     title = _(u'Enrollments')
 
+    table_name = 'enrollment'
+
+    source_tables = ('enrollment', 'patient', 'site', 'study', 'account')
+
     def codebook(self):
 
         return iter([
@@ -51,7 +55,9 @@ class EnrollmentPlan(ExportPlan):
     def data(self,
              use_choice_labels=False,
              expand_collections=False,
-             ignore_private=True):
+             ignore_private=True,
+             since=None,
+             after=None):
         session = self.dbsession
         CreateUser = aliased(models.User)
         ModifyUser = aliased(models.User)
@@ -81,4 +87,11 @@ class EnrollmentPlan(ExportPlan):
             .order_by(models.Enrollment.id,
                       models.Study.title,
                       models.Patient.pid))
+
+        if since is not None:
+            query = query.filter(models.Enrollment.modify_date > since)
+
+        if after is not None:
+            query = query.filter(models.Enrollment.id > after)
+
         return query
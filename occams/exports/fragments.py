@@ -0,0 +1,232 @@
+"""
+Precomputed codebook fragments
+
+Published form versions rarely change, yet their codebook rows used to be
+rebuilt from every attribute and choice each time a codebook was needed.
+Instead, the rows of each published version are generated once (when the
+version is published) and stored as a JSON fragment, so that full
+codebooks become a concatenation of fragments.
+
+Each fragment records a fingerprint of the attributes and choices it was
+built from. Fragments that are missing or stale (e.g. a field of a
+published version was edited) are generated in memory when loaded and
+brought up to date by `refresh`.
+"""
+
+from collections import defaultdict
+from datetime import date, datetime
+import hashlib
+
+import sqlalchemy as sa
+from sqlalchemy import func, null
+
+from .. import models
+from .codebook import row
+
+
+def get_fingerprints(dbsession, ids=None, names=None):
+    """
+    Digests the attributes and choices of published schema versions
+
+    Parameters:
+    dbsession -- The database session to use
+    ids -- (Optional) Only include these schema ids
+    names -- (Optional) Only include versions of these schema names
+
+    Returns:
+    A dictionary of fingerprints, keyed by schema id
+    """
+    query = (
+        dbsession.query(
+            models.Schema.id,
+            models.Schema.modify_date,
+            func.max(models.Attribute.modify_date),
+            func.count(sa.distinct(models.Attribute.id)),
+            func.max(models.Choice.modify_date),
+            func.count(models.Choice.id))
+        .outerjoin(
+            models.Attribute, models.Attribute.schema_id == models.Schema.id)
+        .outerjoin(
+            models.Choice, models.Choice.attribute_id == models.Attribute.id)
+        .filter(models.Schema.publish_date != null())
+        .filter(models.Schema.retract_date == null())
+        .group_by(models.Schema.id, models.Schema.modify_date))
+
+    if ids is not None:
+        query = query.filter(models.Schema.id.in_(ids))
+
+    if names is not None:
+        query = query.filter(models.Schema.name.in_(names))
+
+    return dict(
+        (record[0], hashlib.sha1(repr(tuple(record)).encode('utf-8'))
+            .hexdigest())
+        for record in query)
+
+
+def generate(dbsession, ids):
+    """
+    Builds the codebook rows of schema versions
+
+    Attributes (with their schemata) and choices are each fetched in a
+    single query and assembled in memory, so the number of round trips
+    does not depend on the number of versions or attributes.
+
+    Parameters:
+    dbsession -- The database session to use
+    ids -- The schema ids to generate rows for
+
+    Returns:
+    A dictionary of JSON-serializable row lists (ordered by attribute
+    name), keyed by schema id
+    """
+    fragments = dict((id, []) for id in ids)
+
+    if not fragments:
+        return fragments
+
+    attributes = (
+        dbsession.query(
+            models.Attribute.id,
+            models.Attribute.name,
+            models.Attribute.type,
+            models.Attribute.decimal_places,
+            models.Attribute.title,
+            models.Attribute.description,
+            models.Attribute.is_required,
+            models.Attribute.is_collection,
+            models.Attribute.order,
+            models.Attribute.is_private,
+            models.Schema.id.label('schema_id'),
+            models.Schema.name.label('schema_name'),
+            models.Schema.title.label('schema_title'),
+            models.Schema.publish_date)
+        .select_from(models.Attribute)
+        .join(models.Schema, models.Attribute.schema_id == models.Schema.id)
+        .filter(models.Schema.id.in_(list(fragments)))
+        .order_by(models.Attribute.name, models.Attribute.id)
+        .all())
+
+    choices = defaultdict(list)
+    query = (
+        dbsession.query(
+            models.Choice.attribute_id,
+            models.Choice.name,
+            models.Choice.title)
+        .join(models.Attribute,
+              models.Choice.attribute_id == models.Attribute.id)
+        .filter(models.Attribute.schema_id.in_(list(fragments)))
+        .order_by(models.Choice.attribute_id, models.Choice.order))
+    for attribute_id, name, title in query:
+        choices[attribute_id].append([name, title])
+
+    for attribute in attributes:
+        fragments[attribute.schema_id].append(
+            row(attribute.name, attribute.schema_name, attribute.type,
+                decimal_places=attribute.decimal_places,
+                form=attribute.schema_title,
+                publish_date=attribute.publish_date.isoformat(),
+                title=attribute.title,
+                desc=attribute.description,
+                is_required=attribute.is_required,
+                is_collection=attribute.is_collection,
+                order=attribute.order,
+                is_private=attribute.is_private,
+                choices=choices[attribute.id]))
+
+    return fragments
+
+
+def refresh(dbsession, ids=None):
+    """
+    Stores fragments of published versions that are missing or stale
+
+    Parameters:
+    dbsession -- The database session to use
+    ids -- (Optional) Only refresh these schema ids
+
+    Returns:
+    The ids of the schemata whose fragments were (re)generated
+    """
+    # Serialize concurrent refreshes (e.g. publishing while the worker runs)
+    dbsession.execute(
+        sa.select([sa.func.pg_advisory_xact_lock(
+            sa.func.hashtext('codebook_fragment'))]))
+
+    fingerprints = get_fingerprints(dbsession, ids=ids)
+
+    existing = dict(
+        (fragment.schema_id, fragment) for fragment in (
+            dbsession.query(models.CodebookFragment)
+            .filter(models.CodebookFragment.schema_id.in_(
+                list(fingerprints)))))
+
+    stale = sorted(
+        id for id, fingerprint in fingerprints.items()
+        if id not in existing or existing[id].fingerprint != fingerprint)
+
+    for id, rows in generate(dbsession, stale).items():
+        fragment = existing.get(id)
+        if fragment is None:
+            fragment = models.CodebookFragment(schema_id=id)
+            dbsession.add(fragment)
+        fragment.fingerprint = fingerprints[id]
+        fragment.rows = rows
+        fragment.create_date = datetime.now()
+
+    dbsession.flush()
+    return stale
+
+
+def load(dbsession, names=None):
+    """
+    Loads the codebook rows of published versions
+
+    Missing or stale fragments are generated in memory, but not stored.
+
+    Parameters:
+    dbsession -- The database session to use
+    names -- (Optional) Only load versions of these schema names
+
+    Returns:
+    A dictionary of row lists, keyed by (schema name, publish date)
+    """
+    query = (
+        dbsession.query(
+            models.Schema.id,
+            models.Schema.name,
+            models.Schema.publish_date,
+            models.CodebookFragment.fingerprint,
+            models.CodebookFragment.rows)
+        .outerjoin(
+            models.CodebookFragment,
+            models.CodebookFragment.schema_id == models.Schema.id)
+        .filter(models.Schema.publish_date != null())
+        .filter(models.Schema.retract_date == null()))
+
+    if names is not None:
+        query = query.filter(models.Schema.name.in_(names))
+
+    records = query.all()
+    fingerprints = get_fingerprints(dbsession, names=names)
+
+    stale = [
+        record.id for record in records
+        if record.fingerprint != fingerprints.get(record.id)]
+    generated = generate(dbsession, stale)
+
+    return dict(
+        ((record.name, record.publish_date),
+         _decode(generated.get(record.id, record.rows)))
+        for record in records)
+
+
+def _decode(rows):
+    """
+    Restores the python types of JSON codebook rows
+    """
+    for column in rows:
+        if column['publish_date'] is not None:
+            column['publish_date'] = date.fromisoformat(column['publish_date'])
+        column['choices'] = [tuple(c) for c in column['choices']]
+    return rows
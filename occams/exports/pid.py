@@ -31,6 +31,12 @@ class PidPlan(ExportPlan):
 
     title = _(u'Patient Identifiers')
 
+    table_name = 'patient'
+
+    source_tables = (
+        'patient', 'site', 'patient_reference', 'reference_type',
+        'enrollment', 'study', 'account')
+
     @reify
     def reftypes(self):
         return list(
@@ -65,7 +71,9 @@ class PidPlan(ExportPlan):
     def data(self,
              use_choice_labels=False,
              expand_collections=False,
-             ignore_private=True):
+             ignore_private=True,
+             since=None,
+             after=None):
         session = self.dbsession
         query = (
             session.query(
@@ -117,4 +125,10 @@ class PidPlan(ExportPlan):
                 ModifyUser.key.label('modify_user'))
             .order_by(models.Patient.id))
 
+        if since is not None:
+            query = query.filter(models.Patient.modify_date > since)
+
+        if after is not None:
+            query = query.filter(models.Patient.id > after)
+
         return query
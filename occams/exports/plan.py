@@ -1,3 +1,19 @@
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import JSONB
+
+
+# Audit log maintained by the pg-audit-json extension.
+# Kept out of the application metadata as the extension manages this table.
+logged_actions = sa.Table(
+    'logged_actions',
+    sa.MetaData(schema='audit'),
+    sa.Column('event_id', sa.BigInteger, primary_key=True),
+    sa.Column('table_name', sa.String),
+    sa.Column('action', sa.String),
+    sa.Column('action_tstamp_tx', sa.DateTime(timezone=True)),
+    sa.Column('row_data', JSONB))
+
+
 class ExportPlan(object):
     """
     An export plan
@@ -14,12 +30,21 @@ class ExportPlan(object):
 
     versions = []           # All versions avaialble
 
+    table_name = None       # Source table of the exported records
+    source_tables = ()      # Tables whose changes affect the exported data
+
     def __init__(self, dbsession=None):
         self.dbsession = dbsession
 
     @property
     def file_name(self):
-        return self.name + '.csv'
+        return self.get_file_name()
+
+    def get_file_name(self, file_format='csv'):
+        """
+        Returns the data file name for the given output format
+        """
+        return self.name + '.' + file_format
 
     def codebook(self):
         """
@@ -33,7 +58,9 @@ class ExportPlan(object):
     def data(self,
              use_choice_labels=False,
              expand_collections=False,
-             ignore_private=True):
+             ignore_private=True,
+             since=None,
+             after=None):
         """
         Generate export data
 
@@ -45,12 +72,81 @@ class ExportPlan(object):
                               default: False
         ignore_private -- (Optional) De-identity private information
                           default: True
+        since -- (Optional) Only include records modified after this
+                 timestamp, for incremental exports
+                 default: None (all records)
+        after -- (Optional) Only include records with an id greater than
+                 this value, to resume from the last record written
+                 default: None (all records)
 
         Returns:
-        An iterator of row data
+        An iterator of row data, ordered by id
         """
         raise NotImplemented  # pragma: nocover
 
+    def iterchunks(self, chunk_size, after=None, **options):
+        """
+        Generate export data in bounded chunks
+
+        Each chunk is fetched with its own ``id > last_id LIMIT n`` query
+        (keyset pagination) rather than a single statement spanning the
+        whole export, so no snapshot is held for longer than one chunk.
+        Chunks may also be resumed from any id already written.
+
+        Parameters:
+        chunk_size -- the maximum number of rows to fetch at a time
+        after -- (Optional) Only include records with an id greater than
+                 this value
+        options -- see `data`
+
+        Returns:
+        An iterator of row lists, ordered by id. Rows sharing the same id
+        (e.g. one per visit cycle) are never split across chunks.
+        """
+        limit = chunk_size
+        while True:
+            rows = self.data(after=after, **options).limit(limit).all()
+
+            if len(rows) < limit:
+                if rows:
+                    yield rows
+                return
+
+            # The last id may have more rows beyond the limit
+            last_id = rows[-1].id
+            complete = [row for row in rows if row.id != last_id]
+
+            if not complete:
+                # A single record spans the entire chunk, widen until it fits
+                limit *= 2
+                continue
+
+            yield complete
+            after = complete[-1].id
+            limit = chunk_size
+
+    def deleted(self, since):
+        """
+        Lists records deleted since the given timestamp, according to the
+        audit log of the plan's source table
+
+        Parameters:
+        since -- timestamp of the previous export
+
+        Returns:
+        A query of (id, delete_date) rows
+        """
+        query = (
+            self.dbsession.query(
+                logged_actions.c.row_data['id'].astext.cast(sa.BigInteger)
+                .label('id'),
+                logged_actions.c.action_tstamp_tx.label('delete_date'))
+            .filter(logged_actions.c.table_name == self.table_name)
+            .filter(logged_actions.c.action == 'D')
+            .filter(logged_actions.c.action_tstamp_tx > since)
+            .order_by(logged_actions.c.event_id))
+        return query
+
     def to_json(self):
         """
         Serialize to JSON
@@ -8,14 +8,22 @@ Also incorporates:
 
 """
 
+from collections import namedtuple
 from datetime import datetime
-from sqlalchemy import orm, null, cast, String, literal_column
+import hashlib
+
+import sqlalchemy as sa
+from sqlalchemy import orm, func, null, cast, String, literal_column
+from sqlalchemy.dialects.postgresql import array_agg, aggregate_order_by
 
 
 from .. import models
-from .plan import ExportPlan
+from .plan import ExportPlan, logged_actions
 from .codebook import types, row
+from .fragments import load as load_fragments
 from ..reporting import build_report
+from ..report_tables import get_report
+from ..utils.cache import metadata_cache
 from ..utils.sql import group_concat, to_date
 
 
@@ -23,6 +31,13 @@ class SchemaPlan(ExportPlan):
 
     is_system = False
 
+    table_name = 'entity'
+
+    source_tables = (
+        'entity', 'context', 'schema', 'attribute', 'choice', 'state',
+        'account', 'patient', 'site', 'enrollment', 'study', 'visit',
+        'visit_cycle', 'cycle', 'stratum', 'arm', 'report_table')
+
     @classmethod
     def from_sql(cls, dbsession, record):
         """
@@ -50,19 +65,25 @@ class SchemaPlan(ExportPlan):
     def list_all(cls, dbsession, include_rand=True, include_private=True):
         """
         Lists all the schema plans
+
+        The catalog of exportable forms is cached until a form is
+        published, retracted or edited, or randomization data is uploaded.
         """
-        subquery = _list_schemata_info(dbsession).subquery()
-        query = dbsession.query(subquery)
+        catalog = metadata_cache.get_or_create(
+            catalog_cache_key(dbsession),
+            lambda: [r._asdict() for r in _list_schemata_info(dbsession)])
+
+        records = [CatalogEntry(**entry) for entry in catalog]
 
         if not include_rand:
-            query = query.filter(~subquery.c.has_rand)
+            records = [r for r in records if not r.has_rand]
 
         if not include_private:
-            query = query.filter(~subquery.c.has_private)
+            records = [r for r in records if not r.has_private]
 
-        query = query.order_by(subquery.c.title)
+        records.sort(key=lambda r: r.title)
 
-        return [cls.from_sql(dbsession, r) for r in query]
+        return [cls.from_sql(dbsession, r) for r in records]
 
     @property
     def _is_aeh_partner_form(self):
@@ -74,7 +95,18 @@ class SchemaPlan(ExportPlan):
                 'IPartnerDemographics',
                 'IPartnerDisclosure'))
 
-    def codebook(self):
+    def codebook(self, fragments=None):
+        """
+        Generate codebook data
+
+        Parameters:
+        fragments -- (Optional) Preloaded codebook fragments of published
+                     versions (see `occams.exports.fragments.load`),
+                     otherwise only this form's fragments are loaded
+
+        Returns:
+        An iterator or row codebook entries
+        """
         session = self.dbsession
         knowns = [
             row('id', self.name, types.NUMBER, decimal_places=0,
@@ -125,31 +157,18 @@ class SchemaPlan(ExportPlan):
         for column in knowns:
             yield column
 
-        query = (
-            session.query(models.Attribute)
-            .join(models.Schema)
-            .filter(models.Schema.name == self.name)
-            .filter(models.Schema.publish_date.in_(self.versions))
-            .filter(models.Schema.retract_date == null()))
+        if fragments is None:
+            fragments = load_fragments(session, names=[self.name])
 
-        query = (
-            query.order_by(
-                models.Attribute.name,
-                models.Schema.publish_date))
-
-        for attribute in query:
-            yield row(attribute.name, attribute.schema.name, attribute.type,
-                      decimal_places=attribute.decimal_places,
-                      form=attribute.schema.title,
-                      publish_date=attribute.schema.publish_date,
-                      title=attribute.title,
-                      desc=attribute.description,
-                      is_required=attribute.is_required,
-                      is_collection=attribute.is_collection,
-                      order=attribute.order,
-                      is_private=attribute.is_private,
-                      choices=[(c.name, c.title)
-                               for c in attribute.choices.values()])
+        columns = [
+            column
+            for version in self.versions
+            for column in fragments.get((self.name, version), [])]
+
+        # Rows are copied as fragments may be shared by several callers
+        for column in sorted(
+                columns, key=lambda c: (c['field'], c['publish_date'])):
+            yield dict(column)
 
         footer = [
             row('create_date', self.name, types.DATE,
@@ -164,231 +183,245 @@ class SchemaPlan(ExportPlan):
         for column in footer:
             yield column
 
+    def deleted(self, since):
+        ids_query = (
+            self.dbsession.query(models.Schema.id)
+            .filter(models.Schema.name == self.name)
+            .filter(models.Schema.publish_date.in_(self.versions)))
+        ids = [str(id) for id, in ids_query]
+        return (
+            super(SchemaPlan, self).deleted(since)
+            .filter(logged_actions.c.row_data['schema_id'].astext.in_(ids)))
+
     def data(self,
              use_choice_labels=False,
              expand_collections=False,
-             ignore_private=True):
+             ignore_private=True,
+             since=None,
+             after=None):
         session = self.dbsession
         ids_query = (
             session.query(models.Schema.id)
             .filter(models.Schema.publish_date.in_(self.versions)))
         ids = [id for id, in ids_query]
 
-        report = build_report(
-            session,
-            self.name,
-            ids=ids,
-            expand_collections=expand_collections,
-            use_choice_labels=use_choice_labels,
-            ignore_private=ignore_private)
+        report = None
+
+        # Materialized tables only store codes in unexpanded columns
+        if not use_choice_labels and not expand_collections:
+            report = get_report(
+                session,
+                self.name,
+                ids=ids,
+                ignore_private=ignore_private,
+                since=since,
+                after=after)
+
+        if report is None:
+            report = build_report(
+                session,
+                self.name,
+                ids=ids,
+                expand_collections=expand_collections,
+                use_choice_labels=use_choice_labels,
+                ignore_private=ignore_private,
+                since=since,
+                after=after)
+
+        # Each context lookup is computed once for all the entities of the
+        # schema versions (keyed by entity_id) then joined, rather than
+        # evaluating a correlated subquery per column for every row. The
+        # lookups do not read the report so it is not evaluated again.
+
+        def context_query(*columns):
+            return (
+                session.query(
+                    models.Context.entity_id.label('entity_id'), *columns)
+                .select_from(models.Context)
+                .join(models.Entity,
+                      models.Entity.id == models.Context.entity_id)
+                .filter(models.Entity.schema_id.in_(ids)))
+
+        patient = (
+            context_query(
+                models.Patient.pid.label('pid'),
+                models.Site.name.label('site'))
+            .join(models.Patient,
+                  (models.Context.external == u'patient')
+                  & (models.Context.key == models.Patient.id))
+            .join(models.Site, models.Patient.site)
+            .subquery('patient_context'))
+
+        enrollment = (
+            context_query(
+                group_concat(models.Study.name, ';').label('enrollment'),
+                group_concat(models.Enrollment.id, ';')
+                .label('enrollment_ids'))
+            .join(models.Enrollment,
+                  (models.Context.external == u'enrollment')
+                  & (models.Context.key == models.Enrollment.id))
+            .join(models.Study, models.Enrollment.study)
+            .group_by(models.Context.entity_id)
+            .subquery('enrollment_context'))
+
+        visit = (
+            context_query(
+                models.Visit.id.label('visit_id'),
+                models.Visit.visit_date.label('visit_date'))
+            .join(models.Visit,
+                  (models.Context.external == u'visit')
+                  & (models.Context.key == models.Visit.id))
+            .subquery('visit_context'))
+
+        visit_cycles = (
+            context_query(
+                group_concat(models.Study.title
+                             + literal_column(u"'('")
+                             + cast(models.Cycle.week, String)
+                             + literal_column(u"')'"),
+                             literal_column(u"';'")).label('visit_cycles'))
+            .join(models.Visit,
+                  (models.Context.external == u'visit')
+                  & (models.Context.key == models.Visit.id))
+            .join(models.Visit.cycles)
+            .join(models.Cycle.study)
+            .group_by(models.Context.entity_id)
+            .subquery('visit_cycles_context'))
 
         query = (
             session.query(report.c.id.label('id'))
+            .select_from(report)
+            .outerjoin(patient, patient.c.entity_id == report.c.id)
+            .outerjoin(enrollment, enrollment.c.entity_id == report.c.id)
             .add_columns(
-                session.query(models.Patient.pid)
-                .join(models.Context,
-                      (models.Context.external == u'patient')
-                      & (models.Context.key == models.Patient.id))
-                .filter(models.Context.entity_id == report.c.id)
-                .correlate(report)
-                .as_scalar()
-                .label('pid'))
-            .add_columns(
-                session.query(models.Site.name)
-                .select_from(models.Patient)
-                .join(models.Site)
-                .join(models.Context,
-                      (models.Context.external == u'patient')
-                      & (models.Context.key == models.Patient.id))
-                .filter(models.Context.entity_id == report.c.id)
-                .correlate(report)
-                .as_scalar()
-                .label('site'))
-            .add_columns(
-                session.query(group_concat(models.Study.name, ';'))
-                .select_from(models.Enrollment)
-                .join(models.Study)
-                .join(models.Context,
-                      (models.Context.external == u'enrollment')
-                      & (models.Context.key == models.Enrollment.id))
-                .filter(models.Context.entity_id == report.c.id)
-                .group_by(models.Context.entity_id)
-                .correlate(report)
-                .as_scalar()
-                .label('enrollment'))
-            .add_columns(
-                session.query(group_concat(models.Enrollment.id, ';'))
-                .select_from(models.Enrollment)
-                .join(models.Context,
-                      (models.Context.external == u'enrollment')
-                      & (models.Context.key == models.Enrollment.id))
-                .filter(models.Context.entity_id == report.c.id)
-                .group_by(models.Context.entity_id)
-                .correlate(report)
-                .as_scalar()
-                .label('enrollment_ids'))
-            )
+                patient.c.pid,
+                patient.c.site,
+                enrollment.c.enrollment,
+                enrollment.c.enrollment_ids))
 
         if self._is_aeh_partner_form:
             PartnerPatient = orm.aliased(models.Patient)
+            partner = (
+                context_query(
+                    models.Partner.id.label('partner_id'),
+                    PartnerPatient.pid.label('partner_pid'))
+                .join(models.Partner,
+                      (models.Context.external == u'partner')
+                      & (models.Context.key == models.Partner.id))
+                .outerjoin(PartnerPatient, models.Partner.enrolled_patient)
+                .subquery('partner_context'))
             query = (
                 query
-                .add_columns(
-                    session.query(models.Partner.id)
-                    .select_from(models.Partner)
-                    .join(models.Context,
-                          (models.Context.external == u'partner')
-                          & (models.Context.key == models.Partner.id))
-                    .filter(models.Context.entity_id == report.c.id)
-                    .correlate(report)
-                    .as_scalar()
-                    .label('partner_id'))
-                .add_columns(
-                    session.query(PartnerPatient.pid)
-                    .select_from(models.Partner)
-                    .join(PartnerPatient, models.Partner.enrolled_patient)
-                    .join(models.Context,
-                          (models.Context.external == u'partner')
-                          & (models.Context.key == models.Partner.id))
-                    .filter(models.Context.entity_id == report.c.id)
-                    .correlate(report)
-                    .as_scalar()
-                    .label('partner_pid')))
+                .outerjoin(partner, partner.c.entity_id == report.c.id)
+                .add_columns(partner.c.partner_id, partner.c.partner_pid))
 
         if self.has_rand:
+            stratum = (
+                context_query(
+                    models.Stratum.block_number.label('block_number'),
+                    models.Stratum.randid.label('randid'),
+                    models.Arm.title.label('arm_name'))
+                .join(models.Stratum,
+                      (models.Context.external == u'stratum')
+                      & (models.Context.key == models.Stratum.id))
+                .join(models.Stratum.arm)
+                .subquery('stratum_context'))
             query = (
                 query
+                .outerjoin(stratum, stratum.c.entity_id == report.c.id)
                 .add_columns(
-                    session.query(models.Stratum.block_number)
-                    .select_from(models.Stratum)
-                    .join(models.Context,
-                          (models.Context.external == u'stratum')
-                          & (models.Context.key == models.Stratum.id))
-                    .filter(models.Context.entity_id == report.c.id)
-                    .correlate(report)
-                    .as_scalar()
-                    .label('block_number'))
-                .add_columns(
-                    session.query(models.Stratum.randid)
-                    .select_from(models.Stratum)
-                    .join(models.Context,
-                          (models.Context.external == u'stratum')
-                          & (models.Context.key == models.Stratum.id))
-                    .filter(models.Context.entity_id == report.c.id)
-                    .correlate(report)
-                    .as_scalar()
-                    .label('randid'))
-                .add_columns(
-                    session.query(models.Arm.title)
-                    .select_from(models.Stratum)
-                    .join(models.Context,
-                          (models.Context.external == u'stratum')
-                          & (models.Context.key == models.Stratum.id))
-                    .filter(models.Context.entity_id == report.c.id)
-                    .join(models.Stratum.arm)
-                    .correlate(report)
-                    .as_scalar()
-                    .label('arm_name')))
+                    stratum.c.block_number,
+                    stratum.c.randid,
+                    stratum.c.arm_name))
 
         query = (
             query
+            .outerjoin(visit_cycles, visit_cycles.c.entity_id == report.c.id)
+            .outerjoin(visit, visit.c.entity_id == report.c.id)
             .add_columns(
-                session.query(group_concat(models.Study.title
-                                           + literal_column(u"'('")
-                                           + cast(models.Cycle.week, String)
-                                           + literal_column(u"')'"),
-                                           literal_column(u"';'")))
-                .select_from(models.Visit)
-                .join(models.Visit.cycles)
-                .join(models.Cycle.study)
-                .join(models.Context,
-                      (models.Context.external == u'visit')
-                      & (models.Context.key == models.Visit.id))
-                .filter(models.Context.entity_id == report.c.id)
-                .group_by(models.Context.entity_id)
-                .correlate(report)
-                .as_scalar()
-                .label('visit_cycles'))
-            .add_columns(
-                session.query(models.Visit.id)
-                .select_from(models.Visit)
-                .join(models.Context,
-                      (models.Context.external == u'visit')
-                      & (models.Context.key == models.Visit.id))
-                .filter(models.Context.entity_id == report.c.id)
-                .correlate(report)
-                .as_scalar()
-                .label('visit_id'))
-            .add_columns(
-                session.query(models.Visit.visit_date)
-                .select_from(models.Visit)
-                .join(models.Context,
-                      (models.Context.external == u'visit')
-                      & (models.Context.key == models.Visit.id))
-                .filter(models.Context.entity_id == report.c.id)
-                .correlate(report)
-                .as_scalar()
-                .label('visit_date'))
-        )
+                visit_cycles.c.visit_cycles,
+                visit.c.visit_id,
+                visit.c.visit_date))
 
         query = query.add_columns(
             *[c for c in report.columns if c.name != 'id'])
 
+        query = query.order_by(report.c.id)
+
         return query
 
 
+CatalogEntry = namedtuple(
+    'CatalogEntry',
+    ['name', 'type', 'has_private', 'has_rand', 'title', 'versions'])
+
+
+def catalog_cache_key(dbsession):
+    """
+    Generates a metadata cache key for the catalog of exportable forms
+
+    The key is a digest of the row counts and latest modification
+    timestamps of the schema, attribute and stratum tables, which are
+    small compared to the entity table the catalog is derived from.
+
+    Returns:
+    A string key for `occams.utils.cache.metadata_cache`
+    """
+    def stats(model):
+        return [
+            sa.select([func.count(model.id)]).as_scalar(),
+            sa.select([func.max(model.modify_date)]).as_scalar()]
+
+    record = dbsession.query(*(
+        stats(models.Schema)
+        + stats(models.Attribute)
+        + stats(models.Stratum))).one()
+
+    digest = hashlib.sha1(repr(tuple(record)).encode('utf-8')).hexdigest()
+
+    return ':'.join([
+        str(dbsession.get_bind().engine.url.database), 'catalog', digest])
+
+
 def _list_schemata_info(dbsession):
-    InnerSchema = orm.aliased(models.Schema)
-    OuterSchema = orm.aliased(models.Schema)
+    """
+    Summarizes the published forms in a single grouped query
+    """
+    private = (
+        dbsession.query(models.Schema.name.label('name'))
+        .join(models.Attribute,
+              models.Attribute.schema_id == models.Schema.id)
+        .filter(models.Attribute.is_private)
+        .distinct()
+        .subquery())
+
+    # Randomization forms are the few that are linked to strata
+    rand = (
+        dbsession.query(models.Schema.name.label('name'))
+        .select_from(models.Stratum)
+        .join(models.Context,
+              (models.Context.external == 'stratum')
+              & (models.Context.key == models.Stratum.id))
+        .join(models.Entity, models.Entity.id == models.Context.entity_id)
+        .join(models.Schema, models.Schema.id == models.Entity.schema_id)
+        .distinct()
+        .subquery())
 
     schemata_query = (
-        dbsession.query(OuterSchema.name.label('name'))
-        .add_columns(literal_column("'schema'").label('type'))
-        .add_columns(
-            dbsession.query(models.Attribute)
-            .filter(models.Attribute.is_private)
-            .join(InnerSchema)
-            .filter(InnerSchema.name == OuterSchema.name)
-            .correlate(OuterSchema)
-            .exists()
-            .label('has_private'))
-        .add_columns(
-            dbsession.query(models.Entity)
-            .join(models.Entity.contexts)
-            .filter(models.Context.external == 'stratum')
-            .join(models.Stratum, models.Context.key == models.Stratum.id)
-            .join(InnerSchema, models.Entity.schema)
-            .filter(InnerSchema.name == OuterSchema.name)
-            .correlate(OuterSchema)
-            .exists()
-            .label('has_rand'))
-        .add_columns(
-            dbsession.query(InnerSchema.title)
-            .select_from(InnerSchema)
-            .filter(InnerSchema.name == OuterSchema.name)
-            .filter(InnerSchema.publish_date != null())
-            .filter(InnerSchema.retract_date == null())
-            .order_by(InnerSchema.publish_date.desc())
-            .limit(1)
-            .correlate(OuterSchema)
-            .as_scalar()
-            .label('title'))
-        .add_columns(
-            dbsession.query(
-                group_concat(to_date(InnerSchema.publish_date), ';'))
-            .filter(InnerSchema.name == OuterSchema.name)
-            .filter(InnerSchema.publish_date != null())
-            .filter(InnerSchema.retract_date == null())
-            .group_by(InnerSchema.name)
-            .correlate(OuterSchema)
-            .as_scalar()
+        dbsession.query(
+            models.Schema.name.label('name'),
+            literal_column("'schema'").label('type'),
+            func.bool_or(private.c.name != null()).label('has_private'),
+            func.bool_or(rand.c.name != null()).label('has_rand'),
+            array_agg(aggregate_order_by(
+                models.Schema.title, models.Schema.publish_date.desc()))[1]
+            .label('title'),
+            group_concat(to_date(models.Schema.publish_date), ';')
             .label('versions'))
-        .filter(OuterSchema.publish_date != null())
-        .filter(OuterSchema.retract_date == null()))
-
-    schemata_query = (
-        schemata_query
-        .group_by(OuterSchema.name)
-        .from_self())
+        .outerjoin(private, private.c.name == models.Schema.name)
+        .outerjoin(rand, rand.c.name == models.Schema.name)
+        .filter(models.Schema.publish_date != null())
+        .filter(models.Schema.retract_date == null())
+        .group_by(models.Schema.name))
 
     return schemata_query
@@ -0,0 +1,363 @@
+"""
+Export archive storage
+
+Finished export archives are kept either in the local export directory or
+in an S3-compatible object store (AWS S3, MinIO, etc). Individual data
+files are still staged in the local export directory while an export is
+being generated, only the final archive is handed to the storage backend.
+
+Settings:
+studies.export.storage -- ``local`` (default) or ``s3``
+studies.export.accel_redirect -- (local) internal nginx location that
+                                 serves the export directory, so that
+                                 downloads do not occupy a web worker
+studies.export.s3.bucket -- (s3) bucket name
+studies.export.s3.prefix -- (s3) key prefix for archives
+studies.export.s3.endpoint_url -- (s3) URL of an S3-compatible service
+studies.export.s3.region -- (s3) region name
+studies.export.s3.access_key -- (s3) access key id, otherwise boto3's
+                                default credentials are used
+studies.export.s3.secret_key -- (s3) secret access key
+studies.export.s3.part_size -- (s3) multipart upload chunk size in bytes
+studies.export.s3.url_expire -- (s3) seconds download links are valid
+"""
+
+from contextlib import contextmanager
+import io
+import os
+import threading
+
+from pyramid.httpexceptions import HTTPFound
+from pyramid.response import FileIter, FileResponse
+
+
+# S3 does not allow multipart upload parts (except the last) under 5 MiB
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+# Storage instances shared by the application, keyed by their settings
+_instances = {}
+_lock = threading.Lock()
+
+# Bytes read at a time when sending files
+BLOCK_SIZE = 1024 * 1024
+
+
+class RangeFileIter(FileIter):
+    """
+    File iterator that seeks to requested byte ranges
+
+    WebOb otherwise serves a range by reading (and discarding) everything
+    that precedes it.
+    """
+
+    remaining = None
+
+    def app_iter_range(self, start, stop):
+        start = start or 0
+        self.file.seek(start)
+        if stop is not None:
+            self.remaining = stop - start
+        return self
+
+    def __next__(self):
+        size = self.block_size
+        if self.remaining is not None:
+            size = min(size, self.remaining)
+        data = self.file.read(size) if size else b''
+        if not data:
+            raise StopIteration
+        if self.remaining is not None:
+            self.remaining -= len(data)
+        return data
+
+    next = __next__
+
+
+class DownloadResponse(FileResponse):
+    """
+    File download that supports conditional (304) and range (206) requests
+
+    The entity tag is derived from the given key and the file's
+    modification time and size, so clients revalidate cheaply and resume
+    interrupted transfers of the same file.
+    """
+
+    def __init__(self, path, file_name, key, content_type=None):
+        """
+        Parameters:
+        path -- the file to send
+        file_name -- the name suggested to the client
+        key -- a name that identifies the file (e.g. the export name)
+        content_type -- (Optional) guessed from the path otherwise
+        """
+        super(DownloadResponse, self).__init__(path, content_type=content_type)
+        self.app_iter = RangeFileIter(self.app_iter.file, BLOCK_SIZE)
+        stat = os.stat(path)
+        # Replacing the iterator resets the length, which range requests need
+        self.content_length = stat.st_size
+        self.etag = '{}-{:x}-{:x}'.format(key, stat.st_mtime_ns, stat.st_size)
+        self.accept_ranges = 'bytes'
+        # Clients may keep a copy but must check that it is still current
+        self.cache_control = 'private, no-cache'
+        self.content_disposition = 'attachment;filename=%s' % file_name
+
+
+class LocalStorage(object):
+    """
+    Stores archives in a local directory
+    """
+
+    def __init__(self, directory, accel_redirect=None):
+        """
+        Parameters:
+        directory -- where archives are stored
+        accel_redirect -- (Optional) nginx internal location of directory
+        """
+        self.directory = directory
+        self.accel_redirect = accel_redirect
+
+    def get_path(self, name):
+        return os.path.join(self.directory, name)
+
+    @contextmanager
+    def open(self, name):
+        """
+        Opens an archive for writing
+
+        The archive only becomes visible once it has been written
+        completely.
+        """
+        path = self.get_path(name)
+        staging = path + '.partial'
+        try:
+            with open(staging, 'wb') as fp:
+                yield fp
+        except:
+            if os.path.exists(staging):
+                os.unlink(staging)
+            raise
+        os.replace(staging, path)
+
+    def size(self, name):
+        """
+        Returns the size in bytes of an archive, or None if it does not exist
+        """
+        try:
+            return os.path.getsize(self.get_path(name))
+        except FileNotFoundError:
+            return None
+
+    def delete(self, name):
+        """
+        Removes an archive (if it exists)
+        """
+        try:
+            os.unlink(self.get_path(name))
+        except FileNotFoundError:
+            pass
+
+    def make_response(self, request, name, file_name):
+        """
+        Generates a download response for an archive
+        """
+        if self.accel_redirect:
+            # Let nginx send the file
+            response = request.response
+            response.content_type = 'application/octet-stream'
+            response.headers['X-Accel-Redirect'] = \
+                self.accel_redirect.rstrip('/') + '/' + name
+            response.content_disposition = \
+                'attachment;filename=%s' % file_name
+            return response
+        return DownloadResponse(
+            self.get_path(name), file_name, name,
+            content_type='application/zip')
+
+
+class S3Storage(object):
+    """
+    Stores archives in an S3-compatible bucket
+
+    Archives are written through multipart uploads so they never need to
+    fit in memory or on local disk, and downloads are redirected to
+    short-lived signed URLs so the object store serves (ranged) reads.
+    """
+
+    def __init__(self, client, bucket, prefix='', part_size=MIN_PART_SIZE,
+                 url_expire=300):
+        """
+        Parameters:
+        client -- boto3 S3 client
+        bucket -- bucket name
+        prefix -- (Optional) key prefix for archives
+        part_size -- (Optional) bytes uploaded per multipart upload part
+        url_expire -- (Optional) seconds download links are valid
+        """
+        if part_size < MIN_PART_SIZE:
+            raise ValueError('Parts must be at least %d bytes' % MIN_PART_SIZE)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.part_size = part_size
+        self.url_expire = url_expire
+
+    def get_key(self, name):
+        return self.prefix + name
+
+    @contextmanager
+    def open(self, name):
+        """
+        Opens an archive for writing
+
+        The upload is aborted if writing fails, so incomplete archives are
+        never visible.
+        """
+        writer = _MultipartWriter(
+            self.client, self.bucket, self.get_key(name), self.part_size)
+        try:
+            yield writer
+        except:
+            writer.abort()
+            raise
+        writer.complete()
+
+    def size(self, name):
+        """
+        Returns the size in bytes of an archive, or None if it does not exist
+        """
+        try:
+            response = self.client.head_object(
+                Bucket=self.bucket, Key=self.get_key(name))
+        except self.client.exceptions.ClientError as exc:
+            if exc.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+                return None
+            raise
+        return response['ContentLength']
+
+    def delete(self, name):
+        """
+        Removes an archive (deleting missing objects is not an error in S3)
+        """
+        self.client.delete_object(Bucket=self.bucket, Key=self.get_key(name))
+
+    def make_response(self, request, name, file_name):
+        """
+        Redirects to a signed download URL of an archive
+        """
+        url = self.client.generate_presigned_url(
+            'get_object',
+            Params={
+                'Bucket': self.bucket,
+                'Key': self.get_key(name),
+                'ResponseContentDisposition':
+                    'attachment;filename=%s' % file_name,
+            },
+            ExpiresIn=self.url_expire)
+        return HTTPFound(location=url)
+
+
+class _MultipartWriter(io.RawIOBase):
+    """
+    Write-only stream that uploads its contents in fixed-size parts
+    """
+
+    def __init__(self, client, bucket, key, part_size):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.parts = []
+        self._buffer = bytearray()
+        self._upload_id = client.create_multipart_upload(
+            Bucket=bucket, Key=key)['UploadId']
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self.part_size:
+            self._upload_part(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+        return len(data)
+
+    def _upload_part(self, body):
+        number = len(self.parts) + 1
+        response = self.client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self._upload_id,
+            PartNumber=number,
+            Body=body)
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': number})
+
+    def complete(self):
+        # The last part may be smaller (and uploads need at least one part)
+        if self._buffer or not self.parts:
+            self._upload_part(bytes(self._buffer))
+            self._buffer = bytearray()
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self._upload_id,
+            MultipartUpload={'Parts': self.parts})
+
+    def abort(self):
+        self.client.abort_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+
+
+def from_settings(settings):
+    """
+    Creates the storage backend configured in application settings
+    """
+    backend = settings.get('studies.export.storage', 'local')
+
+    if backend == 'local':
+        return LocalStorage(
+            _require(settings, 'studies.export.dir'),
+            accel_redirect=settings.get('studies.export.accel_redirect'))
+
+    if backend == 's3':
+        # Optional dependency, see the "s3" extra
+        import boto3
+
+        client = boto3.client(
+            's3',
+            endpoint_url=settings.get('studies.export.s3.endpoint_url'),
+            region_name=settings.get('studies.export.s3.region'),
+            aws_access_key_id=settings.get('studies.export.s3.access_key'),
+            aws_secret_access_key=settings.get('studies.export.s3.secret_key'))
+        return S3Storage(
+            client,
+            _require(settings, 'studies.export.s3.bucket'),
+            prefix=settings.get('studies.export.s3.prefix', ''),
+            part_size=int(settings.get(
+                'studies.export.s3.part_size', 8 * 1024 * 1024)),
+            url_expire=int(settings.get('studies.export.s3.url_expire', 300)))
+
+    raise ValueError('Unsupported export storage: %s' % backend)
+
+
+def get_storage(settings):
+    """
+    Returns the application's storage backend, creating it on first use
+
+    Backends are shared by everything configured with the same export
+    settings (e.g. the web application and the celery worker).
+    """
+    key = tuple(sorted(
+        (name, str(value)) for name, value in settings.items()
+        if name.startswith('studies.export.')))
+    with _lock:
+        storage = _instances.get(key)
+        if storage is None:
+            storage = _instances[key] = from_settings(settings)
+    return storage
+
+
+def _require(settings, name):
+    value = settings.get(name)
+    if not value:
+        raise ValueError('Export storage setting is missing: %s' % name)
+    return value
@@ -17,6 +17,12 @@ class VisitPlan(ExportPlan):
 
     title = _(u'Visits')
 
+    table_name = 'visit'
+
+    source_tables = (
+        'visit', 'visit_cycle', 'cycle', 'study', 'patient', 'site',
+        'account')
+
     def codebook(self):
         return iter([
             row('id', self.name, types.NUMBER, decimal_places=0,
@@ -42,7 +48,9 @@ class VisitPlan(ExportPlan):
     def data(self,
              use_choice_labels=False,
              expand_collections=False,
-             ignore_private=True):
+             ignore_private=True,
+             since=None,
+             after=None):
         session = self.dbsession
         CreateUser = aliased(models.User)
         ModifyUser = aliased(models.User)
@@ -67,4 +75,11 @@ class VisitPlan(ExportPlan):
             .join(CreateUser, models.Visit.create_user)
             .join(ModifyUser, models.Visit.modify_user)
             .order_by(models.Visit.id))
+
+        if since is not None:
+            query = query.filter(models.Visit.modify_date > since)
+
+        if after is not None:
+            query = query.filter(models.Visit.id > after)
+
         return query
@@ -0,0 +1,422 @@
+"""
+Bulk import of form data files
+
+Loads a CSV or Parquet file of form data into entities of a single
+published version. Besides one column per attribute, each row identifies
+the patient (``pid``) and optionally the visit (``visit_date``) the form
+belongs to, as well as its ``collect_date`` and ``not_done`` flag. This is
+the same layout as export data files, so exports can be loaded back as is
+(multiple choice values are separated by semicolons).
+
+Files are processed in chunks: every column of a chunk is validated at
+once against the version's compiled validator (see
+`occams.bulk.get_validator`), patients and visits are resolved with one
+query per chunk, and accepted rows are written to the ``entity`` and
+``context`` tables with PostgreSQL's ``COPY``. Rows that fail validation
+are skipped and reported rather than aborting the import.
+"""
+
+import csv
+from datetime import date, datetime
+import io
+import json
+
+from sqlalchemy import null
+
+from . import models
+from .bulk import get_validator, reserve_ids, validate_value, parse_date
+from .exc import ImportFileError
+from .renderers import states
+
+
+# Columns that describe an entity rather than its data
+METADATA_COLUMNS = ('pid', 'visit_date', 'collect_date', 'not_done')
+
+# Columns of export data files that are ignored on import
+IGNORED_COLUMNS = (
+    'id', 'form_name', 'form_publish_date', 'state', 'site', 'enrollment',
+    'enrollment_ids', 'visit_cycles', 'visit_id', 'partner_id',
+    'partner_pid', 'block_number', 'randid', 'arm_name', 'create_date',
+    'create_user', 'modify_date', 'modify_user')
+
+TRUE_VALUES = ('1', 'true', 't', 'yes', 'y')
+FALSE_VALUES = ('0', 'false', 'f', 'no', 'n')
+
+
+class Result(object):
+    """
+    Summary of an import
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.rejected = []
+
+    def reject(self, line, errors):
+        self.rejected.append((line, errors))
+
+    def to_json(self):
+        return {
+            'rows': self.rows,
+            'imported': self.imported,
+            'rejected': len(self.rejected),
+        }
+
+
+def import_file(dbsession, path, schema_name, publish_date,
+                file_format=None, state=states.PENDING_REVIEW,
+                chunk_size=10000, delimiter=';'):
+    """
+    Imports a data file into entities of a published version
+
+    Parameters:
+    dbsession -- The database session to use
+    path -- path to the CSV or Parquet file
+    schema_name -- The name of the form
+    publish_date -- The publish date of the version
+    file_format -- (Optional) ``csv`` or ``parquet``, otherwise guessed
+                   from the file extension
+    state -- (Optional) workflow state of the imported entities
+    chunk_size -- (Optional) number of rows validated and written at a time
+    delimiter -- (Optional) separates multiple choice values in CSV files
+
+    Returns:
+    A `Result` listing the (1-based) line numbers and error messages of
+    rejected rows
+    """
+    if file_format is None:
+        file_format = 'parquet' if path.endswith('.parquet') else 'csv'
+
+    schema_id = (
+        dbsession.query(models.Schema.id)
+        .filter(models.Schema.name == schema_name)
+        .filter(models.Schema.publish_date == publish_date)
+        .filter(models.Schema.publish_date != null())
+        .filter(models.Schema.retract_date == null())
+        .scalar())
+
+    if schema_id is None:
+        raise ImportFileError(
+            'No published version of %s on %s' % (schema_name, publish_date))
+
+    state_id = (
+        dbsession.query(models.State.id)
+        .filter_by(name=state)
+        .scalar())
+
+    if state_id is None:
+        raise ImportFileError('Unknown state: %s' % state)
+
+    validator = get_validator(dbsession, schema_id, schema_name)
+
+    if file_format == 'parquet':
+        chunks = _read_parquet(path, chunk_size)
+    else:
+        chunks = _read_csv(path, chunk_size)
+
+    result = Result()
+    header = None
+
+    for names, columns in chunks:
+        if header is None:
+            header = names
+            _check_header(header, validator)
+
+        count = len(columns[names[0]]) if names else 0
+        first_line = result.rows + 1
+        result.rows += count
+
+        entities, errors = _validate_chunk(
+            dbsession, columns, count, validator, delimiter)
+
+        for index in sorted(errors):
+            result.reject(first_line + index, errors[index])
+
+        accepted = [entities[i] for i in range(count) if i not in errors]
+        _copy_entities(dbsession, schema_id, state_id, accepted)
+        result.imported += len(accepted)
+
+    return result
+
+
+def write_rejected(buffer, result):
+    """
+    Writes the rejected rows of an import as CSV (line, field, message)
+    """
+    writer = csv.writer(buffer)
+    writer.writerow(['line', 'field', 'message'])
+    for line, errors in result.rejected:
+        for field, message in sorted(errors.items()):
+            writer.writerow([line, field, message])
+
+
+def _check_header(header, validator):
+    missing = [name for name in ('pid', 'collect_date') if name not in header]
+    if missing:
+        raise ImportFileError('Missing columns: %s' % ', '.join(missing))
+    unknown = [
+        name for name in header
+        if name not in validator
+        and name not in METADATA_COLUMNS
+        and name not in IGNORED_COLUMNS]
+    if unknown:
+        raise ImportFileError('Unknown columns: %s' % ', '.join(unknown))
+
+
+def _read_csv(path, chunk_size):
+    """
+    Generates (column names, {name: values}) chunks of a CSV file
+    """
+    with open(path, newline='') as fp:
+        reader = csv.reader(fp)
+        names = next(reader, [])
+        while True:
+            rows = [row for _, row in zip(range(chunk_size), reader)]
+            if not rows:
+                break
+            for row in rows:
+                # Pad short rows so every column has the same length
+                row.extend([''] * (len(names) - len(row)))
+            yield names, dict(zip(names, zip(*rows)))
+
+
+def _read_parquet(path, chunk_size):
+    """
+    Generates (column names, {name: values}) chunks of a Parquet file
+
+    Requires the optional ``pyarrow`` package.
+    """
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(path)
+    names = parquet_file.schema_arrow.names
+    for batch in parquet_file.iter_batches(batch_size=chunk_size):
+        yield names, batch.to_pydict()
+
+
+def _validate_chunk(dbsession, columns, count, validator, delimiter):
+    """
+    Validates a chunk of rows, one column at a time
+
+    Returns:
+    A list of entity rows and a dictionary of errors by row index
+    """
+    errors = {}
+
+    def error(index, field, message):
+        errors.setdefault(index, {})[field] = str(message)
+
+    pids = columns['pid']
+    collect_dates = _convert_column(
+        columns['collect_date'], _to_date, 'collect_date', error)
+    visit_dates = _convert_column(
+        columns.get('visit_date', [None] * count), _to_date,
+        'visit_date', error)
+    not_done = _convert_column(
+        columns.get('not_done', [None] * count),
+        lambda v: bool(_to_boolean(v)), 'not_done', error)
+
+    for index in range(count):
+        if collect_dates[index] is None \
+                and 'collect_date' not in errors.get(index, {}):
+            error(index, 'collect_date', 'This field is required')
+
+    patients, visits = _resolve_parents(dbsession, pids, visit_dates)
+
+    data = [{} for _ in range(count)]
+
+    for name, attribute in validator.items():
+        if name not in columns:
+            continue
+
+        def convert(value, attribute=attribute):
+            value = _prepare(attribute, value, delimiter)
+            return None if value is None \
+                else validate_value(attribute, value)
+
+        values = _convert_column(columns[name], convert, name, error)
+        for index, value in enumerate(values):
+            data[index][name] = value
+
+    entities = []
+
+    for index in range(count):
+        patient_id = patients.get(_as_text(pids[index]))
+        if patient_id is None:
+            error(index, 'pid', 'Patient not found')
+
+        visit_id = None
+        if visit_dates[index] is not None and patient_id is not None:
+            visit_id = visits.get((patient_id, visit_dates[index]))
+            if visit_id is None:
+                error(index, 'visit_date', 'Visit not found')
+
+        if not not_done[index]:
+            for name, attribute in validator.items():
+                if attribute.is_required and data[index].get(name) is None:
+                    errors.setdefault(index, {}).setdefault(
+                        name, 'This field is required')
+        else:
+            data[index] = {}
+
+        entities.append({
+            'patient_id': patient_id,
+            'visit_id': visit_id,
+            'collect_date': collect_dates[index],
+            'not_done': bool(not_done[index]),
+            'data': data[index],
+        })
+
+    return entities, errors
+
+
+def _convert_column(values, convert, name, error):
+    """
+    Converts the values of a column, recording errors by row index
+    """
+    converted = []
+    for index, value in enumerate(values):
+        if value is None or value == '':
+            converted.append(None)
+            continue
+        try:
+            converted.append(convert(value))
+        except (TypeError, ValueError) as exc:
+            error(index, name, exc.args[0] if exc.args else 'Invalid value')
+            converted.append(None)
+    return converted
+
+
+def _prepare(attribute, value, delimiter):
+    """
+    Normalizes a file value into the JSON value `occams.bulk` expects
+    """
+    if value is None or value == '':
+        return None
+
+    if attribute.is_collection:
+        if isinstance(value, str):
+            value = [v for v in value.split(delimiter) if v != '']
+        return [_prepare_scalar(attribute, v) for v in value] or None
+
+    return _prepare_scalar(attribute, value)
+
+
+def _prepare_scalar(attribute, value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if attribute.type == 'boolean':
+        return _to_boolean(value)
+    return value
+
+
+def _to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return parse_date(value)
+
+
+def _to_boolean(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise ValueError('Expected true or false')
+
+
+def _as_text(value):
+    return None if value is None else str(value)
+
+
+def _resolve_parents(dbsession, pids, visit_dates):
+    """
+    Looks up the patients and visits referenced by a chunk
+
+    Returns:
+    Patient ids keyed by pid and visit ids keyed by (patient id, date)
+    """
+    pids = set(_as_text(pid) for pid in pids if pid not in (None, ''))
+
+    if not pids:
+        return {}, {}
+
+    patients = dict(
+        dbsession.query(models.Patient.pid, models.Patient.id)
+        .filter(models.Patient.pid.in_(pids)))
+
+    visits = {}
+    dates = set(d for d in visit_dates if d is not None)
+    if dates and patients:
+        query = (
+            dbsession.query(
+                models.Visit.patient_id,
+                models.Visit.visit_date,
+                models.Visit.id)
+            .filter(models.Visit.patient_id.in_(list(patients.values())))
+            .filter(models.Visit.visit_date.in_(dates)))
+        visits = dict(
+            ((patient_id, visit_date), id)
+            for patient_id, visit_date, id in query)
+
+    return patients, visits
+
+
+def _copy_entities(dbsession, schema_id, state_id, entities):
+    """
+    Writes entities and their contexts with COPY
+    """
+    if not entities:
+        return
+
+    now = datetime.now()
+    ids = reserve_ids(dbsession, models.Entity, len(entities))
+
+    entity_rows = []
+    context_rows = []
+
+    for id, entity in zip(ids, entities):
+        entity_rows.append([
+            id, schema_id, state_id, entity['collect_date'],
+            't' if entity['not_done'] else 'f',
+            json.dumps(entity['data']), now, now])
+        context_rows.append([
+            id, models.Patient.__tablename__, entity['patient_id'], now, now])
+        if entity['visit_id'] is not None:
+            context_rows.append([
+                id, models.Visit.__tablename__, entity['visit_id'], now, now])
+
+    _copy(dbsession, models.Entity.__table__, [
+        'id', 'schema_id', 'state_id', 'collect_date', 'not_done', 'data',
+        'create_date', 'modify_date'], entity_rows)
+    _copy(dbsession, models.Context.__table__, [
+        'entity_id', 'external', 'key', 'create_date', 'modify_date'],
+        context_rows)
+
+
+def _copy(dbsession, table, columns, rows):
+    """
+    Loads rows into a table using the session's connection
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+
+    connection = dbsession.connection()
+    preparer = connection.dialect.identifier_preparer
+    statement = 'COPY {} ({}) FROM STDIN WITH CSV'.format(
+        preparer.format_table(table),
+        ', '.join(preparer.quote(c) for c in columns))
+
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(statement, buffer)
+    finally:
+        cursor.close()
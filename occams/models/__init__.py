@@ -53,7 +53,9 @@ from .schema import (  # noqa
     Schema,
     Category,
     Attribute,
-    Choice
+    Choice,
+    ReportTable,
+    CodebookFragment
 )
 
 from .metadata import User  # noqa
@@ -67,6 +69,11 @@ from .storage import (  # noqa
     HasEntities,
 )
 
+from .validation import (  # noqa
+    AttributeValidator,
+    SchemaValidator
+)
+
 # run configure_mappers after defining all of the models to ensure
 # all relationships can be setup
 configure_mappers()
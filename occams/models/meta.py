@@ -19,6 +19,11 @@ Base = declarative_base(metadata=metadata)
 
 @sa.event.listens_for(metadata, 'after_create')
 def after_create(target, connection, **kw):
+    # Export caches look up the latest audit event of each table
+    connection.execute(
+        'CREATE INDEX IF NOT EXISTS ix_logged_actions_table_name_event_id '
+        'ON audit.logged_actions (table_name, event_id)')
+
     for table in target.sorted_tables:
 
         if table.info.get('audit_exclude'):
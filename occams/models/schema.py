@@ -9,6 +9,7 @@ import re
 
 import sqlalchemy as sa
 from sqlalchemy import orm
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm.collections import attribute_mapped_collection
@@ -672,3 +673,101 @@ sa.CheckConstraint(
     sa.cast(Choice.name, sa.Integer) != sa.sql.null(),
     name='ck_choice_numeric_name'
 )
+
+
+class ReportTable(Base, Referenceable):
+    """
+    Registry of materialized report tables
+
+    Each published schema may have a typed copy of its report (see
+    `occams.report_tables`) that is refreshed incrementally in the
+    background. This records which column plan the copy was built from and
+    up to which point in time it contains all entity changes.
+    """
+
+    __tablename__ = 'report_table'
+
+    schema_name = sa.Column(
+        sa.String,
+        nullable=False,
+        doc='The name of the schema the report table was generated for')
+
+    table_name = sa.Column(
+        sa.String,
+        nullable=False,
+        doc='The name of the generated table in the report table schema')
+
+    fingerprint = sa.Column(
+        sa.String,
+        nullable=False,
+        doc='Cache key of the published versions the table was built from')
+
+    watermark = sa.Column(
+        sa.DateTime,
+        nullable=False,
+        doc='All entity changes up to this time are in the table')
+
+    refresh_date = sa.Column(
+        sa.DateTime,
+        nullable=False,
+        default=datetime.now,
+        doc='When the table was last refreshed')
+
+    @declared_attr
+    def __table_args__(cls):
+        return (
+            sa.UniqueConstraint(
+                'schema_name', name='uq_%s_schema_name' % cls.__tablename__),
+            sa.UniqueConstraint(
+                'table_name', name='uq_%s_table_name' % cls.__tablename__))
+
+
+class CodebookFragment(Base, Referenceable):
+    """
+    Precomputed codebook rows of a published schema version
+
+    Fragments are generated when a version is published (see
+    `occams.exports.fragments`) so that codebooks can be assembled from
+    plain JSON rather than loading every attribute and choice through
+    the ORM.
+    """
+
+    __tablename__ = 'codebook_fragment'
+
+    schema_id = sa.Column(sa.Integer, nullable=False)
+
+    schema = orm.relationship(
+        Schema,
+        backref=orm.backref(
+            name='codebook_fragment',
+            uselist=False,
+            cascade='all, delete-orphan',
+            passive_deletes=True),
+        doc='The schema version the rows were generated for')
+
+    fingerprint = sa.Column(
+        sa.String,
+        nullable=False,
+        doc='Digest of the attributes and choices the rows were built from')
+
+    rows = sa.Column(
+        JSONB,
+        nullable=False,
+        doc='Codebook rows of the version\'s attributes, ordered by name')
+
+    create_date = sa.Column(
+        sa.DateTime,
+        nullable=False,
+        default=datetime.now,
+        doc='When the fragment was generated')
+
+    @declared_attr
+    def __table_args__(cls):
+        return (
+            sa.ForeignKeyConstraint(
+                columns=['schema_id'],
+                refcolumns=['schema.id'],
+                name='fk_%s_schema_id' % cls.__tablename__,
+                ondelete='CASCADE'),
+            sa.UniqueConstraint(
+                'schema_id', name='uq_%s_schema_id' % cls.__tablename__))
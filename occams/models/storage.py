@@ -3,7 +3,6 @@ Storage models
 """
 
 from datetime import date
-import re
 
 import sqlalchemy as sa
 from sqlalchemy import orm
@@ -15,7 +14,7 @@ from sqlalchemy.orm.collections import attribute_mapped_collection
 from .metadata import Referenceable, Describeable, Modifiable
 from .meta import Base
 from .schema import Schema
-from ..exc import ConstraintError
+from .validation import get_validator
 
 
 class Context(Base, Referenceable, Modifiable):
@@ -122,117 +121,28 @@ class Entity(Base, Referenceable, Modifiable):
         super().__init__(**kwargs)
 
     def __getitem__(self, key):
-        if key in self.schema.attributes:
+        # Attributes are looked up by name in the schema's validator
+        if key in get_validator(self.schema):
             return self.data.get(key) or None
         else:
             raise KeyError(key)
 
     def __setitem__(self, key, value):
-        if key not in self.schema.attributes:
-            raise KeyError(key)
-
-        attribute = self.schema.attributes[key]
-
-        def check_length(func, op, limit, value):
-            """
-            Perform limit check operation
-            :param func: Callback function to perform the actual operation,
-                         must return true for pass
-            :param op: label for the function
-            :param limit: raw limit value (an integer)
-            :param value: value to validate
-            """
-            if attribute.type in ('string', 'text'):
-                value = len(value)
-            elif attribute.type in ('number'):
-                limit = Decimal(limit)
-            elif attribute.type in ('date'):
-                limit = date.fromtimestamp(limit)
-            elif attribute.type in ('datetime'):
-                limit = datetime.fromtimestamp(limit)
-            else:
-                raise NotImplementedError(
-                    'Cannot coerce limit for type: %s' % attribute.type)
-
-            if not func(value, limit):
-                raise ConstraintError(
-                    attribute.schema.name,
-                    attribute.name,
-                    limit, op, value,
-                    value)
-
-        def convert(value, type_):
-            if value is None:
-                return value
-            elif type_ == 'boolean':
-                return bool(value)
-            elif type_ == 'choice' and value not in attribute.choices:
-                raise ConstraintError(
-                    attribute.schema.name,
-                    attribute.name,
-                    [n for n in attribute.choices], value)
-            return value
-
-        if attribute.is_collection:
-            value = [convert(v, attribute.type) for v in value]
-        else:
-            value = convert(value, attribute.type)
-
-        if value is not None:
-            if attribute.is_collection:
-                if attribute.collection_min is not None and \
-                        attribute.collection_min > len(value):
-                    raise ConstraintError(
-                        atttribute.schema.name,
-                        attribute.name,
-                        attribute.collection_min,
-                        value
-                    )
-                elif attribute.collection_max is not None and \
-                        attribute.collection_max < len(value):
-                    raise ConstraintError(
-                        atttribute.schema.name,
-                        attribute.name,
-                        attribute.collection_max,
-                        value
-                    )
-            else:
-                if attribute.value_min is not None:
-                    check_length(
-                        lambda length, limit: limit <= length,
-                        '<=',
-                        attribute.value_min,
-                        value
-                    )
-
-                if attribute.value_max is not None:
-                    check_length(
-                        lambda length, limit: limit >= length,
-                        '>=',
-                        attribute.value_max,
-                        value
-                    )
-
-                if attribute.pattern is not None \
-                        and not re.match(attribute.pattern, str(value)):
-                    raise ConstraintError(
-                        attribute.schema.name, attribute.name, attribute.pattern, value)
-
-        self.data[key] = value
-
-
+        # Raises KeyError for unknown attributes
+        validator = get_validator(self.schema)[key]
+        self.data[key] = validator(value)
 
     def __delitem__(self, key):
-        if key in self.schema.attributes:
+        if key in get_validator(self.schema):
             self.data[key] = None
         else:
             raise KeyError(key)
 
     def __iter__(self):
-        return self.data.keys()
+        return iter(self.data)
 
-    def __contains__(self, item):
-        return key in self.schema.attributes and key in self.data
+    def __contains__(self, key):
+        return key in get_validator(self.schema) and key in self.data
 
     def keys(self):
         return self.data.keys()
@@ -259,10 +169,11 @@ class Entity(Base, Referenceable, Modifiable):
         return self.data.popitem()
 
     def copy(self):
-        return copy(self.data)
+        return dict(self.data)
 
-    def update(other={}):
-        return self.data.update(other)
+    def update(self, other={}):
+        for key, value in dict(other).items():
+            self[key] = value
 
     @declared_attr
     def __table_args__(cls):
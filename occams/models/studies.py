@@ -1188,6 +1188,24 @@ class Export(Base,
 
     use_choice_labels = sa.Column(sa.Boolean, nullable=False, default=False)
 
+    backend = sa.Column(
+        sa.Enum('python', 'copy', name='export_backend'),
+        nullable=False,
+        default='python',
+        server_default='python',
+        doc="""
+            How data files are generated:
+                python - rows are fetched and serialized by the application;
+                copy - rows are serialized by PostgreSQL's COPY command;
+            """)
+
+    file_format = sa.Column(
+        sa.Enum('csv', 'parquet', name='export_file_format'),
+        nullable=False,
+        default='csv',
+        server_default='csv',
+        doc='The format of the data files contained in the export')
+
     notify = sa.Column(
         sa.Boolean,
         nullable=False,
@@ -1199,6 +1217,10 @@ class Export(Base,
         nullable=False,
         default='pending')
 
+    file_size = sa.Column(
+        sa.BigInteger,
+        doc='Size in bytes of the archive, recorded once it is complete')
+
     contents = sa.Column(
         JSONB,
         nullable=False,
@@ -1221,14 +1243,6 @@ class Export(Base,
         if export_dir:
             return os.path.join(export_dir, self.name)
 
-    @property
-    def file_size(self):
-        """
-        Virtual attribute that returns export's file size (if complete)
-        """
-        if self.status == 'complete':
-            return os.path.getsize(self.path)
-
     @property
     def expire_date(self):
         """
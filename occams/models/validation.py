@@ -0,0 +1,282 @@
+"""
+Compiled attribute validators
+
+Assigning a value to an entity (``entity[name] = value``) checks it against
+its attribute's constraints (choices, limits and pattern). Rather than
+interpreting the attribute's settings on every assignment, the constraints
+of a schema are compiled once into a `SchemaValidator`: patterns are
+compiled, limits are coerced to the attribute's type and choices are
+collected into sets.
+
+Validators of ORM schemata are available as ``schema.validator`` and are
+kept until the schema is expired or any attribute or choice is edited.
+Validators can also be built from plain rule dictionaries (see
+`occams.bulk.get_validator`) so that bulk writes, which bypass the ORM,
+apply the same constraints.
+
+A failed check raises `occams.exc.ConstraintError` with the arguments
+(schema name, attribute name, reason, limit, value), where the reason is
+one of `CHOICE`, `VALUE_MIN`, `VALUE_MAX`, `COLLECTION_MIN`,
+`COLLECTION_MAX`, `PATTERN` or `INVALID`.
+"""
+
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+import re
+import threading
+
+from dateutil.parser import isoparse
+import sqlalchemy as sa
+from sqlalchemy import orm
+
+from .schema import Schema, Attribute, Choice
+from ..exc import ConstraintError
+
+
+CHOICE = 'choice'
+VALUE_MIN = 'value_min'
+VALUE_MAX = 'value_max'
+COLLECTION_MIN = 'collection_min'
+COLLECTION_MAX = 'collection_max'
+PATTERN = 'pattern'
+INVALID = 'invalid'
+
+# Attribute settings that validators are compiled from
+RULE_KEYS = (
+    'name', 'type', 'is_collection', 'is_required', 'decimal_places',
+    'value_min', 'value_max', 'collection_min', 'collection_max', 'pattern')
+
+
+class AttributeValidator(object):
+    """
+    Checks (and converts) values of a single attribute
+    """
+
+    def __init__(self, schema_name, rule, strict=False):
+        """
+        Parameters:
+        schema_name -- the name of the attribute's schema (for errors)
+        rule -- a dictionary of the attribute's `RULE_KEYS` and its list
+                of choice ``choices`` names
+        strict -- (Optional) raise NotImplementedError when checking values
+                  of types that cannot be limited but have limits set,
+                  rather than ignoring those limits
+        """
+        self.schema_name = schema_name
+        self.strict = strict
+        self.name = rule['name']
+        self.type = rule['type']
+        self.is_collection = bool(rule['is_collection'])
+        self.is_required = bool(rule['is_required'])
+        self.decimal_places = rule['decimal_places']
+        self.collection_min = rule['collection_min']
+        self.collection_max = rule['collection_max']
+        self.choices = (
+            frozenset(rule['choices']) if self.type == 'choice' else None)
+        self.pattern = re.compile(rule['pattern']) if rule['pattern'] else None
+        self.value_min = self._coerce_limit(rule['value_min'])
+        self.value_max = self._coerce_limit(rule['value_max'])
+
+    def __call__(self, value):
+        """
+        Validates a value
+
+        Returns:
+        The value to store (booleans are converted to ``bool``)
+
+        Raises:
+        ConstraintError if the value violates a constraint
+        NotImplementedError if the attribute's type does not support limits
+        (strict validators only)
+        """
+        if self.is_collection:
+            if value is None:
+                return value
+            value = [self._convert(v) for v in value]
+            if self.collection_min is not None \
+                    and len(value) < self.collection_min:
+                self._fail(COLLECTION_MIN, self.collection_min, value)
+            if self.collection_max is not None \
+                    and len(value) > self.collection_max:
+                self._fail(COLLECTION_MAX, self.collection_max, value)
+            return value
+
+        value = self._convert(value)
+
+        if value is None:
+            return value
+
+        if self.value_min is not None or self.value_max is not None:
+            actual = self._measure(value)
+            if self.value_min is not None and actual < self.value_min:
+                self._fail(VALUE_MIN, self.value_min, value)
+            if self.value_max is not None and actual > self.value_max:
+                self._fail(VALUE_MAX, self.value_max, value)
+
+        if self.pattern is not None and not self.pattern.match(str(value)):
+            self._fail(PATTERN, self.pattern.pattern, value)
+
+        return value
+
+    def _fail(self, reason, limit, value):
+        raise ConstraintError(
+            self.schema_name, self.name, reason, limit, value)
+
+    def _convert(self, value):
+        if value is None:
+            return value
+        elif self.type == 'boolean':
+            return bool(value)
+        elif self.choices is not None and value not in self.choices:
+            self._fail(CHOICE, sorted(self.choices), value)
+        return value
+
+    def _coerce_limit(self, limit):
+        """
+        Converts a raw (integer) limit to the attribute's type
+        """
+        if limit is None:
+            return None
+        elif self.type in ('string', 'text'):
+            return limit
+        elif self.type == 'number':
+            return Decimal(limit)
+        elif self.type == 'date':
+            return date.fromtimestamp(limit)
+        elif self.type == 'datetime':
+            return datetime.fromtimestamp(limit)
+        elif self.strict:
+            # Only fails if a value is actually checked against the limit
+            return limit
+        return None
+
+    def _measure(self, value):
+        """
+        Returns what a value's limits are compared against
+
+        Numbers and dates may be given as objects or in their stored
+        (string) form.
+        """
+        try:
+            if self.type in ('string', 'text'):
+                return len(value)
+            elif self.type == 'number':
+                return value if isinstance(value, Decimal) \
+                    else Decimal(str(value))
+            elif self.type == 'date':
+                if isinstance(value, datetime):
+                    return value.date()
+                return value if isinstance(value, date) \
+                    else isoparse(value).date()
+            elif self.type == 'datetime':
+                if not isinstance(value, datetime):
+                    value = isoparse(value)
+                return value.replace(tzinfo=None)
+        except (TypeError, ValueError, InvalidOperation):
+            self._fail(INVALID, None, value)
+        raise NotImplementedError(
+            'Cannot coerce limit for type: %s' % self.type)
+
+
+class SchemaValidator(object):
+    """
+    Validators of a schema's attributes, keyed by attribute name
+    """
+
+    def __init__(self, schema_name, rules, strict=False):
+        """
+        Parameters:
+        schema_name -- the name of the schema
+        rules -- the rule dictionaries of its attributes
+        strict -- (Optional) see `AttributeValidator`
+        """
+        self.schema_name = schema_name
+        self.attributes = dict(
+            (rule['name'], AttributeValidator(schema_name, rule, strict))
+            for rule in rules)
+
+    def __getitem__(self, name):
+        return self.attributes[name]
+
+    def __contains__(self, name):
+        return name in self.attributes
+
+    def __iter__(self):
+        return iter(self.attributes)
+
+    def items(self):
+        return self.attributes.items()
+
+    def validate(self, data):
+        """
+        Validates the values of an entity
+
+        Returns:
+        A dictionary of the values to store
+
+        Raises:
+        KeyError for unknown attribute names
+        ConstraintError for the first value that violates a constraint
+        """
+        return dict(
+            (name, self.attributes[name](value))
+            for name, value in data.items())
+
+    @classmethod
+    def from_schema(cls, schema):
+        """
+        Compiles the (strict) validator of an ORM schema
+        """
+        return cls(schema.name, [
+            dict(
+                [(key, getattr(attribute, key)) for key in RULE_KEYS],
+                choices=list(attribute.choices))
+            for attribute in schema.attributes.values()], strict=True)
+
+
+# Incremented whenever attributes or choices are edited, so that validators
+# compiled before the edit are no longer used
+_generation = 0
+_lock = threading.Lock()
+
+
+def _invalidate(*args, **kw):
+    global _generation
+    with _lock:
+        _generation += 1
+
+
+def get_validator(schema):
+    """
+    Returns the compiled validator of a schema (``Schema.validator``)
+    """
+    cached = schema.__dict__.get('_validator')
+    if cached is None or cached[0] != _generation:
+        generation = _generation
+        cached = (generation, SchemaValidator.from_schema(schema))
+        schema.__dict__['_validator'] = cached
+    return cached[1]
+
+
+def _discard(target, *args):
+    target.__dict__.pop('_validator', None)
+
+
+Schema.validator = property(get_validator)
+
+
+@sa.event.listens_for(orm.Mapper, 'after_configured', once=True)
+def _listen():
+    # Backrefs (e.g. ``Schema.attributes``) only exist once mappers
+    # are configured
+    sa.event.listen(Schema, 'expire', _discard)
+    sa.event.listen(Schema, 'refresh', _discard)
+
+    for name in RULE_KEYS:
+        sa.event.listen(getattr(Attribute, name), 'set', _invalidate)
+
+    for event in ('append', 'remove'):
+        sa.event.listen(Schema.attributes, event, _invalidate)
+        sa.event.listen(Attribute.choices, event, _invalidate)
+
+    sa.event.listen(Choice.name, 'set', _invalidate)
@@ -12,6 +12,8 @@ from datetime import date, datetime
 import os
 from itertools import groupby
 import cgi
+from html import escape
+import re
 from decimal import ROUND_UP
 import tempfile
 
@@ -28,6 +30,8 @@ from wtforms_components import DateRange
 
 from . import _, log, models
 from .fields import FileField
+from .reporting import schema_cache_key
+from .utils.cache import form_cache
 
 
 class states:
@@ -289,6 +293,10 @@ def make_form(session,
     """
     Converts a models schema to a WTForm for data entry
 
+    Form classes of published versions are cached (see
+    `occams.utils.cache.form_cache`), so the attributes of a form are only
+    traversed again once the form has been published, retracted or edited.
+
     Parameters:
     session -- the database session to query for form metata
     schema -- the assumed form for data entry
@@ -301,9 +309,65 @@ def make_form(session,
     Returns:
     A WTForm class. The reason why an instance is not returns is in case
     the user wants to sitch together multiple forms for Long Forms.
+    A new class is returned on every call, so callers may add fields to it.
     """
 
-    class modelsForm(wtforms.Form):
+    if show_metadata:
+
+        # If there was a version change so we render the correct form
+        if formdata and 'ofmetadata_-version' in formdata:
+            schema = (
+                session.query(models.Schema)
+                .filter_by(
+                    name=schema.name,
+                    publish_date=formdata['ofmetadata_-version'])
+                .one())
+
+        if not allowed_versions:
+            allowed_versions = []
+
+        allowed_versions.append(schema.publish_date)
+        allowed_versions = sorted(set(allowed_versions))
+
+    if transition == modes.ALL:
+        allowed_states = sorted(TRANSITIONS.keys())
+
+    elif transition == modes.AVAILABLE:
+
+        try:
+            current_state = entity.state.name
+        except AttributeError:
+            current_state = states.PENDING_ENTRY
+
+        allowed_states = TRANSITIONS[current_state]
+
+    else:
+        allowed_states = []
+
+    # Drafts are edited all the time, so only published versions are cached
+    if schema.publish_date and not schema.retract_date:
+        key = (
+            schema.id,
+            show_metadata,
+            tuple(allowed_states),
+            tuple(allowed_versions or []),
+            schema_cache_key(
+                session, 'form', schema.name,
+                versions=sorted(set(
+                    (allowed_versions or []) + [schema.publish_date]))))
+        form_class = form_cache.get(key)
+        if form_class is None:
+            form_class = _build_form(
+                session, schema, show_metadata, allowed_versions,
+                allowed_states)
+            # Pre-rendered field markup, see `render_form`
+            form_class._skeletons = {}
+            form_cache.set(key, form_class)
+    else:
+        form_class = _build_form(
+            session, schema, show_metadata, allowed_versions, allowed_states)
+
+    class modelsForm(form_class):
 
         class Meta:
             pass
@@ -311,6 +375,24 @@ def make_form(session,
         setattr(Meta, 'schema', schema)
         setattr(Meta, 'entity', entity)
 
+    return modelsForm
+
+
+def _build_form(session, schema, show_metadata, allowed_versions,
+                allowed_states):
+    """
+    Generates the (entity-independent) WTForm class of a schema
+
+    Parameters:
+    session -- the database session to query for form metata
+    schema -- the form to generate fields for
+    show_metadata -- includes entity metadata fields
+    allowed_versions -- the versions the metadata may switch to
+    allowed_states -- the names of the states the workflow may set
+    """
+
+    class modelsForm(wtforms.Form):
+
         def validate(self, **kw):
             status = True
 
@@ -335,21 +417,6 @@ def make_form(session,
 
     if show_metadata:
 
-        # If there was a version change so we render the correct form
-        if formdata and 'ofmetadata_-version' in formdata:
-            schema = (
-                session.query(models.Schema)
-                .filter_by(
-                    name=schema.name,
-                    publish_date=formdata['ofmetadata_-version'])
-                .one())
-
-        if not allowed_versions:
-            allowed_versions = []
-
-        allowed_versions.append(schema.publish_date)
-        allowed_versions = sorted(set(allowed_versions))
-
         actual_versions = [(str(p), str(p)) for (p,) in (
             session.query(models.Schema.publish_date)
             .filter(models.Schema.name == schema.name)
@@ -379,21 +446,6 @@ def make_form(session,
 
         setattr(modelsForm, 'ofmetadata_', wtforms.FormField(Metadata))
 
-    if transition == modes.ALL:
-        allowed_states = TRANSITIONS.keys()
-
-    elif transition == modes.AVAILABLE:
-
-        try:
-            current_state = entity.state.name
-        except AttributeError:
-            current_state = states.PENDING_ENTRY
-
-        allowed_states = TRANSITIONS[current_state]
-
-    else:
-        allowed_states = []
-
     if allowed_states:
 
         allowed_states = (
@@ -444,6 +496,10 @@ def render_form(form,
                 attr=None):
     """
     Helper function to render a WTForm by OCCAMS standards
+
+    The markup of the data fields of a published version only depends on
+    the form's structure, so it is rendered once per form class (see
+    `make_form`) as a skeleton into which widgets and errors are filled.
     """
 
     entity = form.meta.entity
@@ -459,11 +515,25 @@ def render_form(form,
     fields_disabled = bool(disabled or metadata_disabled or (
         entity and entity.not_done))
 
+    renderer = FieldRenderer(fields_disabled)
+    skeletons = getattr(form, '_skeletons', None)
+
+    if skeletons is None:
+        fields = _render_fields(form, renderer)
+    else:
+        # Forms may have extra fields added by the view (e.g. enrollment)
+        key = tuple(form._fields)
+        skeleton = skeletons.get(key)
+        if skeleton is None:
+            skeleton = skeletons[key] = _compile_fields(form)
+        fields = skeleton.fill(form, renderer)
+
     return render('occams:templates/form.pt', {
         'cancel_url': cancel_url,
         'schema': schema,
         'entity': entity,
         'form': form,
+        'fields': fields,
         'show_footer': show_footer,
         'metadata_disabled': metadata_disabled,
         'fields_disabled': fields_disabled,
@@ -472,6 +542,97 @@ def render_form(form,
     })
 
 
+class FieldRenderer(object):
+    """
+    Renders the parts of data fields that depend on their values
+    """
+
+    def __init__(self, disabled=False):
+        self.disabled = disabled
+
+    def widget(self, field, **kw):
+        kw['disabled'] = self.disabled
+        if type(field.widget).__name__ == 'FileInput':
+            kw['data-initial-caption'] = \
+                field.data and field.data.file_name or ''
+        return str(field(**kw))
+
+    def errors(self, field):
+        return u''.join(
+            u'<p class="help-block"><strong>%s</strong></p>' % escape(str(error))
+            for error in field.errors)
+
+    def error_class(self, field, css_class):
+        return css_class if field.errors else u''
+
+
+class _SkeletonRenderer(object):
+    """
+    Records calls to a `FieldRenderer`, leaving placeholders in the markup
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def _record(self, method, field, **kw):
+        self.calls.append((method, field.id, kw))
+        return u'@@field:%d@@' % (len(self.calls) - 1)
+
+    def widget(self, field, **kw):
+        return self._record('widget', field, **kw)
+
+    def errors(self, field):
+        return self._record('errors', field)
+
+    def error_class(self, field, css_class):
+        return self._record('error_class', field, css_class=css_class)
+
+
+class _Skeleton(object):
+    """
+    Pre-rendered field markup with placeholders for widgets and errors
+    """
+
+    def __init__(self, markup, calls):
+        parts = re.split(r'@@field:(\d+)@@', markup)
+        self.texts = parts[::2]
+        self.calls = [calls[int(i)] for i in parts[1::2]]
+
+    def fill(self, form, renderer):
+        fields = dict(_iterfields(form))
+        output = [self.texts[0]]
+        for (method, field_id, kw), text in zip(self.calls, self.texts[1:]):
+            output.append(getattr(renderer, method)(fields[field_id], **kw))
+            output.append(text)
+        return u''.join(output)
+
+
+def _render_fields(form, renderer):
+    return render('occams:templates/fields.pt', {
+        'form': form,
+        'renderer': renderer,
+    })
+
+
+def _compile_fields(form):
+    renderer = _SkeletonRenderer()
+    return _Skeleton(_render_fields(form, renderer), renderer.calls)
+
+
+def _iterfields(form):
+    """
+    Generates the bound fields (and choice options) of a form by id
+    """
+    for field in form:
+        yield field.id, field
+        if isinstance(field, wtforms.FormField):
+            for item in _iterfields(field.form):
+                yield item
+        elif hasattr(field, 'option_widget'):
+            for option in field:
+                yield option.id, option
+
+
 def entity_data(entity):
     """
     Serializes an entity into a dictionary for data entry
@@ -0,0 +1,254 @@
+"""
+Materialized report tables
+
+`build_report` flattens the JSONB data of every entity of a form each time
+it is called. For large forms this is expensive, so a background task may
+instead maintain one typed table per published schema in the ``reports``
+database schema. Tables are refreshed incrementally using entity
+modification dates and rebuilt whenever the form's published versions
+change.
+
+Readers use `get_report`, which combines the materialized rows with any
+entity changes since the last refresh, so results are never stale. If a
+form has no up-to-date table, callers should fall back to `build_report`.
+"""
+
+from datetime import datetime
+import hashlib
+import logging
+
+import sqlalchemy as sa
+from sqlalchemy import null, literal
+
+from . import models
+from .reporting import build_report, build_columns, schema_cache_key
+
+
+log = logging.getLogger(__name__)
+
+
+# Database schema that contains the generated tables
+TABLE_SCHEMA = 'reports'
+
+
+def refresh(dbsession, schema_name):
+    """
+    Brings the materialized report table of a schema up to date
+
+    The table is rebuilt from scratch if it does not exist yet or if the
+    form's published versions have changed, otherwise only entities that
+    were modified or deleted since the last refresh are replaced.
+
+    Parameters:
+    dbsession -- The database session to use
+    schema_name -- The name of the schema
+
+    Returns:
+    The registry entry of the refreshed table
+    """
+    from .exports import get_watermark
+
+    # Serialize concurrent refreshes of the same table
+    dbsession.execute(
+        sa.select([sa.func.pg_advisory_xact_lock(
+            sa.func.hashtext('report_table:' + schema_name))]))
+
+    fingerprint = schema_cache_key(dbsession, 'report_table', schema_name)
+    watermark = get_watermark(dbsession)
+
+    record = (
+        dbsession.query(models.ReportTable)
+        .filter_by(schema_name=schema_name)
+        .first())
+
+    report = build_report(dbsession, schema_name, ignore_private=False)
+    table = _get_table(report, get_table_name(schema_name))
+    columns = [c.name for c in report.c]
+
+    if record is None \
+            or record.fingerprint != fingerprint \
+            or record.table_name != table.name:
+        log.info('Rebuilding report table for {}'.format(schema_name))
+        dbsession.execute(sa.DDL(
+            'CREATE SCHEMA IF NOT EXISTS {}'.format(TABLE_SCHEMA)))
+        if record is not None and record.table_name != table.name:
+            # Named by an earlier naming scheme
+            _drop(dbsession, record.table_name)
+        table.drop(dbsession.connection(), checkfirst=True)
+        table.create(dbsession.connection())
+        dbsession.execute(
+            table.insert().from_select(columns, sa.select([report])))
+        if record is None:
+            record = models.ReportTable(schema_name=schema_name)
+            dbsession.add(record)
+        record.table_name = table.name
+        record.fingerprint = fingerprint
+    else:
+        since = record.watermark
+        changed = (
+            sa.select([models.Entity.id])
+            .where(models.Entity.modify_date > since))
+        existing = sa.exists().where(models.Entity.id == table.c.id)
+        dbsession.execute(
+            table.delete().where(table.c.id.in_(changed) | ~existing))
+        fresh = build_report(
+            dbsession, schema_name, ignore_private=False, since=since)
+        dbsession.execute(
+            table.insert().from_select(columns, sa.select([fresh])))
+
+    record.watermark = watermark
+    record.refresh_date = datetime.now()
+    dbsession.flush()
+    dbsession.execute('ANALYZE {}'.format(_quote(dbsession, table)))
+    return record
+
+
+def refresh_all(dbsession):
+    """
+    Refreshes the report tables of all published schemata
+
+    Tables of schemata that are no longer published are dropped.
+
+    Parameters:
+    dbsession -- The database session to use
+
+    Returns:
+    The names of the refreshed schemata
+    """
+    names = [name for name, in (
+        dbsession.query(models.Schema.name)
+        .filter(models.Schema.publish_date != null())
+        .filter(models.Schema.retract_date == null())
+        .distinct()
+        .order_by(models.Schema.name))]
+
+    obsolete = (
+        dbsession.query(models.ReportTable)
+        .filter(~models.ReportTable.schema_name.in_(names)))
+
+    for record in obsolete:
+        _drop(dbsession, record.table_name)
+        dbsession.delete(record)
+
+    for name in names:
+        refresh(dbsession, name)
+
+    return names
+
+
+def get_report(dbsession, schema_name, ids=None, ignore_private=True,
+               since=None, after=None):
+    """
+    Returns the report of a schema from its materialized table
+
+    The result has the same columns as `build_report` (using codes rather
+    than labels and without expanded collections).
+
+    Parameters:
+    dbsession -- The database session to use
+    schema_name -- The name of the schema
+    ids -- (Optional) The spcific schema ids to include in the report
+    ignore_private -- (Optional) Masks private columns (default is True)
+    since -- (Optional) Only include entities modified after this timestamp
+    after -- (Optional) Only include entities with an id greater than this
+
+    Returns:
+    A common table expression (so that queries referring to the report
+    several times only evaluate it once), or None if the schema does not
+    have an up-to-date report table.
+    """
+    record = (
+        dbsession.query(models.ReportTable)
+        .filter_by(schema_name=schema_name)
+        .first())
+
+    if record is None:
+        return None
+
+    fingerprint = schema_cache_key(dbsession, 'report_table', schema_name)
+
+    if record.fingerprint != fingerprint:
+        return None
+
+    fresh = build_report(
+        dbsession,
+        schema_name,
+        ids=ids,
+        ignore_private=ignore_private,
+        since=(record.watermark if since is None
+               else max(since, record.watermark)),
+        after=after)
+
+    table = _get_table(
+        build_report(dbsession, schema_name, ignore_private=False),
+        record.table_name)
+
+    private = set()
+    if ignore_private:
+        private = set(
+            name for name, column in
+            build_columns(dbsession, schema_name).items()
+            if column.is_private)
+
+    # Rows of entities that are unchanged since the last refresh
+    query = (
+        sa.select([
+            (literal(u'[PRIVATE]').label(name)
+                if name in private else table.c[name])
+            for name in fresh.c.keys()])
+        .select_from(table.join(
+            models.Entity.__table__, models.Entity.id == table.c.id))
+        .where(models.Entity.modify_date <= record.watermark))
+
+    if ids:
+        query = query.where(models.Entity.schema_id.in_(ids))
+
+    if since is not None:
+        query = query.where(models.Entity.modify_date > since)
+
+    if after is not None:
+        query = query.where(table.c.id > after)
+
+    return sa.union_all(query, sa.select([fresh])).cte()
+
+
+def get_table_name(schema_name):
+    """
+    Returns the name of a schema's report table
+
+    Schema names are case-sensitive and may be longer than PostgreSQL
+    identifiers (63 bytes), so a truncated name is suffixed with a digest
+    of the full name.
+    """
+    digest = hashlib.sha1(schema_name.encode('utf-8')).hexdigest()[:12]
+    prefix = schema_name.lower().encode('utf-8')[:40].decode('utf-8', 'ignore')
+    return '{}_{}'.format(prefix, digest)
+
+
+def _get_table(report, table_name):
+    """
+    Describes a report table using the column types of its report query
+    """
+    return sa.Table(
+        table_name,
+        sa.MetaData(),
+        *[sa.Column(
+            c.name,
+            sa.UnicodeText if isinstance(c.type, sa.types.NullType) else c.type,
+            primary_key=(c.name == 'id'))
+          for c in report.c],
+        schema=TABLE_SCHEMA)
+
+
+def _drop(dbsession, table_name):
+    dbsession.execute(sa.DDL('DROP TABLE IF EXISTS {}.{}'.format(
+        TABLE_SCHEMA, _quote_identifier(dbsession, table_name))))
+
+
+def _quote(dbsession, table):
+    return '{}.{}'.format(
+        TABLE_SCHEMA, _quote_identifier(dbsession, table.name))
+
+
+def _quote_identifier(dbsession, name):
+    return dbsession.bind.dialect.identifier_preparer.quote_identifier(name)
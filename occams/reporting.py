@@ -2,13 +2,15 @@
 A utility for allowing the access of entered schema data to be represented
 in a SQL table-like fashion.
 """
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
+import hashlib
 
 import sqlalchemy as sa
 from sqlalchemy import orm, cast, null, literal, Integer, case, Unicode, func
 from sqlalchemy.dialects.postgresql import ARRAY
 
 from . import models
+from .utils.cache import metadata_cache
 from .utils.sql import group_concat, to_date, to_datetime
 
 
@@ -20,7 +22,9 @@ def build_report(session,
                  use_choice_labels=False,
                  context=None,
                  ignore_private=True,
-                 delimiter=';'):
+                 delimiter=';',
+                 since=None,
+                 after=None):
     """
     Builds a schema entity data report query table from the data dictioanry.
 
@@ -34,6 +38,8 @@ def build_report(session,
                          (default is False)
     use_choice_labels -- (Optional) Uses choice labels instead of codes
                          (default is False)
+    since -- (Optional) Only include entities modified after this timestamp
+    after -- (Optional) Only include entities with an id greater than this
 
     Returns:
     A SQLAlchemy aliased sub-query. Depending on the database driver,
@@ -44,7 +50,7 @@ def build_report(session,
     named tuples of each result using the names of the naming schema as the
     property names.
     """
-    is_sqlite = 'sqlite' == session.bind.url.drivername
+    is_sqlite = 'sqlite' == session.get_bind().engine.url.drivername
 
     query = (
         session.query(
@@ -63,6 +69,12 @@ def build_report(session,
     if ids:
         query = query.filter(models.Schema.id.in_(ids))
 
+    if since is not None:
+        query = query.filter(models.Entity.modify_date > since)
+
+    if after is not None:
+        query = query.filter(models.Entity.id > after)
+
     if context:
         query = (
             query
@@ -75,6 +87,9 @@ def build_report(session,
 
     attributes = None if attributes is None else set(attributes)
 
+    if use_choice_labels:
+        labels = build_choice_labels(session, schema_name, ids)
+
     for column in columns.values():
         if column.type == 'section':  # Sections are not used in reports
             continue
@@ -112,37 +127,28 @@ def build_report(session,
         elif column.type == 'choice' and column.is_collection:
             if expand_collections:
                 if use_choice_labels:
-                    # Query for the correspoinding label if is in the selection
-                    Choice = orm.aliased(models.Choice)
-                    Attribute = orm.aliased(models.Attribute)
-                    value_column = (
-                        session.query(Choice.title)
-                            .select_from(Choice)
-                            .join(Attribute)
-                            .filter(Attribute.schema_id == models.Entity.schema_id)
-                            .filter(Attribute.name == column.attribute_name)
-                            .filter(Choice.name == column.choice.name)
-                            .filter(models.Entity.data[column.attribute_name].has_key(column.choice.name))
-                            .correlate(models.Entity)
-                            .as_scalar()
-                    )
+                    # Use the corresponding label if it is in the selection
+                    value_column = case([(
+                        models.Entity.data[column.attribute_name].has_key(column.choice.name),
+                        _choice_title(labels, column.attribute_name, column.choice.name))])
                 else:
                     # Coerce to true/false if the selection contains the choice for this column
                     value_column = models.Entity.data[column.attribute_name].has_key(column.choice.name).cast(sa.Integer)
             else:
                 if use_choice_labels:
                     # Replace with corresponding selected labels for the current version of the form
-                    Choice = orm.aliased(models.Choice)
-                    Attribute = orm.aliased(models.Attribute)
+                    selected_subquery = (
+                        session.query(
+                            func.jsonb_array_elements_text(models.Entity.data[column.name]).label('selected')
+                        )
+                        .subquery()
+                    )
                     value_column = (
-                        session.query(func.string_agg(Choice.title, literal(delimiter)))
-                            .select_from(Choice)
-                            .join(Attribute)
-                            .filter(Attribute.schema_id == models.Entity.schema_id)
-                            .filter(Attribute.name == column.attribute_name)
-                            .filter(models.Entity.data[column.name].has_key(Choice.name))
-                            .correlate(models.Entity)
-                            .as_scalar()
+                        session.query(func.string_agg(
+                            _choice_label(labels, column.name, selected_subquery.c.selected),
+                            literal(delimiter)))
+                        .correlate(models.Entity)
+                        .as_scalar()
                     )
                 else:
                     # expand the json array a a listing of values
@@ -164,19 +170,8 @@ def build_report(session,
             value_column = models.Entity.data[column.name].astext.cast(sa.Unicode)
 
             if use_choice_labels:
-                # use a subquery to replace the code with the choice label
-                Choice = orm.aliased(models.Choice)
-                Attribute = orm.aliased(models.Attribute)
-                value_column = (
-                    session.query(Choice.title)
-                        .select_from(Choice)
-                        .join(Attribute)
-                        .filter(Attribute.schema_id == models.Entity.schema_id)
-                        .filter(Attribute.name == column.name)
-                        .filter(Choice.name == value_column)
-                        .correlate(models.Entity)
-                        .as_scalar()
-                )
+                # replace the code with the choice label
+                value_column = _choice_label(labels, column.name, value_column)
 
         query = query.add_column(value_column.label(column.name))
 
@@ -199,7 +194,6 @@ def build_report(session,
     else:
         cte = query.cte(schema_name)
 
-    print(cte)
     return cte
 
 
@@ -228,6 +222,23 @@ def build_columns(session, schema_name, ids=None, expand_collections=False):
     also contain the attribute's checksum.
     """
 
+    key = schema_cache_key(
+        session, 'columns', schema_name, ids=ids,
+        extra=[int(expand_collections)])
+
+    plan = metadata_cache.get_or_create(
+        key,
+        lambda: [column.to_json() for column in _query_columns(
+            session, schema_name, ids, expand_collections).values()])
+
+    return OrderedDict(
+        (data['name'], DataColumn.from_json(data)) for data in plan)
+
+
+def _query_columns(session, schema_name, ids=None, expand_collections=False):
+    """
+    Uncached implementation of `build_columns`
+    """
     query = (
         session.query(models.Attribute)
         .join(models.Attribute.schema)
@@ -280,11 +291,156 @@ def build_columns(session, schema_name, ids=None, expand_collections=False):
     return columns
 
 
+def build_choice_labels(session, schema_name, ids=None):
+    """
+    Maps the choice codes of each published version of a schema to labels
+
+    Labels are resolved in-process when the report is built rather than
+    with a lookup subquery for every choice column of every row.
+
+    Parameters:
+    session -- The database session to use
+    schema_name -- The name of the schema
+    ids -- (Optional) Specific id numbers of the forms
+
+    Returns:
+    A dictionary of schema id (as a string) to attribute names to a
+    dictionary of choice codes to labels.
+    """
+
+    def query_labels():
+        query = (
+            session.query(
+                models.Attribute.schema_id,
+                models.Attribute.name,
+                models.Choice.name,
+                models.Choice.title)
+            .select_from(models.Choice)
+            .join(models.Choice.attribute)
+            .join(models.Attribute.schema)
+            .filter(models.Schema.name == schema_name)
+            .filter(models.Schema.publish_date != null())
+            .filter(models.Schema.retract_date == null()))
+
+        if ids:
+            query = query.filter(models.Schema.id.in_(ids))
+
+        labels = {}
+        for schema_id, attribute_name, choice_name, title in query:
+            (labels
+                .setdefault(str(schema_id), {})
+                .setdefault(attribute_name, {}))[choice_name] = title
+        return labels
+
+    key = schema_cache_key(session, 'labels', schema_name, ids=ids)
+    return metadata_cache.get_or_create(key, query_labels)
+
+
+def _by_version(mapping, expression):
+    """
+    Generates an expression that picks the version-specific value
+
+    Versions sharing identical values are collapsed so that in the common
+    case (labels unchanged across versions) no version check is necessary.
+
+    Parameters:
+    mapping -- A dictionary of schema id to value
+    expression -- A function that generates the expression for a value
+    """
+    values = [v for v in mapping.values() if v]
+    if not values:
+        return cast(null(), Unicode)
+    if all(v == values[0] for v in values):
+        return expression(values[0])
+    return case(
+        dict((int(schema_id), expression(value))
+             for schema_id, value in mapping.items() if value),
+        value=models.Entity.schema_id)
+
+
+def _choice_label(labels, attribute_name, code):
+    """
+    Generates an expression that replaces a choice code with its label
+    """
+    return _by_version(
+        dict((schema_id, attributes.get(attribute_name))
+             for schema_id, attributes in labels.items()),
+        lambda titles: case(titles, value=code))
+
+
+def _choice_title(labels, attribute_name, choice_name):
+    """
+    Generates an expression for the label of a specific choice
+    """
+    return _by_version(
+        dict((schema_id, attributes.get(attribute_name, {}).get(choice_name))
+             for schema_id, attributes in labels.items()),
+        literal)
+
+
+def schema_cache_key(session, kind, schema_name, ids=None, versions=None,
+                     extra=None):
+    """
+    Generates a metadata cache key for the published versions of a schema
+
+    The key is a digest of the versions' ids and the modification timestamps
+    and counts of their attributes and choices, so publishing, retracting or
+    editing a version yields a new key and stale entries are never read.
+
+    Parameters:
+    session -- The database session to use
+    kind -- The kind of metadata being cached (e.g. "columns")
+    schema_name -- The name of the schema
+    ids -- (Optional) Specific id numbers of the forms
+    versions -- (Optional) Specific publish dates of the forms
+    extra -- (Optional) Additional values that affect the cached metadata
+
+    Returns:
+    A string key for `occams.utils.cache.metadata_cache`
+    """
+    query = (
+        session.query(
+            models.Schema.id,
+            models.Schema.modify_date,
+            func.max(models.Attribute.modify_date),
+            func.count(sa.distinct(models.Attribute.id)),
+            func.max(models.Choice.modify_date),
+            func.count(models.Choice.id))
+        .outerjoin(
+            models.Attribute, models.Attribute.schema_id == models.Schema.id)
+        .outerjoin(
+            models.Choice, models.Choice.attribute_id == models.Attribute.id)
+        .filter(models.Schema.name == schema_name)
+        .filter(models.Schema.publish_date != null())
+        .filter(models.Schema.retract_date == null())
+        .group_by(models.Schema.id, models.Schema.modify_date)
+        .order_by(models.Schema.id))
+
+    if ids:
+        query = query.filter(models.Schema.id.in_(ids))
+
+    if versions is not None:
+        query = query.filter(models.Schema.publish_date.in_(versions))
+
+    digest = hashlib.sha1()
+    digest.update(repr(extra or []).encode('utf-8'))
+    for record in query:
+        digest.update(repr(tuple(record)).encode('utf-8'))
+
+    return ':'.join([
+        str(session.get_bind().engine.url.database), kind, schema_name,
+        digest.hexdigest()])
+
+
+ChoiceTerm = namedtuple('ChoiceTerm', ['name', 'title'])
+
+
 class DataColumn(object):
     """
     A data dictionary column for reference when inspecting a report column.
 
-    Note that this type is intended to be read-only.
+    Note that this type is intended to be read-only and only holds plain
+    values so that it can be shared through the metadata cache.
 
     This type also behaves as a dictionary, granting access to vocabulary
     terms (if the underlying attributes have specified choices).
@@ -307,11 +463,44 @@ class DataColumn(object):
         self.type = types.pop()
         self.is_collection = collections.pop()
         self.is_private = any(a.is_private for a in attributes)
-        self.attributes = tuple(attributes)
-        self.choice = choice
+        # Ids of the attribute lineage, oldest to newest
+        self.attributes = tuple(a.id for a in attributes)
+        self.choice = None
         if choice is not None:
+            self.choice = ChoiceTerm(choice.name, choice.title)
             self.choices = {}
         else:
             self.choices = dict((c.name, c.title)
                                 for a in attributes
                                 for c in a.choices.values())
+
+    def to_json(self):
+        """
+        Returns a JSON-serializable representation of this column
+        """
+        return {
+            'name': self.name,
+            'attribute_name': self.attribute_name,
+            'type': self.type,
+            'is_collection': self.is_collection,
+            'is_private': self.is_private,
+            'attributes': list(self.attributes),
+            'choice': self.choice and list(self.choice),
+            'choices': self.choices,
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        """
+        Rebuilds a column from its `to_json` representation
+        """
+        column = cls.__new__(cls)
+        column.name = data['name']
+        column.attribute_name = data['attribute_name']
+        column.type = data['type']
+        column.is_collection = data['is_collection']
+        column.is_private = data['is_private']
+        column.attributes = tuple(data['attributes'])
+        column.choice = data['choice'] and ChoiceTerm(*data['choice'])
+        column.choices = data['choices']
+        return column
@@ -43,6 +43,7 @@ def includeme(config):
     config.add_route('studies.patients_forms',              r'/studies/patients/forms',                  factory=models.PatientFactory)
     config.add_route('studies.patient',                     r'/studies/patients/{patient}',              factory=models.PatientFactory, traverse='/{patient}')
     config.add_route('studies.patient_forms',               r'/studies/patients/{patient}/forms',        factory=models.PatientFactory, traverse='/{patient}/forms')
+    config.add_route('studies.patient_forms_bulk',          r'/studies/patients/{patient}/forms/bulk',   factory=models.PatientFactory, traverse='/{patient}/forms')
     config.add_route('studies.patient_form',                r'/studies/patients/{patient}/forms/{form}', factory=models.PatientFactory, traverse='/{patient}/forms/{form}')
 
     config.add_route('studies.enrollments',                 r'/studies/patients/{patient}/enrollments',                              factory=models.PatientFactory, traverse='/{patient}/enrollments')
@@ -55,6 +56,7 @@ def includeme(config):
     config.add_route('studies.visit',                       r'/studies/patients/{patient}/visits/{visit}',               factory=models.PatientFactory, traverse='/{patient}/visits/{visit}')
 
     config.add_route('studies.visit_forms',                 r'/studies/patients/{patient}/visits/{visit}/forms',         factory=models.PatientFactory, traverse='/{patient}/visits/{visit}/forms')
+    config.add_route('studies.visit_forms_bulk',            r'/studies/patients/{patient}/visits/{visit}/forms/bulk',    factory=models.PatientFactory, traverse='/{patient}/visits/{visit}/forms')
     config.add_route('studies.visit_form',                  r'/studies/patients/{patient}/visits/{visit}/forms/{form:\d+}',  factory=models.PatientFactory, traverse='/{patient}/visits/{visit}/forms/{form}')
 
     config.add_route('studies.index',                       r'/',                                            factory=models.StudyFactory)
@@ -3,7 +3,7 @@ Command-line interface for exporting data
 """
 
 import argparse
-from itertools import chain
+from datetime import datetime
 import os
 import shutil
 import sys
@@ -15,6 +15,13 @@ from tabulate import tabulate
 from .. import exports
 
 
+# Records the modification timestamp up to which the export is complete
+WATERMARK_FILE = 'watermark.txt'
+
+# Appended to the plan name for the listing of deleted record ids
+DELETED_SUFFIX = '.deleted.csv'
+
+
 def parse_args(argv=sys.argv):
     parser = argparse.ArgumentParser(description='Generate export data files.')
 
@@ -71,6 +78,31 @@ def parse_args(argv=sys.argv):
         dest='show_private',
         action='store_true',
         help='De-identifies private data.')
+    export_group.add_argument(
+        '--format',
+        dest='file_format',
+        choices=['csv', 'parquet'],
+        default='csv',
+        help='Data file format (parquet requires pyarrow)')
+    export_group.add_argument(
+        '--backend',
+        choices=['python', 'copy'],
+        default='python',
+        help='Generate data files in the application (python) or '
+             'with PostgreSQL\'s native COPY command (copy)')
+    export_group.add_argument(
+        '--batch-size',
+        metavar='N',
+        dest='batch_size',
+        type=int,
+        default=1000,
+        help='Number of rows to stream from the database at a time '
+             '(0 loads the entire result set at once)')
+    export_group.add_argument(
+        '--incremental',
+        action='store_true',
+        help='Only export records modified since the previous export to '
+             'the output directory, along with listings of deleted records')
     export_group.add_argument(
         '--dir',
         metavar='PATH',
@@ -109,8 +141,7 @@ def print_list(args, env):
 
     header = ['sys', 'priv', 'rand', 'name', 'title']
     dbsession = env['request'].dbsession
-    plans = exports.plans
-    rows = iter(format(e) for e in exports.list_all(plans, dbsession).values())
+    rows = iter(format(e) for e in exports.list_all(dbsession).values())
     print(tabulate(rows, header, tablefmt='simple'))
 
 
@@ -127,8 +158,10 @@ def make_export(args, env):
         sys.exit('You must specifiy something to export!')
 
     dbsession = env['request'].dbsession
-    plans = exports.plans
-    exportables = exports.list_all(plans, dbsession)
+    exportables = exports.list_all(dbsession)
+
+    since = read_watermark(args.dir) if args.incremental else None
+    watermark = exports.get_watermark(dbsession)
 
     if args.atomic:
         out_dir = '%s-%s' % (args.dir.rstrip('/'), uuid.uuid4())
@@ -148,15 +181,36 @@ def make_export(args, env):
                     and not plan.has_rand)
                 or (args.all_rand and plan.has_rand)
                 or (args.names and plan.name in args.names)):
-            with open(os.path.join(out_dir, plan.file_name), 'w') as fp:
-                exports.write_data(fp, plan.data(
-                    use_choice_labels=args.use_choice_labels,
-                    expand_collections=args.expand_collections,
-                    ignore_private=not args.show_private))
+            query = plan.data(
+                use_choice_labels=args.use_choice_labels,
+                expand_collections=args.expand_collections,
+                ignore_private=not args.show_private,
+                since=since)
+            path = os.path.join(out_dir, plan.get_file_name(args.file_format))
+            if args.file_format == 'parquet':
+                with open(path, 'wb') as fp:
+                    exports.write_parquet(
+                        fp, query, list(plan.codebook()),
+                        batch_size=args.batch_size or 1000)
+            else:
+                with open(path, 'w') as fp:
+                    if args.backend == 'copy':
+                        exports.copy_data(fp, query)
+                    else:
+                        exports.write_data(
+                            fp, query, batch_size=args.batch_size)
+            if since is not None:
+                path = os.path.join(out_dir, plan.name + DELETED_SUFFIX)
+                with open(path, 'w') as fp:
+                    exports.write_data(fp, plan.deleted(since))
 
     with open(os.path.join(out_dir, exports.codebook.FILE_NAME), 'w') as fp:
-        codebooks = [p.codebook() for p in exportables.values()]
-        exports.write_codebook(fp, chain.from_iterable(codebooks))
+        exports.write_codebook(
+            fp, exports.iter_codebook(dbsession, exportables.values()))
+
+    if args.incremental:
+        with open(os.path.join(out_dir, WATERMARK_FILE), 'w') as fp:
+            fp.write(watermark.isoformat())
 
     if args.atomic:
         old_dir = os.path.realpath(args.dir)
@@ -165,3 +219,17 @@ def make_export(args, env):
         os.symlink(os.path.abspath(out_dir), args.dir)
         if not os.path.islink(old_dir):
             shutil.rmtree(old_dir)
+
+
+def read_watermark(path):
+    """
+    Reads the watermark of the previous export in the output directory
+
+    Returns:
+    The timestamp of the previous export, or None if there was none
+    """
+    watermark_path = os.path.join(path, WATERMARK_FILE)
+    if not os.path.exists(watermark_path):
+        return None
+    with open(watermark_path) as fp:
+        return datetime.fromisoformat(fp.read().strip())
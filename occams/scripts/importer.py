@@ -0,0 +1,113 @@
+"""
+Command-line interface for importing form data files
+"""
+
+import argparse
+import json
+import sys
+
+from dateutil.parser import isoparse
+from pyramid.paster import bootstrap, setup_logging
+
+from .. import importer, models
+from ..exc import ImportFileError
+
+
+def parse_args(argv=sys.argv):
+    parser = argparse.ArgumentParser(
+        description='Import a CSV or Parquet file of form data.')
+
+    conn_group = parser.add_argument_group('Connection options')
+    conn_group.add_argument(
+        '-c', '--config',
+        metavar='INI',
+        dest='config',
+        help='Application INI file')
+    conn_group.add_argument(
+        '--blame',
+        metavar='USER',
+        help='User recorded in the audit log '
+             '(default: the database user)')
+
+    main_group = parser.add_argument_group('Import Options')
+    main_group.add_argument(
+        '--schema',
+        required=True,
+        help='Name of the form to import')
+    main_group.add_argument(
+        '--version',
+        required=True,
+        type=lambda value: isoparse(value).date(),
+        help='Publish date of the form version (YYYY-MM-DD)')
+    main_group.add_argument(
+        '--format',
+        dest='file_format',
+        choices=['csv', 'parquet'],
+        help='Data file format (default: guessed from the file extension, '
+             'parquet requires pyarrow)')
+    main_group.add_argument(
+        '--state',
+        default=importer.states.PENDING_REVIEW,
+        help='Workflow state of imported forms (default: %(default)s)')
+    main_group.add_argument(
+        '--chunk-size',
+        metavar='N',
+        dest='chunk_size',
+        type=int,
+        default=10000,
+        help='Number of rows validated and written at a time')
+    main_group.add_argument(
+        '--delimiter',
+        default=';',
+        help='Separator of multiple choice values in CSV files')
+    main_group.add_argument(
+        '--rejected',
+        metavar='PATH',
+        help='Write the errors of rejected rows to this CSV file')
+    main_group.add_argument(
+        '--dry-run',
+        dest='dry_run',
+        action='store_true',
+        help='Validate the file without saving anything')
+    main_group.add_argument(
+        'path',
+        metavar='FILE',
+        help='The data file')
+
+    return parser.parse_args(argv)
+
+
+def main(argv=sys.argv):
+    args = parse_args(argv[1:])
+
+    setup_logging(args.config)
+    env = bootstrap(args.config)
+    request = env['request']
+
+    with request.tm:
+        dbsession = request.dbsession
+        blame = args.blame or models.get_blame_from_url(dbsession.bind.url)
+        models.set_pg_locals(dbsession, 'import', blame)
+
+        try:
+            result = importer.import_file(
+                dbsession,
+                args.path,
+                args.schema,
+                args.version,
+                file_format=args.file_format,
+                state=args.state,
+                chunk_size=args.chunk_size,
+                delimiter=args.delimiter)
+        except ImportFileError as exc:
+            request.tm.abort()
+            sys.exit(str(exc))
+
+        if args.dry_run:
+            request.tm.abort()
+
+    if args.rejected:
+        with open(args.rejected, 'w', newline='') as fp:
+            importer.write_rejected(fp, result)
+
+    print(json.dumps(result.to_json(), indent=2))
@@ -9,24 +9,26 @@ later time.
 import csv
 from collections import OrderedDict
 from datetime import timedelta
-from itertools import chain
 import json
 import os
-import tempfile
+import shutil
 from urllib.parse import urlparse
-from zipfile import ZipFile, ZIP_DEFLATED
 
-from celery import Celery, bootsteps, signals, Task
+from celery import Celery, bootsteps, chord, group, signals, Task
 from celery.bin import Option
 from celery.utils.log import get_task_logger
-from pyramid.settings import aslist
+from pyramid.settings import asbool, aslist
 from pyramid.paster import get_appsettings
 import humanize
 from redis import Redis
 import sqlalchemy as sa
 from sqlalchemy import orm
 
-from . import models, exports
+from . import models, exports, importer, report_tables
+from .exports import cache as export_cache
+from .exports.cache import ExportCache
+from .exports.storage import get_storage
+from .utils import cache
 
 
 class IniConfigLoader(bootsteps.Step):
@@ -81,6 +83,47 @@ def configure(settings):
         settings['studies.export.expire'] = \
             int(settings['studies.export.expire'])
 
+    # Number of rows fetched per round-trip from the server-side cursor
+    settings['studies.export.batch_size'] = \
+        int(settings.get('studies.export.batch_size', 1000))
+
+    # Rows per keyset-paginated query of CSV data files (0 disables)
+    settings['studies.export.chunk_size'] = \
+        int(settings.get('studies.export.chunk_size', 0))
+
+    # Checkouts with up to this many rows are streamed directly (0 disables)
+    settings['studies.export.stream_limit'] = \
+        int(settings.get('studies.export.stream_limit', 0))
+
+    # Total bytes of generated data files to keep for reuse (0 disables)
+    settings['studies.export.cache.size'] = \
+        int(settings.get('studies.export.cache.size', 0))
+
+    # Default data file generator for new exports (python or copy)
+    settings.setdefault('studies.export.backend', 'python')
+
+    # Where finished archives are kept (see `occams.exports.storage`)
+    settings.setdefault('studies.export.storage', 'local')
+    assert settings['studies.export.storage'] in ('local', 's3'), \
+        'Unsupported storage: %s' % settings['studies.export.storage']
+
+    # Archive compression method and (method-specific) level
+    settings.setdefault('studies.export.compression', 'deflate')
+    assert settings['studies.export.compression'] in exports.COMPRESSION, \
+        'Unsupported compression: %s' % settings['studies.export.compression']
+
+    if settings.get('studies.export.compression_level') not in (None, ''):
+        settings['studies.export.compression_level'] = \
+            int(settings['studies.export.compression_level'])
+    else:
+        settings['studies.export.compression_level'] = None
+
+    # Column plans and codebooks may be shared across processes via redis
+    metadata_redis = None
+    if asbool(settings.get('studies.metadata_cache.redis')):
+        metadata_redis = Redis.from_url(settings['redis.url'])
+    cache.configure(settings, redis=metadata_redis)
+
     app.conf.update(
         broker_url=settings['celery.broker.url'],
         result_backend=settings['celery.backend.url'],
@@ -224,10 +267,28 @@ class OccamsTask(Task):
         return self._redis
 
 
+# Chunk size used when copying data files into an archive
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def _get_parts_dir(export):
+    """
+    Returns the staging directory for an export's individual data files
+    """
+    return export.path + '.parts'
+
+
+def _get_checkpoints_key(export):
+    """
+    Returns the redis hash of an export's per-plan progress
+    """
+    return export.redis_key + ':checkpoints'
+
+
 @with_transaction
 def on_failure_make_export(self, exc, task_id, args, kwargs, einfo):
     """
-    Error handler for `make_export` task.
+    Error handler for `make_export` task and its subtasks.
     Marks the export as failed dispatches failure to listening applications.
     """
     dbsession = self.dbsession
@@ -236,9 +297,15 @@ def on_failure_make_export(self, exc, task_id, args, kwargs, einfo):
     log.error('Task {0} raised exception: {1!r}\n{2!r}'.format(
               task_id, exc, einfo))
 
-    export = dbsession.query(models.Export).filter_by(name=task_id).one()
+    # All export tasks receive the export name as their first argument
+    name, *_ = args
+
+    export = dbsession.query(models.Export).filter_by(name=name).one()
     export.status = u'failed'
 
+    shutil.rmtree(_get_parts_dir(export), ignore_errors=True)
+    redis.delete(_get_checkpoints_key(export))
+
     redis.hset(export.redis_key, 'status', export.status)
     redis.publish('export', json.dumps(redis.hgetall(export.redis_key)))
 
@@ -260,6 +327,11 @@ def make_export(self, name):
     conditions,
     (http://docs.celeryproject.org/en/latest/userguide/tasks.html#state)
 
+    Each data file is generated by its own `make_export_member` subtask
+    so that they may be processed in parallel by available workers.
+    Once all data files are complete, `assemble_export` bundles them
+    into the final archive.
+
     All progress will be broadcast to the redis **export** channel with the
     following dictionary:
     export_id -- the export being processed
@@ -285,32 +357,186 @@ def make_export(self, name):
         'total': len(export.contents),
     })
 
-    with ZipFile(export.path, mode='w', compression=ZIP_DEFLATED) as zfp:
-        exportables = exports.list_all(dbsession)
+    os.makedirs(_get_parts_dir(export), exist_ok=True)
 
-        for item in export.contents:
-            plan = exportables[item['name']]
+    members = group(
+        make_export_member.si(name, item['name'])
+        for item in export.contents)
+
+    chord(members)(assemble_export.si(name))
+
+
+@app.task(
+    name='make_export_member',
+    base=OccamsTask,
+    bind=True,
+    # Redeliver to another worker if this one dies mid-export
+    acks_late=True,
+    reject_on_worker_lost=True,
+    on_failure=on_failure_make_export
+)
+@with_transaction
+def make_export_member(self, name, plan_name):
+    """
+    Generates a single data file of an export
+
+    Progress is checkpointed to redis so that if the task is redelivered
+    (e.g. after a worker restart) completed data files are kept and CSV
+    files are resumed from the last record id written.
+
+    Parameters:
+    name -- the export being processed
+    plan_name -- the export plan to generate data for
+    """
+
+    redis = self.redis
+    dbsession = self.dbsession
+    settings = self.app.conf.settings
+
+    export = dbsession.query(models.Export).filter_by(name=name).one()
+    plan = exports.list_all(dbsession)[plan_name]
+    file_name = plan.get_file_name(export.file_format)
+    path = os.path.join(_get_parts_dir(export), file_name)
+    batch_size = settings['studies.export.batch_size']
+    chunk_size = settings['studies.export.chunk_size']
+
+    checkpoints_key = _get_checkpoints_key(export)
+    checkpoint = json.loads(redis.hget(checkpoints_key, plan_name) or '{}')
+
+    if not os.path.exists(path):
+        checkpoint = {}
+
+    def save_checkpoint(**state):
+        redis.hset(checkpoints_key, plan_name, json.dumps(state))
+
+    if checkpoint.get('complete'):
+        log.info(f'Already generated: {plan_name}')
+        return file_name
+
+    cache = ExportCache.from_settings(settings)
+    cache_key = None
+    resume_id = checkpoint.get('last_id')
+
+    if cache.is_enabled and resume_id is None and plan.source_tables:
+        cacheable = not export_cache.has_pending_writes(
+            dbsession, plan.source_tables)
+        cache_key = export_cache.make_key(
+            plan,
+            export_cache.get_data_version(dbsession, plan.source_tables),
+            use_choice_labels=export.use_choice_labels,
+            expand_collections=export.expand_collections,
+            ignore_private=True,
+            file_format=export.file_format,
+            backend=export.backend)
+
+    if cache_key and cache.fetch(cache_key, file_name, path):
+        log.info(f'Reusing cached data file for {plan_name}')
+        save_checkpoint(complete=True)
+    else:
+        options = {
+            'use_choice_labels': export.use_choice_labels,
+            'expand_collections': export.expand_collections,
+        }
+
+        if resume_id is not None:
+            log.info(f'Resuming {plan_name} after id {resume_id}')
+            options['after'] = resume_id
+            # Discard anything written after the checkpoint
+            os.truncate(path, checkpoint['offset'])
+        elif os.path.exists(path):
+            # Never write through a hard link to a cached file
+            os.unlink(path)
+
+        query = plan.data(**options)
+
+        if export.file_format == 'parquet':
+            with open(path, 'wb') as fp:
+                exports.write_parquet(
+                    fp, query, list(plan.codebook()), batch_size=batch_size)
+        elif export.backend == 'copy':
+            with open(path, 'w') as fp:
+                exports.copy_data(fp, query)
+        elif chunk_size:
+            with open(path, 'a' if resume_id is not None else 'w') as fp:
+                exports.write_chunks(
+                    fp,
+                    [d['name'] for d in query.column_descriptions],
+                    plan.iterchunks(chunk_size, **options),
+                    header=resume_id is None,
+                    checkpoint=lambda last_id: save_checkpoint(
+                        last_id=last_id, offset=fp.tell()))
+        else:
+            with open(path, 'a' if resume_id is not None else 'w') as fp:
+                exports.write_data(
+                    fp, query,
+                    batch_size=batch_size,
+                    header=resume_id is None,
+                    checkpoint=lambda last_id: save_checkpoint(
+                        last_id=last_id, offset=fp.tell()))
+
+        save_checkpoint(complete=True)
 
-            with tempfile.NamedTemporaryFile(mode='w') as tfp:
-                exports.write_data(tfp, plan.data(
-                    use_choice_labels=export.use_choice_labels,
-                    expand_collections=export.expand_collections))
-                zfp.write(tfp.name, plan.file_name)
+        # Only completed files may be linked into the cache, since resumed
+        # files are modified in place
+        if cache_key and cacheable:
+            cache.store(cache_key, file_name, path)
 
-            redis.hincrby(export.redis_key, 'count')
-            data = redis.hgetall(export.redis_key)
-            redis.publish('export', json.dumps(data))
+    redis.hincrby(export.redis_key, 'count')
+    data = redis.hgetall(export.redis_key)
+    redis.publish('export', json.dumps(data))
 
-            count, total, name = data['count'], data['total'], item['name']
-            log.info(f'{count} of {total}: {name}')
+    count, total = data['count'], data['total']
+    log.info(f'{count} of {total}: {plan_name}')
 
-        with tempfile.NamedTemporaryFile(mode='w') as tfp:
-            codebook_chain = \
-                [p.codebook() for p in exportables.values()]
-            exports.write_codebook(tfp, chain.from_iterable(codebook_chain))
-            zfp.write(tfp.name, exports.codebook.FILE_NAME)
+    return file_name
+
+
+@app.task(
+    name='assemble_export',
+    base=OccamsTask,
+    bind=True,
+    ignore_result=True,
+    on_failure=on_failure_make_export
+)
+@with_transaction
+def assemble_export(self, name):
+    """
+    Bundles the generated data files of an export into its final archive
+
+    Parameters:
+    name -- the export being processed
+    """
+
+    redis = self.redis
+    dbsession = self.dbsession
+    settings = self.app.conf.settings
+
+    export = dbsession.query(models.Export).filter_by(name=name).one()
+    parts_dir = _get_parts_dir(export)
+    exportables = exports.list_all(dbsession)
+
+    storage = get_storage(settings)
+
+    with storage.open(export.name) as out, exports.open_archive(
+            out,
+            compression=settings['studies.export.compression'],
+            compresslevel=settings['studies.export.compression_level']) as zfp:
+        for item in export.contents:
+            plan = exportables[item['name']]
+            file_name = plan.get_file_name(export.file_format)
+            with open(os.path.join(parts_dir, file_name), 'rb') as src, \
+                    exports.open_member(zfp, file_name, binary=True) as dst:
+                shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+
+        with exports.open_member(zfp, exports.codebook.FILE_NAME) as fp:
+            exports.write_codebook(
+                fp, exports.iter_codebook(dbsession, exportables.values()))
+
+    shutil.rmtree(parts_dir, ignore_errors=True)
+    redis.delete(_get_checkpoints_key(export))
 
     export.status = 'complete'
+    export.file_size = storage.size(export.name)
     redis.hmset(export.redis_key, {
         'status': export.status,
         'file_size': humanize.naturalsize(export.file_size)
@@ -319,23 +545,77 @@ def make_export(self, name):
 
 
 @app.task(name='make_codebook', base=OccamsTask, ignore_result=True, bind=True)
+@with_transaction
 def make_codebook(self):
     """
     Creates a coodebook file that is ready to be served on demand by the web app
+
+    Codebook fragments of published forms that are missing or out of date
+    are regenerated first.
     """
     dbsession = self.dbsession
     export_dir= self.app.conf.settings['studies.export.dir']
     try:
-        codebook_chain = \
-            [p.codebook() for p in exports.list_all(dbsession).values()]
+        exports.fragments.refresh(dbsession)
+        plans = exports.list_all(dbsession).values()
         path = os.path.join(export_dir, exports.codebook.FILE_NAME)
         with open(path, 'w') as fp:
-            exports.write_codebook(fp, chain.from_iterable(codebook_chain))
+            exports.write_codebook(fp, exports.iter_codebook(dbsession, plans))
     except Exception as exc:
         # Need to keep retrying (default is every 3 min)
         self.retry(exc=exc)
 
 
+@app.task(
+    name='refresh_report_tables',
+    base=OccamsTask,
+    ignore_result=True,
+    bind=True)
+@with_transaction
+def refresh_report_tables(self):
+    """
+    Brings the materialized report tables of published forms up to date
+
+    Meant to be scheduled via celery beat, for example:
+
+        celery.beat = report_tables
+        celery.beat.report_tables.task = refresh_report_tables
+        celery.beat.report_tables.schedule = timedelta
+        celery.beat.report_tables.schedule.minutes = 5
+    """
+    names = report_tables.refresh_all(self.dbsession)
+    log.info('Refreshed {} report tables'.format(len(names)))
+
+
+@app.task(name='import_entities', base=OccamsTask, bind=True)
+@with_transaction
+def import_entities(self, path, schema_name, publish_date, **options):
+    """
+    Imports a CSV or Parquet file of form data (see `occams.importer`)
+
+    Rejected rows are written next to the file as ``<path>.rejected.csv``.
+
+    Parameters:
+    path -- path to the data file, readable by the worker
+    schema_name -- the name of the form
+    publish_date -- the publish date of the version (ISO format)
+    options -- passed to `occams.importer.import_file`
+
+    Returns:
+    A summary of the import (rows, imported and rejected counts)
+    """
+    result = importer.import_file(
+        self.dbsession, path, schema_name, publish_date, **options)
+
+    if result.rejected:
+        with open(path + '.rejected.csv', 'w', newline='') as fp:
+            importer.write_rejected(fp, result)
+
+    summary = result.to_json()
+    log.info('Imported {imported} of {rows} rows'.format(**summary))
+    return summary
+
+
 @signals.celeryd_after_setup.connect
 def on_celeryd_after_setup(**kw):
     """
@@ -0,0 +1,180 @@
+"""
+Form metadata cache
+
+Column plans and codebook rows only change when a form is published,
+retracted or has its fields edited, yet they are recomputed for every
+report, export and data entry request. This module stores them in a small
+in-process LRU cache which may optionally be backed by Redis so that all
+web and worker processes share the same entries.
+
+Entries are JSON documents, so every lookup returns a fresh copy that
+callers are free to modify.
+
+Objects that cannot be serialized (such as generated form classes and
+compiled validators) are kept in a process-local LRU cache instead, see
+`LocalCache`.
+"""
+
+from collections import OrderedDict
+from datetime import date, datetime
+import json
+import threading
+
+
+class LocalCache(object):
+    """
+    Thread-safe, size-bounded, least-recently-used cache of objects
+    """
+
+    def __init__(self, size=128):
+        """
+        Parameters:
+        size -- maximum number of entries (0 disables)
+        """
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the object cached for key, or None if it is not cached
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        """
+        Caches an object, evicting the least recently used if full
+        """
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Discards all entries
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+class MetadataCache(object):
+    """
+    Two-tier (process-local then Redis) cache of JSON documents
+    """
+
+    def __init__(self, size=128, redis=None, expire=None, prefix='occams:metadata:'):
+        """
+        Parameters:
+        size -- maximum number of entries kept in process (0 disables)
+        redis -- (Optional) Redis client used to share entries
+        expire -- (Optional) seconds until shared entries expire
+        prefix -- key prefix for shared entries
+        """
+        self.redis = redis
+        self.expire = expire
+        self.prefix = prefix
+        self._local = LocalCache(size)
+
+    @property
+    def size(self):
+        return self._local.size
+
+    @size.setter
+    def size(self, value):
+        self._local.size = value
+
+    def get(self, key):
+        """
+        Returns the decoded document for key, or None if it is not cached
+        """
+        if self.size <= 0 and self.redis is None:
+            return None
+
+        encoded = self._local.get(key)
+
+        if encoded is None and self.redis is not None:
+            encoded = self.redis.get(self.prefix + key)
+            if encoded is not None:
+                if isinstance(encoded, bytes):
+                    encoded = encoded.decode('utf-8')
+                self._local.set(key, encoded)
+
+        return None if encoded is None else json.loads(encoded)
+
+    def set(self, key, value):
+        """
+        Caches a JSON-serializable value (dates are stored in ISO format)
+        """
+        if self.size <= 0 and self.redis is None:
+            return
+        encoded = json.dumps(value, default=_encode)
+        self._local.set(key, encoded)
+        if self.redis is not None:
+            self.redis.set(self.prefix + key, encoded, ex=self.expire)
+
+    def get_or_create(self, key, creator):
+        """
+        Returns the cached value for key, generating it with creator on a miss
+        """
+        value = self.get(key)
+        if value is None:
+            value = creator()
+            self.set(key, value)
+            # Round-trip so that hits and misses return the same types
+            value = json.loads(json.dumps(value, default=_encode))
+        return value
+
+    def clear(self):
+        """
+        Discards all process-local entries
+        """
+        self._local.clear()
+
+
+def _encode(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError('Cannot encode %r' % value)
+
+
+metadata_cache = MetadataCache()
+
+# Generated data entry form classes, see `occams.renderers.make_form`
+form_cache = LocalCache(size=64)
+
+# Compiled attribute validators, see `occams.bulk.get_validator`
+validator_cache = LocalCache(size=128)
+
+
+def configure(settings, redis=None):
+    """
+    Configures the shared metadata cache from application settings
+
+    Settings:
+    studies.metadata_cache.size -- process-local entries (default: 128)
+    studies.metadata_cache.expire -- seconds shared entries live (default: 1 day)
+    studies.form_cache.size -- generated form classes kept (default: 64)
+    studies.validator_cache.size -- compiled validators kept (default: 128)
+
+    Parameters:
+    settings -- application settings
+    redis -- (Optional) Redis client, entries are process-local otherwise
+    """
+    metadata_cache.size = int(settings.get('studies.metadata_cache.size', 128))
+    metadata_cache.expire = \
+        int(settings.get('studies.metadata_cache.expire', 86400))
+    metadata_cache.redis = redis
+    metadata_cache.clear()
+    form_cache.size = int(settings.get('studies.form_cache.size', 64))
+    form_cache.clear()
+    validator_cache.size = \
+        int(settings.get('studies.validator_cache.size', 128))
+    validator_cache.clear()
@@ -14,6 +14,7 @@ from wtforms_components import DateRange
 
 from .. import _, log, models
 from ..reporting import build_report
+from ..report_tables import get_report
 from ..renderers import make_form, render_form, apply_data, entity_data, modes
 from ..utils.forms import wtferrors, ModelField, Form
 
@@ -468,8 +469,10 @@ def randomize_ajax(context, request):
                         return HTTPFound(location=request.current_route_path(
                             _query={'procid': internal_procid}))
                 else:
-                    report = build_report(
-                        dbsession, enrollment.study.randomization_schema.name)
+                    schema_name = enrollment.study.randomization_schema.name
+                    report = get_report(dbsession, schema_name)
+                    if report is None:
+                        report = build_report(dbsession, schema_name)
                     data = form.data
 
                     # Get an unassigned entity that matches the input criteria
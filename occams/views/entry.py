@@ -9,7 +9,7 @@ from wtforms.ext.dateutil.fields import DateField
 from wtforms_components import DateRange
 
 
-from .. import _, models
+from .. import _, models, bulk
 from ..utils.forms import wtferrors, ModelField, Form
 from ..renderers import make_form, render_form, entity_data, form2json, version2json
 
@@ -295,6 +295,57 @@ def add_json(context, request):
     return {'__next__': next}
 
 
+@view_config(
+    route_name='studies.visit_forms_bulk',
+    xhr=True,
+    permission='add',
+    request_method='POST',
+    renderer='json')
+@view_config(
+    route_name='studies.patient_forms_bulk',
+    xhr=True,
+    permission='add',
+    request_method='POST',
+    renderer='json')
+def bulk_json(context, request):
+    """
+    Adds or updates many forms in one request
+
+    Expects a JSON body with a list of ``entities``
+    (see `occams.bulk.save` for their format).
+
+    Settings:
+    studies.entry.bulk_limit -- maximum number of entities per request
+    """
+    check_csrf_token(request)
+    dbsession = request.dbsession
+
+    limit = int(request.registry.settings.get(
+        'studies.entry.bulk_limit', 1000))
+
+    try:
+        entries = request.json_body['entities']
+    except (ValueError, KeyError, TypeError):
+        raise HTTPBadRequest(json={'errors': {
+            'entities': request.localizer.translate(
+                _(u'This field is required'))}})
+
+    if not isinstance(entries, list) or not entries or len(entries) > limit:
+        raise HTTPBadRequest(json={'errors': {
+            'entities': request.localizer.translate(
+                _(u'Expected a list of up to ${limit} forms'),
+                mapping={'limit': limit})}})
+
+    ids, errors = bulk.save(dbsession, context.__parent__, entries)
+
+    if errors:
+        raise HTTPBadRequest(json={'errors': dict(
+            (key, request.localizer.translate(message))
+            for key, message in errors.items())})
+
+    return {'ids': ids}
+
+
 @view_config(
     route_name='studies.visit_forms',
     xhr=True,
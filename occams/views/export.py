@@ -7,13 +7,14 @@ from babel.dates import format_datetime
 from humanize import naturalsize
 from pyramid.i18n import get_localizer, negotiate_locale_name
 from pyramid.httpexceptions import HTTPBadRequest, HTTPFound, HTTPOk
-from pyramid.response import FileResponse
 from pyramid.csrf import check_csrf_token
 from pyramid.view import view_config
+import sqlalchemy as sa
 import transaction
 import wtforms
 
 from .. import _, log, models, exports, tasks
+from ..exports.storage import DownloadResponse, get_storage
 from ..utils.forms import wtferrors, Form
 from ..utils.pagination import Pagination
 
@@ -73,17 +74,32 @@ def checkout(context, request):
                     wtforms.validators.InputRequired()])
             expand_collections = wtforms.BooleanField(default=False)
             use_choice_labels = wtforms.BooleanField(default=False)
+            backend = wtforms.SelectField(
+                choices=[('python', _(u'Standard')),
+                         ('copy', _(u'Fast (database native)'))],
+                default=request.registry.settings.get(
+                    'studies.export.backend', 'python'))
+            file_format = wtforms.SelectField(
+                choices=[('csv', _(u'CSV')), ('parquet', _(u'Parquet'))],
+                default='csv')
 
         form = CheckoutForm(request.POST)
 
         if not form.validate():
             errors = wtferrors(form)
         else:
+            # Small checkouts are downloaded right away
+            response = stream_export(request, form, exportables)
+            if response is not None:
+                return response
+
             task_id = str(uuid.uuid4())
             dbsession.add(models.Export(
                 name=task_id,
                 expand_collections=form.expand_collections.data,
                 use_choice_labels=form.use_choice_labels.data,
+                backend=form.backend.data,
+                file_format=form.file_format.data,
                 owner_user=(dbsession.query(models.User)
                             .filter_by(key=request.authenticated_userid)
                             .one()),
@@ -114,6 +130,59 @@ def checkout(context, request):
     }
 
 
+def stream_export(request, form, exportables):
+    """
+    Returns a ZIP archive of the selected data files generated on the fly
+
+    Checkouts with no more rows than ``studies.export.stream_limit`` (in
+    total) are streamed directly to the browser instead of being queued.
+    The archive is compressed as rows are fetched from the database so the
+    download starts right away. Only CSV data files may be streamed.
+    REQUIRES GUNICORN WITH GEVENT WORKER
+
+    Returns:
+    A streaming response, or None if the checkout is too large
+    """
+    dbsession = request.dbsession
+    settings = request.registry.settings
+    limit = settings.get('studies.export.stream_limit') or 0
+
+    if limit <= 0 or form.file_format.data != 'csv':
+        return None
+
+    plans = [exportables[name] for name in form.contents.data]
+    members = []
+    total = 0
+
+    for plan in plans:
+        query = plan.data(
+            use_choice_labels=form.use_choice_labels.data,
+            expand_collections=form.expand_collections.data)
+        # Only count up to the remaining budget
+        subquery = query.limit(limit - total + 1).subquery()
+        total += (
+            dbsession.query(sa.func.count())
+            .select_from(subquery)
+            .scalar())
+        if total > limit:
+            return None
+        members.append((plan.file_name, query))
+
+    codebook_rows = list(exports.iter_codebook(dbsession, plans))
+
+    response = request.response
+    response.content_type = 'application/zip'
+    response.content_disposition = 'attachment;filename=export.zip'
+    response.app_iter = exports.stream_archive(
+        dbsession.bind,
+        members,
+        codebook_rows=codebook_rows,
+        compression=settings.get('studies.export.compression', 'deflate'),
+        compresslevel=settings.get('studies.export.compression_level'),
+        batch_size=settings.get('studies.export.batch_size', 1000))
+    return response
+
+
 @view_config(
     route_name='studies.exports_codebook',
     permission='view',
@@ -168,9 +237,8 @@ def codebook_download(context, request):
     if not os.path.isfile(path):
         log.warn('Trying to download codebook before it\'s pre-cooked!')
         raise HTTPBadRequest(u'Codebook file is not ready yet')
-    response = FileResponse(path)
-    response.content_disposition = 'attachment;filename=%s' % codebook_name
-    return response
+    return DownloadResponse(
+        path, codebook_name, codebook_name, content_type='text/csv')
 
 
 @view_config(
@@ -207,6 +275,13 @@ def status_json(context, request):
 
     redis = request.redis
 
+    def get_file_size(export):
+        if export.file_size is None and export.status == 'complete':
+            # Archives completed before sizes were recorded
+            storage = get_storage(request.registry.settings)
+            return storage.size(export.name)
+        return export.file_size
+
     def export2json(export):
         # TODO: This doesn't actually work, I can't figure out how to get
         #       the corect data out of redis
@@ -216,6 +291,7 @@ def status_json(context, request):
             data = {}
         log.debug('info: {}'.format(str(data)))
         count = len(export.contents)
+        file_size = get_file_size(export)
         return {
             'id': export.id,
             'title': localizer.pluralize(
@@ -226,11 +302,12 @@ def status_json(context, request):
             'status': export.status,
             'use_choice_labels': export.use_choice_labels,
             'expand_collections': export.expand_collections,
+            'backend': export.backend,
+            'file_format': export.file_format,
             'contents': sorted(export.contents, key=lambda v: v['title']),
             'count': data.get('count'),
             'total': data.get('total'),
-            'file_size': (naturalsize(export.file_size)
-                          if export.file_size else None),
+            'file_size': naturalsize(file_size) if file_size else None,
             'download_url': request.route_path('studies.export_download',
                                                export=export.id),
             'delete_url': request.route_path('studies.export',
@@ -308,6 +385,7 @@ def delete_json(context, request):
     dbsession.delete(export)
     dbsession.flush()
     tasks.app.control.revoke(export.name)
+    get_storage(request.registry.settings).delete(export.name)
     return HTTPOk()
 
 
@@ -325,12 +403,8 @@ def download(context, request):
     if export.status != 'complete':
         raise HTTPBadRequest('Export is not complete')
 
-    export_dir = request.registry.settings['studies.export.dir']
-    path = os.path.join(export_dir, export.name)
-
-    response = FileResponse(path)
-    response.content_disposition = 'attachment;filename=export.zip'
-    return response
+    storage = get_storage(request.registry.settings)
+    return storage.make_response(request, export.name, 'export.zip')
 
 
 def query_exports(request):
@@ -15,6 +15,7 @@ from wtforms_components import DateRange
 from zope.sqlalchemy import mark_changed
 
 from .. import _, models
+from ..exc import ConstraintError
 from . import cycle as cycle_views
 from ..utils.forms import Form, wtferrors, ModelField
 from ..utils.pagination import Pagination
@@ -846,6 +847,9 @@ def upload_randomization_json(context, request):
         * RANDID
     In addition, the CSV file must have the columns as the form
     it is using for randomization.
+
+    The whole file is rejected if any (non-blank) form value violates
+    the constraints of the randomization form.
     """
 
     check_csrf_token(request)
@@ -890,7 +894,23 @@ def upload_randomization_json(context, request):
         .filter_by(name=u'complete')
         .one())
 
-    for row in reader:
+    validator = context.randomization_schema.validator
+
+    for line, row in enumerate(reader, start=2):
+        data = {
+            key: row[fieldnames[key.upper()]]
+            for key in formkeys
+        }
+
+        # Blank cells are stored as-is, they have nothing to validate
+        try:
+            validator.validate(dict(
+                (key, value) for key, value in data.items() if value))
+        except ConstraintError as e:
+            raise HTTPBadRequest(body=_(
+                u'Invalid value for ${column} on line ${line}',
+                mapping={'column': e.args[1], 'line': line}))
+
         arm_name = row[fieldnames['ARM']]
         if arm_name not in arms:
             arms[arm_name] = models.Arm(
@@ -910,10 +930,7 @@ def upload_randomization_json(context, request):
         entity = models.Entity(
             schema=context.randomization_schema,
             state=complete,
-            data={
-                key: row[fieldnames[key.upper()]]
-                for key in formkeys
-            }
+            data=data
         )
 
         stratum.entities.add(entity)
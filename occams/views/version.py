@@ -15,6 +15,7 @@ import wtforms.ext.dateutil.fields
 from wtforms_components import DateRange
 
 from .. import _, models
+from ..exports import fragments
 from ..utils.forms import Form
 from ..renderers import make_form, render_form, apply_data
 from . import field as field_views
@@ -175,6 +176,9 @@ def publish_json(context, request):
 
     dbsession.flush()
 
+    # Precompute the version's codebook rows while they are fresh
+    fragments.refresh(dbsession, ids=[context.id])
+
     return view_json(context, request)
 
 
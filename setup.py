@@ -37,13 +37,18 @@ setup(
     include_package_data=True,
     zip_safe=False,
     install_requires=REQUIRES,
-    extras_require={'develop': DEVELOP},
+    extras_require={
+        'develop': DEVELOP,
+        'parquet': ['pyarrow'],
+        's3': ['boto3'],
+    },
     tests_require=DEVELOP,
     entry_points="""\
     [paste.app_factory]
     main = occams:main
     [console_scripts]
     occams_buildassets = occams.scripts.buildassets:main
+    occams_import = occams.scripts.importer:main
     occams_initdb = occams.scripts.initdb:main
     """,
 )
@@ -88,6 +88,24 @@ def create_tables(request):
     request.addfinalizer(drop_tables)
 
 
+@pytest.fixture(autouse=True)
+def metadata_cache():
+    """
+    Isolates the process-local form metadata caches between tests
+
+    :returns: the shared metadata cache
+    """
+    from occams.utils.cache import \
+        metadata_cache, form_cache, validator_cache
+    metadata_cache.clear()
+    form_cache.clear()
+    validator_cache.clear()
+    yield metadata_cache
+    metadata_cache.clear()
+    form_cache.clear()
+    validator_cache.clear()
+
+
 @pytest.fixture
 def config(request):
     """
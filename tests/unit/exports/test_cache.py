@@ -0,0 +1,98 @@
+class TestMakeKey:
+
+    def test_options(self):
+        """
+        It should generate different keys for different contents
+        """
+        from occams.exports.cache import make_key
+        from occams.exports.plan import ExportPlan
+
+        plan = ExportPlan()
+        plan.name = 'foo'
+
+        key = make_key(plan, 5, use_choice_labels=False)
+        assert key == make_key(plan, 5, use_choice_labels=False)
+        assert key != make_key(plan, 6, use_choice_labels=False)
+        assert key != make_key(plan, 5, use_choice_labels=True)
+
+
+class TestExportCache:
+
+    def test_fetch_store(self, tmpdir):
+        """
+        It should reuse stored files
+        """
+        from occams.exports.cache import ExportCache
+
+        cache = ExportCache(str(tmpdir.join('cache')), 1024)
+        source = tmpdir.join('source.csv')
+        source.write('a,b\n')
+
+        destination = str(tmpdir.join('destination.csv'))
+        assert not cache.fetch('key', 'foo.csv', destination)
+
+        cache.store('key', 'foo.csv', str(source))
+        assert cache.fetch('key', 'foo.csv', destination)
+        assert open(destination).read() == 'a,b\n'
+
+    def test_evict(self, tmpdir):
+        """
+        It should evict least recently used files over the size limit
+        """
+        import os
+        from occams.exports.cache import ExportCache
+
+        cache = ExportCache(str(tmpdir.join('cache')), 10)
+        old = tmpdir.join('old.csv')
+        old.write('x' * 6)
+        new = tmpdir.join('new.csv')
+        new.write('y' * 6)
+
+        cache.store('old', 'foo.csv', str(old))
+        os.utime(cache.get_path('old', 'foo.csv'), (0, 0))
+        cache.store('new', 'foo.csv', str(new))
+
+        assert not os.path.exists(cache.get_path('old', 'foo.csv'))
+        assert os.path.exists(cache.get_path('new', 'foo.csv'))
+
+    def test_disabled(self, tmpdir):
+        """
+        It should not store anything if the cache has no space
+        """
+        from occams.exports.cache import ExportCache
+
+        cache = ExportCache(str(tmpdir.join('cache')), 0)
+        source = tmpdir.join('source.csv')
+        source.write('a,b\n')
+        cache.store('key', 'foo.csv', str(source))
+        assert not tmpdir.join('cache').check()
+
+
+class TestGetDataVersion:
+
+    def test_source_tables(self, dbsession):
+        """
+        It should only change with writes to the given tables
+        """
+        from occams import models
+        from occams.exports.cache import get_data_version, has_pending_writes
+
+        tables = ['site', 'patient']
+
+        dbsession.add(models.Site(name=u'ucsd', title=u'UCSD'))
+        dbsession.flush()
+        version = get_data_version(dbsession, tables)
+        assert version is not None
+
+        dbsession.add(models.Export(
+            owner_user=models.User(key=u'joe'), contents=[]))
+        dbsession.flush()
+        assert get_data_version(dbsession, tables) == version
+
+        site = dbsession.query(models.Site).one()
+        dbsession.add(models.Patient(pid=u'P1', site=site))
+        dbsession.flush()
+        assert get_data_version(dbsession, tables) > version
+
+        # Writes of the current transaction are not pending
+        assert not has_pending_writes(dbsession, tables)
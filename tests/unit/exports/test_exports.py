@@ -1,3 +1,6 @@
+import pytest
+
+
 class TestWriteData:
 
     def test_unicode(self, dbsession):
@@ -22,6 +25,174 @@ class TestWriteData:
         assert sorted(['anumeric', 'astring']) == sorted(rows[0])
         assert sorted(['420', '¿Qué pasa?']) == sorted(rows[1])
 
+    def test_batch_size(self, dbsession):
+        """
+        It should stream rows in batches, preserving column order
+        """
+        from contextlib import closing
+        import io
+        from sqlalchemy import func
+        from occams import exports
+
+        series = func.generate_series(1, 25).label('num')
+        query = dbsession.query(series, (series * 2).label('double'))
+
+        with closing(io.StringIO()) as fp:
+            exports.write_data(fp, query, batch_size=10)
+            fp.seek(0)
+            rows = [r for r in exports.csv.reader(fp)]
+
+        assert ['num', 'double'] == rows[0]
+        assert 26 == len(rows)
+        assert ['25', '50'] == rows[-1]
+
+    def test_checkpoint(self, dbsession):
+        """
+        It should report checkpoints without splitting rows of the same id
+        """
+        from contextlib import closing
+        import io
+        from sqlalchemy import func
+        from occams import exports
+
+        # Every id (except the first) appears twice
+        series = func.generate_series(1, 10).label('num')
+        query = dbsession.query((series / 2).label('id'), series)
+
+        checkpoints = []
+
+        with closing(io.StringIO()) as fp:
+            exports.write_data(
+                fp, query,
+                batch_size=3,
+                checkpoint=lambda last_id: checkpoints.append(
+                    (last_id, fp.tell())))
+            contents = fp.getvalue()
+
+        assert [1, 3] == [last_id for last_id, _ in checkpoints]
+
+        # Resuming after the last checkpoint yields the same file
+        last_id, offset = checkpoints[-1]
+        subquery = query.subquery()
+        resumed = dbsession.query(subquery).filter(subquery.c.id > last_id)
+        with closing(io.StringIO(contents[:offset])) as fp:
+            fp.seek(offset)
+            exports.write_data(fp, resumed, header=False)
+            assert contents == fp.getvalue()
+
+
+class TestCopyData:
+
+    def test_matches_write_data(self, dbsession):
+        """
+        It should generate the same CSV as the python writer
+        """
+        from contextlib import closing
+        from datetime import date
+        import io
+        from sqlalchemy import literal, literal_column, Date, Integer, Unicode
+        from occams import exports
+
+        query = dbsession.query(
+            literal_column(u"'420'", Integer).label('anumeric'),
+            literal(u'¿Qué pasa?', Unicode).label('astring'),
+            literal(date(2020, 1, 31), Date).label('adate'),
+            )
+
+        with closing(io.StringIO()) as fp:
+            exports.copy_data(fp, query)
+            copied = fp.getvalue()
+
+        with closing(io.StringIO()) as fp:
+            exports.write_data(fp, query)
+            written = fp.getvalue()
+
+        assert list(exports.csv.reader(io.StringIO(copied))) == \
+            list(exports.csv.reader(io.StringIO(written)))
+
+
+class TestWriteParquet:
+
+    def test_typed_columns(self, dbsession):
+        """
+        It should store columns using the types specified in the codebook
+        """
+        from contextlib import closing
+        from datetime import date
+        from decimal import Decimal
+        import io
+        import pytest
+        pa = pytest.importorskip('pyarrow')
+        import pyarrow.parquet as pq
+        from sqlalchemy import literal, Date, Integer, Numeric, Unicode
+        from occams import exports
+        from occams.exports.codebook import row, types
+
+        query = dbsession.query(
+            literal(420, Integer).label('anumeric'),
+            literal(Decimal('4.20'), Numeric).label('adecimal'),
+            literal(u'¿Qué pasa?', Unicode).label('astring'),
+            literal(date(2020, 1, 31), Date).label('adate'),
+            literal(u'1;2', Unicode).label('acollection'),
+            literal(1, Integer).label('uncoded'),
+            )
+
+        rows = [
+            row('anumeric', 'aform', types.NUMBER, decimal_places=0),
+            row('adecimal', 'aform', types.NUMBER, decimal_places=2),
+            row('astring', 'aform', types.STRING),
+            row('adate', 'aform', types.DATE),
+            row('acollection', 'aform', types.CHOICE, is_collection=True),
+        ]
+
+        with closing(io.BytesIO()) as fp:
+            exports.write_parquet(fp, query, rows, batch_size=10)
+            fp.seek(0)
+            table = pq.read_table(fp)
+
+        assert table.schema.field('anumeric').type == pa.int64()
+        assert table.schema.field('adecimal').type == pa.float64()
+        assert table.schema.field('astring').type == pa.string()
+        assert table.schema.field('adate').type == pa.date32()
+        assert table.schema.field('acollection').type == \
+            pa.list_(pa.string())
+        assert table.schema.field('uncoded').type == pa.int64()
+        assert table.to_pydict() == {
+            'anumeric': [420],
+            'adecimal': [4.2],
+            'astring': [u'¿Qué pasa?'],
+            'adate': [date(2020, 1, 31)],
+            'acollection': [[u'1', u'2']],
+            'uncoded': [1],
+        }
+
+
+class TestOpenMember:
+
+    @pytest.mark.parametrize('compression', ['deflate', 'store'])
+    def test_streams_rows(self, dbsession, compression):
+        """
+        It should write query results directly into an archive entry
+        """
+        import io
+        import zipfile
+        from sqlalchemy import func
+        from occams import exports
+
+        series = func.generate_series(1, 3).label('num')
+        query = dbsession.query(series)
+
+        buffer = io.BytesIO()
+        with exports.open_archive(buffer, compression=compression) as zfp:
+            with exports.open_member(zfp, 'num.csv') as fp:
+                exports.write_data(fp, query)
+
+        with zipfile.ZipFile(buffer) as zfp:
+            info = zfp.getinfo('num.csv')
+            assert info.compress_type == exports.COMPRESSION[compression]
+            assert zfp.read('num.csv').decode('utf-8').split() == \
+                ['num', '1', '2', '3']
+
 
 class TestDumpCodeBook:
 
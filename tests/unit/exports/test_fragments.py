@@ -0,0 +1,147 @@
+class TestFragments:
+
+    def _create_schema(self, dbsession, publish_date):
+        from occams import models
+
+        schema = models.Schema(
+            name=u'vitals',
+            title=u'Vitals',
+            publish_date=publish_date,
+            attributes={
+                'weight': models.Attribute(
+                    name=u'weight',
+                    title=u'Weight',
+                    type=u'number',
+                    decimal_places=1,
+                    order=0),
+                'color': models.Attribute(
+                    name=u'color',
+                    title=u'Color',
+                    type=u'choice',
+                    order=1,
+                    choices={
+                        '001': models.Choice(
+                            name=u'001', title=u'Red', order=0),
+                        '002': models.Choice(
+                            name=u'002', title=u'Blue', order=1)})})
+        dbsession.add(schema)
+        dbsession.flush()
+        return schema
+
+    def test_refresh(self, dbsession):
+        """
+        It should store fragments of published versions until they change
+        """
+        from datetime import date
+        from occams import models
+        from occams.exports import fragments
+
+        schema = self._create_schema(dbsession, date(2015, 1, 1))
+        draft = self._create_schema(dbsession, None)
+
+        assert fragments.refresh(dbsession) == [schema.id]
+        assert fragments.refresh(dbsession) == []
+
+        fragment = dbsession.query(models.CodebookFragment).one()
+        assert fragment.schema_id == schema.id
+        assert [r['field'] for r in fragment.rows] == ['color', 'weight']
+        assert fragment.rows[0]['publish_date'] == '2015-01-01'
+        assert fragment.rows[0]['choices'] == [['001', 'Red'], ['002', 'Blue']]
+
+        schema.attributes['weight'].title = u'Body weight'
+        dbsession.flush()
+
+        assert fragments.refresh(dbsession, ids=[schema.id, draft.id]) \
+            == [schema.id]
+        dbsession.refresh(fragment)
+        assert fragment.rows[1]['title'] == u'Body weight'
+
+    def test_load(self, dbsession):
+        """
+        It should load stored fragments and generate missing ones
+        """
+        from datetime import date
+        from occams.exports import fragments
+
+        schema = self._create_schema(dbsession, date(2015, 1, 1))
+
+        generated = fragments.load(dbsession)
+        fragments.refresh(dbsession)
+        stored = fragments.load(dbsession, names=[u'vitals'])
+
+        assert generated == stored
+        rows = stored[(u'vitals', schema.publish_date)]
+        assert rows[0]['publish_date'] == date(2015, 1, 1)
+        assert rows[0]['choices'] == [('001', 'Red'), ('002', 'Blue')]
+
+    def test_codebook(self, dbsession):
+        """
+        It should assemble form codebooks from preloaded fragments
+        """
+        from datetime import date
+        from occams import exports
+        self._create_schema(dbsession, date(2015, 1, 1))
+        plans = exports.list_all(dbsession)
+
+        rows = list(exports.iter_codebook(dbsession, plans.values()))
+
+        assert rows == [r for p in plans.values() for r in p.codebook()]
+        fields = [r['field'] for r in rows if r['table'] == u'vitals']
+        assert fields.index('color') + 1 == fields.index('weight')
+
+    def test_codebook_queries(self, dbsession):
+        """
+        It should generate the codebook in a constant number of queries
+        """
+        from datetime import date
+        from sqlalchemy import event
+        from occams import models, exports
+
+        def make_forms(start, stop):
+            dbsession.add_all([
+                models.Schema(
+                    name=u'form{}'.format(i),
+                    title=u'Form {}'.format(i),
+                    publish_date=date(2015, 1, 1),
+                    attributes={
+                        'color': models.Attribute(
+                            name=u'color',
+                            title=u'Color',
+                            type=u'choice',
+                            order=0,
+                            choices={
+                                '001': models.Choice(
+                                    name=u'001', title=u'Red', order=0)})})
+                for i in range(start, stop)])
+            dbsession.flush()
+
+        def count_queries():
+            statements = []
+
+            def before_cursor_execute(*args):
+                statements.append(args[2])
+
+            connection = dbsession.connection()
+            event.listen(
+                connection, 'before_cursor_execute', before_cursor_execute)
+            try:
+                plans = exports.list_all(dbsession).values()
+                rows = list(exports.iter_codebook(dbsession, plans))
+            finally:
+                event.remove(
+                    connection, 'before_cursor_execute', before_cursor_execute)
+            return len(statements), rows
+
+        make_forms(0, 1)
+        few, _ = count_queries()
+
+        make_forms(1, 500)
+        many, rows = count_queries()
+
+        assert few == many
+        assert len([r for r in rows if r['field'] == 'color']) == 500
+
+        # Stored fragments do not need to be generated
+        exports.fragments.refresh(dbsession)
+        stored, _ = count_queries()
+        assert stored < many
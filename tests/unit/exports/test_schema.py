@@ -31,6 +31,36 @@ class TestSchemaPlan:
         plans = SchemaPlan.list_all(dbsession, include_private=False)
         assert len(plans) == 0
 
+    def test_list_catalog_cached(self, dbsession):
+        """
+        It should cache the catalog until forms are published or retracted
+        """
+        from datetime import date
+        from occams import models
+        from occams.exports.schema import SchemaPlan
+
+        def make_schema(name):
+            schema = models.Schema(
+                name=name,
+                title=name.title(),
+                publish_date=date(2015, 1, 1))
+            dbsession.add(schema)
+            dbsession.flush()
+            return schema
+
+        contact = make_schema(u'contact')
+        assert [p.name for p in SchemaPlan.list_all(dbsession)] == \
+            [u'contact']
+
+        make_schema(u'vitals')
+        assert [p.name for p in SchemaPlan.list_all(dbsession)] == \
+            [u'contact', u'vitals']
+
+        contact.retract_date = date(2016, 1, 1)
+        dbsession.flush()
+        assert [p.name for p in SchemaPlan.list_all(dbsession)] == \
+            [u'vitals']
+
     def test_list_not_include_rand(self, dbsession):
         """
         It should not include randomization data if specified.
@@ -314,3 +344,52 @@ class TestSchemaPlan:
         assert record.block_number == stratum.block_number
         assert record.arm_name == stratum.arm.title
         assert record.randid == stratum.randid
+
+    def test_multiple_enrollments(self, dbsession):
+        """
+        It should aggregate multiple enrollments without duplicating rows
+        """
+        from datetime import date, timedelta
+        from occams import models
+        from occams.exports.schema import SchemaPlan
+
+        schema = models.Schema(
+            name=u'termination',
+            title=u'Termination',
+            publish_date=date.today(),
+            attributes={
+                'foo': models.Attribute(
+                    name='foo',
+                    title=u'',
+                    type='string',
+                    order=0,
+                )})
+        entity = models.Entity(
+            schema=schema,
+            collect_date=date.today())
+        patient = models.Patient(
+            site=models.Site(name='ucsd', title=u'UCSD'),
+            pid=u'12345',
+            entities=[entity])
+        enrollments = [
+            models.Enrollment(
+                patient=patient,
+                study=models.Study(
+                    name=name,
+                    short_title=name.upper(),
+                    code=code,
+                    consent_date=date.today() - timedelta(365),
+                    title=name.title()),
+                consent_date=date.today() - timedelta(5),
+                latest_consent_date=date.today() - timedelta(3),
+                entities=[entity])
+            for name, code in [(u'cooties', u'998'), (u'flu', u'999')]]
+        dbsession.add_all([schema, entity, patient] + enrollments)
+        dbsession.flush()
+
+        plan = SchemaPlan.from_schema(dbsession, schema.name)
+        record = plan.data().one()
+        assert record.pid == patient.pid
+        assert sorted(record.enrollment.split(';')) == [u'cooties', u'flu']
+        assert sorted(record.enrollment_ids.split(';')) == \
+            sorted(str(e.id) for e in enrollments)
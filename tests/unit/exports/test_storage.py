@@ -0,0 +1,174 @@
+import pytest
+
+
+class FakeS3Client:
+    """
+    Records multipart uploads in memory, in place of an object store
+    """
+
+    def __init__(self):
+        self.uploads = {}
+        self.objects = {}
+
+    def create_multipart_upload(self, Bucket, Key):
+        upload_id = str(len(self.uploads))
+        self.uploads[upload_id] = []
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.uploads[UploadId].append(Body)
+        return {'ETag': 'etag-%d' % PartNumber}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId,
+                                  MultipartUpload):
+        assert len(MultipartUpload['Parts']) == len(self.uploads[UploadId])
+        self.objects[(Bucket, Key)] = b''.join(self.uploads.pop(UploadId))
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        del self.uploads[UploadId]
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+
+class TestLocalStorage:
+
+    def test_open(self, tmpdir):
+        """
+        It should only make archives visible once completely written
+        """
+        from occams.exports.storage import LocalStorage
+
+        storage = LocalStorage(str(tmpdir))
+
+        with storage.open('foo') as fp:
+            fp.write(b'data')
+            assert storage.size('foo') is None
+
+        assert storage.size('foo') == 4
+
+        with pytest.raises(RuntimeError):
+            with storage.open('bar') as fp:
+                fp.write(b'data')
+                raise RuntimeError
+
+        assert storage.size('bar') is None
+        assert tmpdir.listdir() == [tmpdir.join('foo')]
+
+    def test_delete(self, tmpdir):
+        """
+        It should remove archives and ignore missing ones
+        """
+        from occams.exports.storage import LocalStorage
+
+        storage = LocalStorage(str(tmpdir))
+
+        with storage.open('foo') as fp:
+            fp.write(b'data')
+
+        storage.delete('foo')
+        storage.delete('foo')
+
+        assert storage.size('foo') is None
+        assert tmpdir.listdir() == []
+
+    def test_accel_redirect(self, tmpdir, req):
+        """
+        It should delegate downloads to nginx if configured
+        """
+        from occams.exports.storage import LocalStorage
+
+        storage = LocalStorage(str(tmpdir), accel_redirect='/protected/')
+        response = storage.make_response(req, 'foo', 'export.zip')
+
+        assert response.headers['X-Accel-Redirect'] == '/protected/foo'
+        assert response.content_disposition == \
+            'attachment;filename=export.zip'
+
+
+class TestS3Storage:
+
+    def test_open(self):
+        """
+        It should upload archives in parts of the configured size
+        """
+        from occams.exports.storage import S3Storage, MIN_PART_SIZE
+
+        client = FakeS3Client()
+        storage = S3Storage(client, 'exports', prefix='archives/')
+
+        data = b'x' * (MIN_PART_SIZE * 2 + 10)
+        with storage.open('foo') as fp:
+            for offset in range(0, len(data), 1000000):
+                fp.write(data[offset:offset + 1000000])
+
+        assert client.objects[('exports', 'archives/foo')] == data
+
+    def test_open_abort(self):
+        """
+        It should abort uploads if writing fails
+        """
+        from occams.exports.storage import S3Storage
+
+        client = FakeS3Client()
+        storage = S3Storage(client, 'exports')
+
+        with pytest.raises(RuntimeError):
+            with storage.open('foo') as fp:
+                fp.write(b'data')
+                raise RuntimeError
+
+        assert client.uploads == {}
+        assert client.objects == {}
+
+    def test_delete(self):
+        """
+        It should remove archives from the bucket
+        """
+        from occams.exports.storage import S3Storage
+
+        client = FakeS3Client()
+        storage = S3Storage(client, 'exports', prefix='archives/')
+
+        with storage.open('foo') as fp:
+            fp.write(b'data')
+
+        storage.delete('foo')
+
+        assert client.objects == {}
+
+    def test_part_size(self):
+        """
+        It should refuse parts smaller than S3 allows
+        """
+        from occams.exports.storage import S3Storage
+
+        with pytest.raises(ValueError):
+            S3Storage(FakeS3Client(), 'exports', part_size=1024)
+
+
+class TestGetStorage:
+
+    def test_shared(self, tmpdir):
+        """
+        It should reuse the backend of identical settings
+        """
+        from occams.exports.storage import get_storage, LocalStorage
+
+        settings = {'studies.export.dir': str(tmpdir)}
+        storage = get_storage(settings)
+
+        assert isinstance(storage, LocalStorage)
+        assert get_storage(dict(settings)) is storage
+        assert 'studies.export.storage.instance' not in settings
+
+    def test_missing_settings(self):
+        """
+        It should fail clearly if the export directory is not configured
+        """
+        from occams.exports.storage import get_storage
+
+        with pytest.raises(ValueError) as excinfo:
+            get_storage({})
+
+        assert 'studies.export.dir' in str(excinfo.value)
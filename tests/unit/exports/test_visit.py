@@ -21,3 +21,45 @@ class TestVisitPlan:
         data_columns = [c['name'] for c in query.column_descriptions]
 
         assert sorted(codebook_columns) == sorted(data_columns)
+
+    def test_since(self, dbsession, factories):
+        """
+        It should only include visits modified after the specified timestamp
+        """
+        from datetime import timedelta
+        plan = self._create_one(dbsession)
+
+        cycle = factories.CycleFactory.create()
+        visit = factories.VisitFactory.create(cycles=[cycle])
+        dbsession.flush()
+        # The database sets the final modification time
+        dbsession.refresh(visit)
+
+        before = visit.modify_date - timedelta(seconds=1)
+        assert [r.id for r in plan.data(since=before)] == [visit.id]
+        assert plan.data(since=visit.modify_date).count() == 0
+
+    def test_iterchunks(self, dbsession, factories):
+        """
+        It should page through visits without splitting a visit's cycles
+        """
+        plan = self._create_one(dbsession)
+
+        study = factories.StudyFactory.create()
+        cycles = factories.CycleFactory.create_batch(3, study=study)
+        visits = [
+            factories.VisitFactory.create(cycles=cycles[:2]),
+            factories.VisitFactory.create(cycles=cycles),
+            factories.VisitFactory.create(cycles=cycles[:1]),
+        ]
+        dbsession.flush()
+
+        chunks = [[r.id for r in rows] for rows in plan.iterchunks(2)]
+
+        assert chunks == [
+            [visits[0].id] * 2,
+            [visits[1].id] * 3,
+            [visits[2].id],
+        ]
+        assert [r.id for r in plan.data()] == sum(chunks, [])
+        assert list(plan.iterchunks(2, after=visits[2].id)) == []
@@ -486,3 +486,41 @@ def test_choice_constraint(dbsession):
 
     with pytest.raises(ConstraintError):
         entity['test'] = '999'
+
+
+def test_validator_cached(dbsession):
+    """
+    It should compile a schema's validator once until its attributes change
+    """
+    from datetime import date
+    from occams import models
+    from occams.exc import ConstraintError
+
+    schema = models.Schema(name='Foo', title='',
+                           publish_date=date(2000, 1, 1))
+    # The name must be set first, it keys the attribute in its schema
+    s1 = models.Attribute(
+        name='s1', schema=schema, title='Section 1', type='section', order=0)
+    attribute = models.Attribute(
+        name='test', schema=schema, parent_attribute=s1,
+        title='', type='number', value_max=10, order=0)
+    dbsession.add(schema)
+    dbsession.flush()
+
+    validator = schema.validator
+    assert schema.validator is validator
+    assert validator['test']('5') == '5'
+
+    with pytest.raises(ConstraintError):
+        validator['test']('11')
+
+    attribute.value_max = 20
+    assert schema.validator is not validator
+    assert schema.validator['test']('11') == '11'
+
+    entity = models.Entity(schema=schema)
+    entity['test'] = '11'
+    assert entity['test'] == '11'
+
+    with pytest.raises(KeyError):
+        entity['unknown'] = 1
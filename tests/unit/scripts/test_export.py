@@ -187,6 +187,33 @@ class TestPrintList:
                 [None, '--config', 'fake.ini', '--dir', self.dir, plan.name])
             assert plan.file_name in os.listdir(self.dir)
 
+    def test_make_export_incremental(self, plan):
+        """
+        It should only export changes since the previous incremental export
+        """
+        import os
+        import mock
+        from occams.scripts.export import WATERMARK_FILE, DELETED_SUFFIX
+        args = [None, '--config', 'fake.ini', '--dir', self.dir,
+                '--all', '--incremental']
+        # force list_all to return only the test form
+        with mock.patch('occams.exports.list_all',
+                        return_value={plan.name: plan}):
+            # The first export has no previous watermark
+            with mock.patch.object(plan, 'data', wraps=plan.data) as data:
+                self._call_fut(args)
+            assert data.call_args[1]['since'] is None
+            assert WATERMARK_FILE in os.listdir(self.dir)
+            assert plan.name + DELETED_SUFFIX not in os.listdir(self.dir)
+
+            deleted = plan.dbsession.query(
+                plan.data().subquery().c.dummy.label('id'))
+            with mock.patch.object(plan, 'data', wraps=plan.data) as data, \
+                    mock.patch.object(plan, 'deleted', return_value=deleted):
+                self._call_fut(args)
+            assert data.call_args[1]['since'] is not None
+            assert plan.name + DELETED_SUFFIX in os.listdir(self.dir)
+
     def test_make_export_nothing_specified(self, plan):
         """
         It should quit with an error message if no option is specified
@@ -0,0 +1,75 @@
+"""
+Tests the form metadata cache
+"""
+
+
+class TestMetadataCache:
+
+    def test_lru(self):
+        """
+        It should evict the least recently used entries
+        """
+        from occams.utils.cache import MetadataCache
+        cache = MetadataCache(size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        assert cache.get('a') == 1
+        assert cache.get('b') is None
+        assert cache.get('c') == 3
+
+    def test_copies(self):
+        """
+        It should return a fresh copy of the cached value on every lookup
+        """
+        from datetime import date
+        from occams.utils.cache import MetadataCache
+        cache = MetadataCache()
+        value = cache.get_or_create('a', lambda: {'d': date(2020, 1, 1)})
+        value['d'] = None
+        assert cache.get('a') == {'d': '2020-01-01'}
+
+    def test_redis(self):
+        """
+        It should share entries with other processes through redis
+        """
+        import mock
+        from occams.utils.cache import MetadataCache
+        redis = mock.Mock()
+        redis.get.return_value = b'{"x": 1}'
+        cache = MetadataCache(redis=redis, prefix='p:')
+        assert cache.get('a') == {'x': 1}
+        redis.get.assert_called_once_with('p:a')
+        # now cached in process
+        assert cache.get('a') == {'x': 1}
+        assert redis.get.call_count == 1
+
+        cache.set('b', [1])
+        redis.set.assert_called_once_with('p:b', '[1]', ex=None)
+
+
+class TestLocalCache:
+
+    def test_lru(self):
+        """
+        It should keep the same objects and evict the least recently used
+        """
+        from occams.utils.cache import LocalCache
+        cache = LocalCache(size=2)
+        value = object()
+        cache.set('a', value)
+        cache.set('b', object())
+        assert cache.get('a') is value
+        cache.set('c', object())
+        assert cache.get('b') is None
+        assert cache.get('a') is value
+
+    def test_disabled(self):
+        """
+        It should not store anything if the size is zero
+        """
+        from occams.utils.cache import LocalCache
+        cache = LocalCache(size=0)
+        cache.set('a', object())
+        assert cache.get('a') is None
@@ -0,0 +1,157 @@
+"""
+Tests the bulk importer of form data files
+"""
+
+import pytest
+
+
+@pytest.fixture
+def schema(dbsession):
+    from datetime import date
+    from occams import models
+
+    schema = models.Schema(
+        name=u'vitals',
+        title=u'Vitals',
+        publish_date=date(2020, 1, 1),
+        attributes={
+            'weight': models.Attribute(
+                name='weight', title=u'Weight', type='number',
+                is_required=True, value_min=0, order=0),
+            'symptoms': models.Attribute(
+                name='symptoms', title=u'Symptoms', type='choice',
+                is_collection=True, order=1,
+                choices={
+                    '001': models.Choice(name='001', title=u'Cough', order=0),
+                    '002': models.Choice(name='002', title=u'Fever', order=1),
+                }),
+        })
+
+    site = models.Site(name=u'somewhere', title=u'Somewhere')
+    patient = models.Patient(pid=u'P1', site=site)
+    visit = models.Visit(patient=patient, visit_date=date(2020, 2, 1))
+
+    dbsession.add_all([schema, patient, visit])
+    dbsession.flush()
+    return schema
+
+
+def _write_csv(tmpdir, rows):
+    import csv
+    path = str(tmpdir.join('vitals.csv'))
+    with open(path, 'w', newline='') as fp:
+        csv.writer(fp).writerows(rows)
+    return path
+
+
+class TestImportFile:
+
+    def test_import(self, dbsession, tmpdir, schema):
+        """
+        It should load valid rows and link them to patients and visits
+        """
+        from occams import models
+        from occams.importer import import_file
+
+        path = _write_csv(tmpdir, [
+            ['pid', 'visit_date', 'collect_date', 'not_done', 'weight',
+             'symptoms'],
+            ['P1', '2020-02-01', '2020-02-01', '0', '70.5', '001;002'],
+            ['P1', '', '2020-02-03', '1', '', ''],
+        ])
+
+        result = import_file(
+            dbsession, path, 'vitals', '2020-01-01', chunk_size=1)
+
+        assert result.to_json() == {'rows': 2, 'imported': 2, 'rejected': 0}
+
+        entities = (
+            dbsession.query(models.Entity)
+            .order_by(models.Entity.collect_date)
+            .all())
+        assert entities[0].data == {'weight': '70.5', 'symptoms': ['001', '002']}
+        assert entities[0].state.name == 'pending-review'
+        assert entities[1].not_done
+        assert entities[1].data == {}
+
+        contexts = sorted(
+            (c.entity_id, c.external)
+            for c in dbsession.query(models.Context))
+        assert contexts == [
+            (entities[0].id, 'patient'),
+            (entities[0].id, 'visit'),
+            (entities[1].id, 'patient'),
+        ]
+
+    def test_rejected(self, dbsession, tmpdir, schema):
+        """
+        It should skip and report invalid rows
+        """
+        from io import StringIO
+        from occams import models
+        from occams.importer import import_file, write_rejected
+
+        path = _write_csv(tmpdir, [
+            ['pid', 'collect_date', 'weight', 'symptoms'],
+            ['P1', '2020-02-01', '-1', '001'],
+            ['P2', '2020-02-01', '1', '003'],
+            ['P1', 'yesterday', '', ''],
+            ['P1', '2020-02-01', '2', '002'],
+        ])
+
+        result = import_file(dbsession, path, 'vitals', '2020-01-01')
+
+        assert result.to_json() == {'rows': 4, 'imported': 1, 'rejected': 3}
+        assert [(line, sorted(errors)) for line, errors in result.rejected] \
+            == [(1, ['weight']),
+                (2, ['pid', 'symptoms']),
+                (3, ['collect_date', 'weight'])]
+        assert dbsession.query(models.Entity).count() == 1
+
+        buffer = StringIO()
+        write_rejected(buffer, result)
+        assert len(buffer.getvalue().splitlines()) == 6
+
+    def test_unknown_column(self, dbsession, tmpdir, schema):
+        """
+        It should refuse files with columns that are not part of the form
+        """
+        from occams.exc import ImportFileError
+        from occams.importer import import_file
+
+        path = _write_csv(tmpdir, [
+            ['pid', 'collect_date', 'height'],
+            ['P1', '2020-02-01', '180'],
+        ])
+
+        with pytest.raises(ImportFileError):
+            import_file(dbsession, path, 'vitals', '2020-01-01')
+
+    def test_cached_rules(self, dbsession, tmpdir, schema):
+        """
+        It should compile validators from cached rules, ignoring limits of
+        types that cannot be limited
+        """
+        from occams import models
+        from occams.importer import import_file
+        from occams.utils.cache import validator_cache
+
+        schema.attributes['smoker'] = models.Attribute(
+            name='smoker', title=u'Smoker', type='choice', value_min=1,
+            order=2,
+            choices={'0': models.Choice(name='0', title=u'No', order=0)})
+        dbsession.flush()
+
+        path = _write_csv(tmpdir, [
+            ['pid', 'collect_date', 'weight', 'smoker'],
+            ['P1', '2020-02-01', '70', '0'],
+        ])
+
+        for _ in range(2):
+            result = import_file(dbsession, path, 'vitals', '2020-01-01')
+            assert result.to_json() == \
+                {'rows': 1, 'imported': 1, 'rejected': 0}
+            # The next import compiles the rules found in the metadata cache
+            validator_cache.clear()
+
+        assert dbsession.query(models.Entity).count() == 2
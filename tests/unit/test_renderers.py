@@ -254,6 +254,45 @@ class TestMakeForm:
         assert not form.validate()
         assert 'dummy_field' in form.errors
 
+    def test_cached(self, dbsession):
+        """
+        It should reuse the generated class until the form is edited
+        """
+        from occams import models
+        from occams.renderers import make_form
+
+        schema = self._make_schema(dbsession)
+        Form1 = make_form(dbsession, schema)
+        Form2 = make_form(dbsession, schema)
+        assert Form1 is not Form2
+        assert Form1.__bases__ == Form2.__bases__
+
+        # Classes are unique to each call, so callers may modify them
+        Form1.extra = wtforms.HiddenField()
+        assert not hasattr(Form2, 'extra')
+
+        schema.attributes['other_field'] = models.Attribute(
+            name='other_field', title='Other Field', type='string', order=1)
+        dbsession.flush()
+
+        Form3 = make_form(dbsession, schema)
+        assert Form3.__bases__ != Form1.__bases__
+        assert hasattr(Form3, 'other_field')
+
+    def test_not_cached_draft(self, dbsession):
+        """
+        It should not cache the classes of unpublished forms
+        """
+        from occams.renderers import make_form
+
+        schema = self._make_schema(dbsession)
+        schema.publish_date = None
+        dbsession.flush()
+
+        Form1 = make_form(dbsession, schema, show_metadata=False)
+        Form2 = make_form(dbsession, schema, show_metadata=False)
+        assert Form1.__bases__ != Form2.__bases__
+
 
 class TestRenderForm:
 
@@ -329,6 +368,32 @@ class TestRenderForm:
 
         assert field.has_attr('disabled')
 
+    def test_skeleton(self, dbsession):
+        """
+        It should reuse the field markup while filling in values and errors
+        """
+        from webob.multidict import MultiDict
+        from occams.renderers import render_form
+        from bs4 import BeautifulSoup
+
+        Form = self._make_form(dbsession)
+        form = Form(MultiDict({'dummy_field': 'first'}))
+        first = render_form(form)
+        assert len(Form._skeletons) == 1
+
+        form = Form(MultiDict({'dummy_field': 'second'}))
+        form.dummy_field.errors = ['Bad <value>']
+        soup = BeautifulSoup(render_form(form, disabled=True))
+        assert len(Form._skeletons) == 1
+
+        field = soup.find(id='dummy_field')
+        assert field['value'] == 'second'
+        assert field.has_attr('disabled')
+        wrapper = field.find_parent(class_='ds-attribute')
+        assert 'has-error' in wrapper['class']
+        assert 'Bad <value>' in wrapper.find(class_='errors').text
+        assert 'first' in first
+
 
 class TestApplyData:
 
@@ -0,0 +1,112 @@
+"""
+Tests the materialized report tables
+"""
+
+import pytest
+
+
+@pytest.fixture
+def schema(dbsession):
+    from datetime import date
+    from occams import models
+
+    schema = models.Schema(
+        name='A',
+        title='A',
+        publish_date=date.today(),
+        attributes={
+            'a': models.Attribute(
+                name='a', title='', type='string', order=0),
+            'b': models.Attribute(
+                name='b', title='', type='number', order=1,
+                is_private=True)})
+    dbsession.add(schema)
+    dbsession.flush()
+    return schema
+
+
+def _rows(dbsession, report):
+    return sorted(tuple(r) for r in dbsession.query(report))
+
+
+def test_refresh_creates_table(dbsession, schema):
+    """
+    It should materialize the report of a published schema
+    """
+    from occams import models, report_tables
+
+    entity = models.Entity(schema=schema)
+    entity['a'] = u'foo'
+    entity['b'] = 5
+    dbsession.add(entity)
+    dbsession.flush()
+
+    record = report_tables.refresh(dbsession, 'A')
+
+    assert record.table_name == report_tables.get_table_name('A')
+    result = dbsession.execute(
+        'SELECT id, a, b FROM reports."{}"'.format(record.table_name))
+    result = result.fetchall()
+    assert [tuple(r) for r in result] == [(entity.id, u'foo', 5)]
+
+
+def test_get_report_not_materialized(dbsession, schema):
+    """
+    It should defer to build_report when no table has been generated
+    """
+    from occams import report_tables
+    assert report_tables.get_report(dbsession, 'A') is None
+
+
+def test_get_report_matches_build_report(dbsession, schema):
+    """
+    It should include changes made since the last refresh
+    """
+    from occams import models, report_tables, reporting
+
+    entity1 = models.Entity(schema=schema)
+    entity1['a'] = u'foo'
+    dbsession.add(entity1)
+    dbsession.flush()
+
+    report_tables.refresh(dbsession, 'A')
+
+    entity2 = models.Entity(schema=schema)
+    entity2['a'] = u'bar'
+    entity2['b'] = 3
+    dbsession.add(entity2)
+    dbsession.flush()
+
+    expected = _rows(dbsession, reporting.build_report(dbsession, 'A'))
+    assert _rows(dbsession, report_tables.get_report(dbsession, 'A')) \
+        == expected
+
+    report_tables.refresh(dbsession, 'A')
+    assert _rows(dbsession, report_tables.get_report(dbsession, 'A')) \
+        == expected
+
+
+def test_get_report_stale_versions(dbsession, schema):
+    """
+    It should not use a table built from different published versions
+    """
+    from datetime import date, timedelta
+    from occams import report_tables
+
+    report_tables.refresh(dbsession, 'A')
+    assert report_tables.get_report(dbsession, 'A') is not None
+
+    schema.retract_date = date.today() + timedelta(1)
+    dbsession.flush()
+    assert report_tables.get_report(dbsession, 'A') is None
+
+
+def test_table_names():
+    """
+    It should generate distinct, valid identifiers for all schema names
+    """
+    from occams.report_tables import get_table_name
+
+    assert get_table_name('A') != get_table_name('a')
+    assert len(get_table_name('x' * 100).encode('utf-8')) <= 63
+    assert get_table_name('x' * 100) != get_table_name('x' * 101)
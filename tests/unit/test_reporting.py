@@ -198,6 +198,55 @@ def test_datadict_duplicate_vocabulary_term(dbsession):
     assert 'New Bar' == columns['a'].choices['002']
 
 
+def test_datadict_cached(dbsession, metadata_cache):
+    """
+    It should reuse column plans until the published versions change
+    """
+
+    from datetime import date, timedelta
+    import mock
+    from occams import models, reporting
+
+    schema = models.Schema(
+        name='A',
+        title='A',
+        publish_date=date.today(),
+        attributes={
+            's1': models.Attribute(
+                name='s1',
+                title='S1',
+                type='section',
+                order=0,
+                attributes={
+                    'a': models.Attribute(
+                        name='a',
+                        title='',
+                        type='string',
+                        order=0)})})
+
+    dbsession.add(schema)
+    dbsession.flush()
+
+    columns = reporting.build_columns(dbsession, 'A')
+
+    with mock.patch('occams.reporting._query_columns') as query_columns:
+        cached = reporting.build_columns(dbsession, 'A')
+        assert not query_columns.called
+
+    assert [c.to_json() for c in columns.values()] == \
+        [c.to_json() for c in cached.values()]
+
+    schema.attributes['s1'].attributes['a'].type = 'text'
+    dbsession.flush()
+    columns = reporting.build_columns(dbsession, 'A')
+    assert columns['a'].type == 'text'
+
+    schema.retract_date = date.today() + timedelta(1)
+    dbsession.flush()
+    columns = reporting.build_columns(dbsession, 'A')
+    assert 'a' not in columns
+
+
 @pytest.mark.parametrize('db_type,sa_type', [
     ('choice', sa.String),
     ('string', sa.Unicode),
@@ -512,6 +561,52 @@ def test_build_report_choice_types_multiple_choice_expanded_labels(dbsession, en
     assert result.a_003 == 'Blue'
 
 
+def test_build_report_choice_labels_by_version(dbsession):
+    """
+    It should use the labels of the version each entity was collected with
+    without looking them up for every row
+    """
+    from copy import deepcopy
+    from datetime import date, timedelta
+    from occams import models, reporting
+
+    today = date.today()
+
+    schema1 = models.Schema(
+        name='A',
+        title='A',
+        publish_date=today,
+        attributes={
+            'a': models.Attribute(
+                name='a',
+                title='',
+                type='choice',
+                order=0,
+                choices={
+                    '001': models.Choice(name='001', title='Green', order=0),
+                    '002': models.Choice(name='002', title='Red', order=1)
+                })})
+
+    schema2 = deepcopy(schema1)
+    schema2.publish_date = today + timedelta(1)
+    schema2.attributes['a'].choices['002'].title = 'Crimson'
+
+    dbsession.add_all([schema1, schema2])
+    dbsession.flush()
+
+    entity1 = models.Entity(schema=schema1)
+    entity1['a'] = '002'
+    entity2 = models.Entity(schema=schema2)
+    entity2['a'] = '002'
+    dbsession.add_all([entity1, entity2])
+    dbsession.flush()
+
+    report = reporting.build_report(dbsession, 'A', use_choice_labels=True)
+    query = dbsession.query(report.c.id, report.c.a).order_by(report.c.id)
+    assert 'choice' not in str(query.statement)
+    assert query.all() == [(entity1.id, 'Red'), (entity2.id, 'Crimson')]
+
+
 def test_build_report_expand_none_selected(dbsession):
     """
     It should leave all choices blank (not zero) on if no option was selected
@@ -253,3 +253,138 @@ class Test_add_json:
 
         assert 'is not part of the studies' in \
             excinfo.value.json['errors']['schema']
+
+
+class Test_bulk_json:
+
+    def _call_fut(self, *args, **kw):
+        from occams.views.entry import bulk_json as view
+        return view(*args, **kw)
+
+    @pytest.fixture
+    def visit(self, dbsession):
+        from datetime import date
+        from occams import models
+
+        schema = models.Schema(
+            name=u'schema',
+            title=u'Schema',
+            publish_date=date(2020, 1, 1),
+            attributes={
+                'weight': models.Attribute(
+                    name='weight', title=u'Weight', type='number',
+                    is_required=True, value_min=0, order=0),
+                'color': models.Attribute(
+                    name='color', title=u'Color', type='choice', order=1,
+                    choices={
+                        '001': models.Choice(
+                            name='001', title=u'Red', order=0),
+                        '002': models.Choice(
+                            name='002', title=u'Blue', order=1)}),
+            })
+
+        study = models.Study(
+            name='some-study',
+            title=u'Some Study',
+            short_title=u'sstudy',
+            code=u'000',
+            consent_date=date.today(),
+            schemata=set([schema]))
+
+        cycle = models.Cycle(study=study, name=u'cycle-1', title=u'Cycle')
+
+        site = models.Site(name=u'somewhere', title=u'Somewhere')
+        patient = models.Patient(pid=u'12345', site=site)
+
+        visit = models.Visit(
+            patient=patient, visit_date=date.today(), cycles=[cycle])
+
+        dbsession.add_all([study, patient, visit])
+        dbsession.flush()
+        return visit
+
+    def _make_factory(self, req, visit):
+        from occams import models
+        req.method = 'POST'
+        req.matchdict = {'patient': visit.patient, 'visit': visit}
+        factory = models.FormFactory(req)
+        factory.__parent__ = visit
+        return factory
+
+    def test_add(self, req, dbsession, visit):
+        """
+        It should add all forms to the visit and patient
+        """
+        from occams import models
+
+        req.json_body = {'entities': [
+            {'schema': 'schema', 'publish_date': '2020-01-01',
+             'collect_date': '2020-02-01',
+             'data': {'weight': 10.5, 'color': '002'}},
+            {'schema': 'schema', 'publish_date': '2020-01-01',
+             'collect_date': '2020-03-01', 'not_done': True},
+        ]}
+        res = self._call_fut(self._make_factory(req, visit), req)
+
+        assert len(res['ids']) == 2
+        first, second = [
+            dbsession.query(models.Entity).get(id) for id in res['ids']]
+        assert first.data == {'weight': '10.5', 'color': '002'}
+        assert first.state.name == 'pending-review'
+        assert second.not_done
+        assert dbsession.query(models.Context).count() == 4
+
+    def test_update(self, req, dbsession, visit):
+        """
+        It should replace the data of existing forms of the visit
+        """
+        from datetime import date
+        from occams import models
+
+        entity = models.Entity(
+            schema=dbsession.query(models.Schema).one(),
+            collect_date=date(2020, 2, 1),
+            data={'weight': '1'})
+        visit.entities.add(entity)
+        dbsession.flush()
+
+        req.json_body = {'entities': [
+            {'id': entity.id, 'schema': 'schema',
+             'publish_date': '2020-01-01', 'collect_date': '2020-02-02',
+             'data': {'weight': 2}},
+        ]}
+        res = self._call_fut(self._make_factory(req, visit), req)
+
+        assert res['ids'] == [entity.id]
+        assert entity.data == {'weight': '2'}
+        assert entity.collect_date == date(2020, 2, 2)
+
+    def test_invalid(self, req, dbsession, visit):
+        """
+        It should report all errors and not save anything
+        """
+        from pyramid.httpexceptions import HTTPBadRequest
+        from occams import models
+
+        req.json_body = {'entities': [
+            {'schema': 'schema', 'publish_date': '2020-01-01',
+             'collect_date': '2020-02-01',
+             'data': {'weight': -1, 'color': '003', 'other': 1}},
+            {'schema': 'schema', 'publish_date': '2020-01-01',
+             'collect_date': '2020-02-01', 'data': {}},
+            {'schema': 'unknown', 'publish_date': '2020-01-01',
+             'collect_date': '2020-02-01'},
+        ]}
+
+        with pytest.raises(HTTPBadRequest) as excinfo:
+            self._call_fut(self._make_factory(req, visit), req)
+
+        errors = excinfo.value.json['errors']
+        assert sorted(errors) == [
+            'entities-0-data-color',
+            'entities-0-data-other',
+            'entities-0-data-weight',
+            'entities-1-data-weight',
+            'entities-2-schema',
+        ]
+        assert dbsession.query(models.Entity).count() == 0
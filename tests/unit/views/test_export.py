@@ -103,6 +103,98 @@ class TestAdd:
         assert res.location == req.route_path('studies.exports_status')
         export = dbsession.query(models.Export).one()
         assert export.owner_user.key == 'joe'
+        assert export.backend == 'python'
+
+    def test_valid_backend(self, req, dbsession, config, check_csrf_token):
+        """
+        It should allow the user to select the export backend
+        """
+        from datetime import date
+        import mock
+        from webob.multidict import MultiDict
+        from occams import models
+
+        blame = models.User(key=u'joe')
+        dbsession.add(blame)
+        dbsession.flush()
+
+        schema = models.Schema(
+            name=u'vitals', title=u'Vitals', publish_date=date.today())
+        dbsession.add(schema)
+        dbsession.flush()
+
+        config.testing_securitypolicy(userid='joe')
+        req.method = 'POST'
+        req.POST = MultiDict([('contents', 'vitals'), ('backend', 'copy')])
+
+        with mock.patch('occams.tasks.make_export'):
+            self._call_fut(models.ExportFactory(req), req)
+
+        export = dbsession.query(models.Export).one()
+        assert export.backend == 'copy'
+
+    def test_valid_stream(self, req, dbsession, config, check_csrf_token):
+        """
+        It should stream small checkouts instead of queueing them
+        """
+        from datetime import date
+        import csv
+        import io
+        import zipfile
+        import mock
+        from webob.multidict import MultiDict
+        from occams import models, exports
+
+        req.registry.settings['studies.export.stream_limit'] = 100
+
+        blame = models.User(key=u'joe')
+        dbsession.add(blame)
+        dbsession.flush()
+
+        schema = models.Schema(
+            name=u'vitals', title=u'Vitals', publish_date=date.today(),
+            attributes={
+                'weight': models.Attribute(
+                    name='weight', title=u'', type='string', order=0)})
+        entity = models.Entity(schema=schema, collect_date=date.today())
+        entity['weight'] = u'heavy'
+        patient = models.Patient(
+            site=models.Site(name='ucsd', title=u'UCSD'),
+            pid=u'12345',
+            entities=[entity])
+        dbsession.add_all([schema, entity, patient])
+        dbsession.flush()
+
+        config.testing_securitypolicy(userid='joe')
+        req.method = 'POST'
+        req.POST = MultiDict([('contents', 'vitals')])
+
+        # The archive is otherwise generated on a new connection, which
+        # cannot see the uncommitted data of the test
+        stream_archive = exports.stream_archive
+
+        def stream_uncommitted(connection, *args, **kw):
+            assert connection is dbsession.bind
+            return stream_archive(dbsession.connection(), *args, **kw)
+
+        with mock.patch('occams.tasks.make_export') as make_export, \
+                mock.patch('occams.exports.stream_archive',
+                           side_effect=stream_uncommitted):
+            res = self._call_fut(models.ExportFactory(req), req)
+            assert not make_export.apply_async.called
+
+        assert res.content_type == 'application/zip'
+        assert dbsession.query(models.Export).count() == 0
+
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(res.app_iter)))
+        assert sorted(archive.namelist()) == ['codebook.csv', 'vitals.csv']
+
+        with archive.open('vitals.csv') as fp:
+            rows = list(csv.DictReader(io.TextIOWrapper(fp, 'utf-8')))
+        assert len(rows) == 1
+        assert rows[0]['id'] == str(entity.id)
+        assert rows[0]['pid'] == u'12345'
+        assert rows[0]['weight'] == u'heavy'
 
     def test_exceed_limit(self, req, dbsession, config):
         """
@@ -192,6 +284,33 @@ class TestStatusJSON:
         exports = res['exports']
         assert len(exports) == 1
 
+    def test_file_size_missing(self, req, dbsession, config, tmpdir):
+        """
+        It should look up the size of archives completed without one
+        """
+        import mock
+        from occams import models
+
+        req.registry.settings['studies.export.dir'] = str(tmpdir)
+
+        blame = models.User(key=u'joe')
+        dbsession.add(blame)
+        dbsession.flush()
+        dbsession.info['blame'] = blame
+
+        export = models.Export(
+            owner_user=blame,
+            contents=[],
+            status='complete')
+        dbsession.add(export)
+        dbsession.flush()
+        tmpdir.join(export.name).write(b'data', mode='wb')
+
+        config.testing_securitypolicy(userid='joe')
+        req.redis = mock.Mock()
+        res = self._call_fut(models.ExportFactory(req), req)
+        assert res['exports'][0]['file_size'] == '4 Bytes'
+
     def test_allow_not_expired(self, req, dbsession, config):
         """
         It should include exports that are within the cutoff period
@@ -446,6 +565,31 @@ class TestCodebookDownload:
             assert isinstance(res, FileResponse)
         os.remove(name)
 
+    def test_conditional_range(self, req, dbsession, config, tmpdir):
+        """
+        It should support revalidation and partial downloads
+        """
+        from webob import Request
+        from occams.exports.codebook import FILE_NAME
+        from occams import models
+        req.registry.settings['studies.export.dir'] = str(tmpdir)
+        tmpdir.join(FILE_NAME).write_binary(b'0123456789')
+        config.testing_securitypolicy(userid='jane')
+
+        res = self._call_fut(models.ExportFactory(req), req)
+        assert res.etag
+        assert res.last_modified
+
+        partial = Request.blank('/', headers={'Range': 'bytes=2-5'}) \
+            .get_response(self._call_fut(models.ExportFactory(req), req))
+        assert partial.status_code == 206
+        assert partial.body == b'2345'
+
+        cached = Request.blank('/', headers={'If-None-Match': '"%s"' % res.etag}) \
+            .get_response(self._call_fut(models.ExportFactory(req), req))
+        assert cached.status_code == 304
+        res.app_iter.close()
+
 
 class TestDelete:
 
@@ -453,7 +597,7 @@ class TestDelete:
         from occams.views.export import delete_json as view
         return view(*args, **kw)
 
-    def test_delete(self, req, dbsession, config, check_csrf_token):
+    def test_delete(self, req, dbsession, config, check_csrf_token, tmpdir):
         """
         It should allow the owner of the export to cancel/delete the export
         """
@@ -461,6 +605,8 @@ class TestDelete:
         from pyramid.httpexceptions import HTTPOk
         from occams import models
 
+        req.registry.settings['studies.export.dir'] = str(tmpdir)
+
         blame = models.User(key=u'joe')
         dbsession.add(blame)
         dbsession.flush()
@@ -477,6 +623,7 @@ class TestDelete:
         dbsession.flush()
         export_id = export.id
         export_name = export.name
+        tmpdir.join(export_name).write(b'data', mode='wb')
         dbsession.expunge_all()
 
         config.testing_securitypolicy(userid='joe')
@@ -486,6 +633,7 @@ class TestDelete:
         assert isinstance(res, HTTPOk)
         assert dbsession.query(models.Export).get(export_id) is None
         revoke.assert_called_with(export_name)
+        assert not tmpdir.join(export_name).check()
 
 
 class TestDownload:
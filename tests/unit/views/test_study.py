@@ -963,6 +963,112 @@ class TestUploadRandomizationJson:
             assert entity in stratum.entities
             assert entity['criteria'] == 'is smart'
 
+    def test_invalid_value(self, req, dbsession, check_csrf_token):
+        """
+        It should validate values against the randomization schema
+        """
+        import tempfile
+        import csv
+        from datetime import date
+        from pyramid.httpexceptions import HTTPBadRequest
+        from occams import models
+
+        schema = models.Schema(
+            name='rand', title=u'Rand', publish_date=date.today(),
+            attributes={
+                'criteria': models.Attribute(
+                    name='criteria',
+                    title=u'Criteria',
+                    type='choice',
+                    order=0,
+                    choices={
+                        '001': models.Choice(
+                            name='001', title=u'Smart', order=0)})})
+
+        study = models.Study(
+            name=u'somestudy',
+            title=u'Some Study',
+            short_title=u'sstudy',
+            code=u'000',
+            is_randomized=True,
+            randomization_schema=schema,
+            consent_date=date.today())
+
+        dbsession.add_all([study])
+        dbsession.flush()
+
+        class DummyUpload:
+            pass
+
+        with tempfile.NamedTemporaryFile(prefix='nose-', mode='r+', suffix='.exe') as fp:
+            upload = DummyUpload()
+            upload.file = fp
+            upload.filename = fp.name
+
+            writer = csv.writer(fp)
+            writer.writerow([u'ARM', u'STRATA', u'BLOCKID', u'RANDID', u'CRITERIA'])  # noqa
+            writer.writerow([u'UCSD', u'hints', u'1234567', u'987654', u'999'])  # noqa
+            fp.flush()
+
+            req.POST = {'upload': upload}
+            with pytest.raises(HTTPBadRequest) as excinfo:
+                self._call_fut(study, req)
+
+            assert 'Invalid value' in str(excinfo.value.body)
+            assert dbsession.query(models.Entity).count() == 0
+
+    def test_blank_value(self, req, dbsession, check_csrf_token):
+        """
+        It should store blank values without validating them
+        """
+        import tempfile
+        import csv
+        from datetime import date
+        from occams import models
+
+        schema = models.Schema(
+            name='rand', title=u'Rand', publish_date=date.today(),
+            attributes={
+                'criteria': models.Attribute(
+                    name='criteria',
+                    title=u'Criteria',
+                    type='choice',
+                    order=0,
+                    choices={
+                        '001': models.Choice(
+                            name='001', title=u'Smart', order=0)})})
+
+        study = models.Study(
+            name=u'somestudy',
+            title=u'Some Study',
+            short_title=u'sstudy',
+            code=u'000',
+            is_randomized=True,
+            randomization_schema=schema,
+            consent_date=date.today())
+
+        dbsession.add_all([study])
+        dbsession.flush()
+
+        class DummyUpload:
+            pass
+
+        with tempfile.NamedTemporaryFile(prefix='nose-', mode='r+', suffix='.exe') as fp:
+            upload = DummyUpload()
+            upload.file = fp
+            upload.filename = fp.name
+
+            writer = csv.writer(fp)
+            writer.writerow([u'ARM', u'STRATA', u'BLOCKID', u'RANDID', u'CRITERIA'])  # noqa
+            writer.writerow([u'UCSD', u'hints', u'1234567', u'987654', u''])  # noqa
+            fp.flush()
+
+            req.POST = {'upload': upload}
+            self._call_fut(study, req)
+
+            entity = dbsession.query(models.Entity).one()
+            assert entity.data == {'criteria': u''}
+
     def test_duplicate_rids(self, req, dbsession, check_csrf_token):
         """
         It should fail if the upload contains repeated rids